@@ -1,8 +1,7 @@
 import os
-import json
 import asyncio
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
 import yaml
 from fastapi import FastAPI
@@ -10,19 +9,24 @@ from tenacity import RetryError
 
 from utils.logger import setup_logger
 from utils.lock import FileLock
+from utils.executor import configure as configure_executor, run_blocking, run_transfer
+from utils.jobs import JobManager, current_job, set_phase
+from utils import history
 from utils.validation import ensure_policy_defaults
 from utils.retention import cleanup_local, list_backups
 
 from supervisor_api import create_backup_full, create_backup_partial, list_backups as ha_list
 from remote_policy import fetch_remote_policy, save_cache, load_cache
 from policy_merge import merge_policy
-from storage import supabase as supabase_storage
-from storage import s3 as s3_storage
-from storage import b2 as b2_storage
+from storage.registry import PROVIDERS, get_provider
+from storage.checkpoint import UploadCheckpoint, is_stale, list_checkpoints
 
 
 app = FastAPI()
 logger = setup_logger()
+jobs = JobManager()
+# Scheduler loop and startup resume, kept referenced so they are not garbage collected mid-run.
+background_tasks: List[asyncio.Task] = []
 
 
 def read_local_cfg() -> Dict[str, Any]:
@@ -39,22 +43,22 @@ def read_local_cfg() -> Dict[str, Any]:
 
 
 async def resolve_policy() -> Dict[str, Any]:
-    local_cfg = read_local_cfg()
+    local_cfg = await run_blocking(read_local_cfg)
     if local_cfg.get("remote_config_enabled"):
         remote = await fetch_remote_policy(local_cfg.get("remote_config_endpoint", ""), local_cfg.get("client_id", ""), local_cfg.get("client_token", ""))
         if remote:
-            save_cache(remote)
+            await run_blocking(save_cache, remote)
             merged = merge_policy(local_cfg, remote)
             logger.info("policy: remote active")
             return merged
-        cache = load_cache()
+        cache = await run_blocking(load_cache)
         if cache:
             merged = merge_policy(local_cfg, cache)
             logger.warning("policy: using cached remote")
             return merged
         logger.warning("policy: fallback to local backups.yaml")
         return local_cfg
-    cache = load_cache()
+    cache = await run_blocking(load_cache)
     if cache:
         merged = merge_policy(local_cfg, cache)
         logger.info("policy: remote disabled but cache applied")
@@ -80,18 +84,15 @@ def has_free_space_gb(path: str, required_gb: int) -> bool:
         return True
 
 
-async def upload_remote(file_path: str, storage_cfg: Dict[str, Any], dest_name: str, attempts: int, backoff: int) -> str:
-    provider = storage_cfg.get("provider", "supabase")
+async def upload_remote(file_path: str, storage_cfg: Dict[str, Any], dest_name: str, attempts: int, backoff: int,
+                        part_size_mb: int = 16, concurrency: int = 4, checkpoint: Optional[UploadCheckpoint] = None) -> str:
+    concurrency = max(1, concurrency)
     last_err = None
     for i in range(attempts):
         try:
-            if provider == "supabase":
-                return supabase_storage.upload(file_path, storage_cfg.get("url", ""), storage_cfg.get("bucket", ""), storage_cfg.get("token", ""), dest_name)
-            if provider == "s3":
-                return s3_storage.upload(file_path, storage_cfg.get("bucket", ""), storage_cfg.get("access_key", ""), storage_cfg.get("secret_key", ""), storage_cfg.get("region", "us-east-1"), dest_name)
-            if provider == "b2":
-                return b2_storage.upload(file_path, storage_cfg.get("bucket", ""), storage_cfg.get("key_id", ""), storage_cfg.get("app_key", ""), dest_name)
-            raise ValueError("invalid storage provider")
+            provider = await run_blocking(get_provider, storage_cfg, max(10, concurrency))
+            return await run_transfer(provider.upload, file_path, dest_name=dest_name, part_size=max(5, part_size_mb) * 1024 * 1024,
+                                      concurrency=concurrency, checkpoint=checkpoint)
         except Exception as e:
             last_err = e
             logger.warning(f"upload attempt {i+1}/{attempts} failed: {e}")
@@ -101,11 +102,13 @@ async def upload_remote(file_path: str, storage_cfg: Dict[str, Any], dest_name:
 
 async def create_local_snapshot(policy: Dict[str, Any], manual: bool = False) -> Dict[str, Any]:
     lock = FileLock()
-    if not lock.acquire():
+    set_phase("waiting_lock")
+    if not await lock.acquire():
         return {"status": "busy"}
     try:
+        set_phase("snapshot")
         required_gb = int(policy.get("limits", {}).get("max_snapshot_size_gb", 20))
-        if not has_free_space_gb("/backup", required_gb):
+        if not await run_blocking(has_free_space_gb, "/backup", required_gb):
             logger.error("insufficient local space; not creating backup")
             return {"status": "no_space"}
         include = {}
@@ -115,7 +118,8 @@ async def create_local_snapshot(policy: Dict[str, Any], manual: bool = False) ->
         else:
             resp = await create_backup_full(name=f"NexDom Local {datetime.utcnow().isoformat()}")
         logger.info(f"local backup resp: {resp}")
-        cleanup_local(policy.get("local", {}).get("retention_days", 7))
+        set_phase("retention")
+        await run_blocking(cleanup_local, policy.get("local", {}).get("retention_days", 7))
         return resp
     finally:
         lock.release()
@@ -123,66 +127,170 @@ async def create_local_snapshot(policy: Dict[str, Any], manual: bool = False) ->
 
 async def create_remote_snapshot(policy: Dict[str, Any]) -> Dict[str, Any]:
     lock = FileLock()
-    if not lock.acquire():
+    set_phase("waiting_lock")
+    if not await lock.acquire():
         return {"status": "busy"}
     try:
+        set_phase("snapshot")
         required_gb = int(policy.get("limits", {}).get("max_snapshot_size_gb", 20))
-        if not has_free_space_gb("/backup", required_gb):
+        if not await run_blocking(has_free_space_gb, "/backup", required_gb):
             logger.error("insufficient local space; not creating backup for remote upload")
             return {"status": "no_space"}
         resp = await create_backup_full(name=f"NexDom Remote {datetime.utcnow().isoformat()}")
         logger.info(f"remote backup resp: {resp}")
-        backups = list_backups("/backup")
+        backups = await run_blocking(list_backups, "/backup")
         if not backups:
             return {"status": "no_backup"}
         latest_file = backups[0][0]
         max_gb = policy.get("limits", {}).get("max_snapshot_size_gb", 20)
-        if not max_size_ok(latest_file, max_gb):
+        if not await run_blocking(max_size_ok, latest_file, max_gb):
             logger.warning("snapshot exceeds max size, not uploading")
             return {"status": "too_large"}
         dest_name = f"{policy.get('client_id','client')}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.tar"
-        attempts = int(policy.get("limits", {}).get("retry_attempts", 3))
-        backoff = int(policy.get("limits", {}).get("retry_backoff_seconds", 30))
-        url = await upload_remote(latest_file, policy.get("storage", {}), dest_name, attempts, backoff)
+        return await upload_snapshot(policy, latest_file, dest_name)
+    finally:
+        lock.release()
+
+
+async def upload_snapshot(policy: Dict[str, Any], file_path: str, dest_name: str) -> Dict[str, Any]:
+    """Upload file_path with a checkpoint under /data/uploads, resuming an earlier attempt for the same file.
+
+    Confirmed parts are reported to the current job, if any, for progress and ETA.
+    """
+    storage_cfg = policy.get("storage", {})
+    limits = policy.get("limits", {})
+    checkpoint = await run_blocking(UploadCheckpoint.open, file_path, storage_cfg.get("provider", "supabase"), dest_name)
+    if checkpoint.upload_id:
+        logger.info(f"resuming upload of {os.path.basename(file_path)} ({len(checkpoint.parts)} parts confirmed)")
+    dest_name = checkpoint.dest_name
+    size = checkpoint.state["size"]
+    job = current_job()
+    if job is not None:
+        job.start_transfer(size)
+        checkpoint.listener = job.progress
+    url = await upload_remote(
+        file_path, storage_cfg, dest_name,
+        int(limits.get("retry_attempts", 3)), int(limits.get("retry_backoff_seconds", 30)),
+        int(limits.get("upload_part_size_mb", 16)), int(limits.get("upload_concurrency", 4)), checkpoint,
+    )
+    if job is not None:
+        job.progress(size)
+    await run_blocking(checkpoint.discard)
+    return {"status": "uploaded", "url": url, "file": os.path.basename(file_path), "dest_name": dest_name, "size_bytes": size}
+
+
+def abort_remote_upload(storage_cfg: Dict[str, Any], state: Dict[str, Any]) -> None:
+    if not state.get("upload_id") or storage_cfg.get("provider", "supabase") != state.get("provider"):
+        return
+    get_provider(storage_cfg).abort_upload(state)
+
+
+def cleanup_stale_uploads(policy: Dict[str, Any]) -> int:
+    """Abort provider sessions of stale checkpoints and orphaned multipart uploads older than upload_resume_hours."""
+    storage_cfg = policy.get("storage", {})
+    max_age = int(policy.get("limits", {}).get("upload_resume_hours", 24))
+    aborted = 0
+    keep = set()
+    for state in list_checkpoints():
+        if not is_stale(state, max_age):
+            keep.add(state.get("upload_id"))
+            continue
         try:
-            with open("/data/last_remote.json", "w") as f:
-                json.dump({
-                    "file": os.path.basename(latest_file),
-                    "dest_name": dest_name,
-                    "url": url,
-                    "size_bytes": os.path.getsize(latest_file),
-                    "created_at": datetime.utcnow().isoformat(),
-                }, f)
-        except Exception:
+            abort_remote_upload(storage_cfg, state)
+            aborted += 1
+        except Exception as e:
+            logger.warning(f"could not abort stale upload {state.get('dest_name')}: {e}")
+        try:
+            os.remove(state["path"])
+        except OSError:
             pass
-        return {"status": "uploaded", "url": url}
+    prefix = f"{policy.get('client_id','client')}-"
+    try:
+        aborted += get_provider(storage_cfg).abort_stale_uploads(prefix, max_age, keep)
+    except Exception as e:
+        logger.warning(f"stale multipart cleanup failed: {e}")
+    if aborted:
+        logger.info(f"aborted {aborted} stale uploads")
+    return aborted
+
+
+async def local_backup_job(policy: Dict[str, Any], manual: bool = False) -> Dict[str, Any]:
+    res = await create_local_snapshot(policy, manual=manual)
+    backups = await run_blocking(list_backups, "/backup")
+    if backups:
+        latest_file = backups[0][0]
+        res = dict(res, file=os.path.basename(latest_file), size_bytes=await run_blocking(os.path.getsize, latest_file))
+    return res
+
+
+async def resume_upload(policy: Dict[str, Any], state: Dict[str, Any]) -> Dict[str, Any]:
+    lock = FileLock()
+    set_phase("waiting_lock")
+    if not await lock.acquire():
+        return {"status": "busy"}
+    try:
+        return await upload_snapshot(policy, state["source"], state["dest_name"])
     finally:
         lock.release()
 
 
+async def cleanup_stale_uploads_locked(policy: Dict[str, Any], timeout: int = 5 * 60) -> Optional[int]:
+    """cleanup_stale_uploads under the backup lock, so a session that is still uploading is never aborted.
+
+    Returns None when the lock stayed busy for timeout seconds.
+    """
+    lock = FileLock(timeout=timeout)
+    if not await lock.acquire():
+        return None
+    try:
+        return await run_blocking(cleanup_stale_uploads, policy)
+    finally:
+        lock.release()
+
+
+async def resume_pending_uploads() -> None:
+    """Queue uploads interrupted by a restart, after dropping the stale ones."""
+    policy = await resolve_policy()
+    if await cleanup_stale_uploads_locked(policy) is None:
+        logger.warning("backup lock busy; stale upload cleanup skipped")
+    provider = policy.get("storage", {}).get("provider", "supabase")
+    for state in await run_blocking(list_checkpoints):
+        if state.get("provider") != provider:
+            continue
+        job = jobs.submit("remote", lambda state=state: resume_upload(policy, state))
+        logger.info(f"resuming upload of {os.path.basename(state['source'])} as job {job.id}")
+
+
 @app.post("/service/create_local_backup")
 async def svc_create_local():
     policy = await resolve_policy()
-    res = await create_local_snapshot(policy, manual=True)
-    try:
-        backups = list_backups("/backup")
-        if backups:
-            latest_file = backups[0][0]
-            with open("/data/last_local.json", "w") as f:
-                json.dump({
-                    "file": os.path.basename(latest_file),
-                    "size_bytes": os.path.getsize(latest_file),
-                    "created_at": datetime.utcnow().isoformat(),
-                }, f)
-    except Exception:
-        pass
-    return res
+    job = jobs.submit("local", lambda: local_backup_job(policy, manual=True))
+    return {"status": "queued", "job_id": job.id}
 
 
 @app.post("/service/create_remote_backup")
 async def svc_create_remote():
     policy = await resolve_policy()
-    return await create_remote_snapshot(policy)
+    job = jobs.submit("remote", lambda: create_remote_snapshot(policy))
+    return {"status": "queued", "job_id": job.id}
+
+
+@app.get("/service/jobs")
+async def svc_jobs():
+    return {"jobs": [j.to_dict() for j in reversed(jobs.jobs.values())]}
+
+
+@app.get("/service/jobs/{job_id}")
+async def svc_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return {"status": "not_found"}
+    return job.to_dict()
+
+
+@app.get("/service/history")
+async def svc_history():
+    return {"history": await run_blocking(history.load)}
 
 
 @app.post("/service/refresh_policy")
@@ -194,58 +302,30 @@ async def svc_refresh_policy():
 @app.post("/service/cleanup_local")
 async def svc_cleanup_local():
     policy = await resolve_policy()
-    count = cleanup_local(policy.get("local", {}).get("retention_days", 7))
+    count = await run_blocking(cleanup_local, policy.get("local", {}).get("retention_days", 7))
     return {"deleted": count}
 
 
 @app.post("/service/cleanup_remote")
 async def svc_cleanup_remote():
     policy = await resolve_policy()
-    provider = policy.get("storage", {}).get("provider", "supabase")
+    storage_cfg = policy.get("storage", {})
+    if storage_cfg.get("provider", "supabase") not in PROVIDERS:
+        return {"status": "unsupported"}
+    # Fail fast instead of waiting: an upload holding the lock may run for hours.
+    if await cleanup_stale_uploads_locked(policy, timeout=0) is None:
+        return {"status": "busy"}
     retention_weeks = policy.get("remote", {}).get("retention_weeks", 8)
     prefix = f"{policy.get('client_id','client')}-"
-    if provider == "supabase":
-        url = policy["storage"].get("url", "")
-        bucket = policy["storage"].get("bucket", "")
-        token = policy["storage"].get("token", "")
-        objs = supabase_storage.list_objects(url, bucket, token, prefix=prefix)
-        ours = objs
-        sorted_objs = sorted(ours, key=lambda o: o.get("updated_at", ""), reverse=True)
-        to_delete = [o["name"] for o in sorted_objs[retention_weeks:]]
-        supabase_storage.delete_objects(url, bucket, token, to_delete)
-        return {"deleted": len(to_delete)}
-    if provider == "s3":
-        bucket = policy["storage"].get("bucket", "")
-        access_key = policy["storage"].get("access_key", "")
-        secret_key = policy["storage"].get("secret_key", "")
-        region = policy["storage"].get("region", "us-east-1")
-        objs = s3_storage.list_objects(bucket, access_key, secret_key, region, prefix=prefix)
-        ours = objs
-        sorted_objs = sorted(ours, key=lambda o: o.get("updated_at", ""), reverse=True)
-        to_delete = [o["name"] for o in sorted_objs[retention_weeks:]]
-        s3_storage.delete_objects(bucket, access_key, secret_key, region, to_delete)
-        return {"deleted": len(to_delete)}
-    if provider == "b2":
-        bucket = policy["storage"].get("bucket", "")
-        key_id = policy["storage"].get("key_id", "")
-        app_key = policy["storage"].get("app_key", "")
-        objs = b2_storage.list_objects(bucket, key_id, app_key, prefix=prefix)
-        ours = objs
-        sorted_objs = sorted(ours, key=lambda o: o.get("updated_at", 0), reverse=True)
-        to_delete = [o["name"] for o in sorted_objs[retention_weeks:]]
-        b2_storage.delete_objects(bucket, key_id, app_key, to_delete)
-        return {"deleted": len(to_delete)}
-    return {"status": "unsupported"}
+    provider = await run_blocking(get_provider, storage_cfg)
+    to_delete = await run_blocking(provider.expired_objects, prefix, retention_weeks)
+    await run_blocking(provider.delete_objects, to_delete)
+    return {"deleted": len(to_delete)}
 
 
-@app.get("/service/status")
-async def svc_status():
-    policy = await resolve_policy()
-    ha_backups = await ha_list()
+def read_local_status() -> Dict[str, Any]:
     local_latest = list_backups("/backup")
     status = {
-        "policy": policy,
-        "ha_backups": ha_backups,
         "local_latest": local_latest[0][0] if local_latest else None,
         "local_latest_size": os.path.getsize(local_latest[0][0]) if local_latest else None,
     }
@@ -258,23 +338,28 @@ async def svc_status():
                 status["errors"] = errs[-10:]
     except Exception:
         pass
-    try:
-        if os.path.exists("/data/last_local.json"):
-            with open("/data/last_local.json") as f:
-                status["last_local"] = json.load(f)
-        if os.path.exists("/data/last_remote.json"):
-            with open("/data/last_remote.json") as f:
-                status["last_remote"] = json.load(f)
-    except Exception:
-        pass
+    status["last_local"] = history.latest("local")
+    status["last_remote"] = history.latest("remote")
+    return status
+
+
+@app.get("/service/status")
+async def svc_status():
+    policy = await resolve_policy()
+    ha_backups = await ha_list()
+    status = {"policy": policy, "ha_backups": ha_backups, "jobs": [j.to_dict() for j in jobs.active()]}
+    status.update(await run_blocking(read_local_status))
     return status
 
 
 @app.on_event("startup")
 async def startup_event():
+    limits = read_local_cfg().get("limits", {})
+    configure_executor(int(limits.get("blocking_workers", 4)))
     try:
         from scheduler import start_background
-        await start_background()
+        background_tasks.append(await start_background())
         logger.info("scheduler started")
+        background_tasks.append(asyncio.create_task(resume_pending_uploads()))
     except Exception as e:
         logger.error(f"scheduler start failed: {e}")
\ No newline at end of file
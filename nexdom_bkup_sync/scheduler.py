@@ -4,7 +4,7 @@ from datetime import datetime, time
 from typing import Dict, Any
 
 from utils.logger import setup_logger
-from backup import resolve_policy, create_local_snapshot, create_remote_snapshot
+from backup import resolve_policy, jobs, local_backup_job, create_remote_snapshot
 
 
 logger = setup_logger()
@@ -26,8 +26,8 @@ async def scheduler_loop():
             t = parse_hhmm(policy["local"].get("time", "03:00"))
             if now.time().hour == t.hour and now.time().minute == t.minute:
                 if not last_local or (now.date() != last_local.date()):
-                    logger.info("scheduled local backup")
-                    await create_local_snapshot(policy)
+                    job = jobs.submit("local", lambda policy=policy: local_backup_job(policy))
+                    logger.info(f"scheduled local backup: job {job.id}")
                     last_local = now
         # Remote weekly
         if policy.get("remote", {}).get("enabled", True):
@@ -35,11 +35,11 @@ async def scheduler_loop():
             weekday = policy["remote"].get("day", "sunday").lower()
             if now.strftime("%A").lower() == weekday and now.time().hour == t.hour and now.time().minute == t.minute:
                 if not last_remote or (now.isocalendar() != last_remote.isocalendar()):
-                    logger.info("scheduled remote backup")
-                    await create_remote_snapshot(policy)
+                    job = jobs.submit("remote", lambda policy=policy: create_remote_snapshot(policy))
+                    logger.info(f"scheduled remote backup: job {job.id}")
                     last_remote = now
         await asyncio.sleep(30)
 
 
-async def start_background():
-    asyncio.create_task(scheduler_loop())
\ No newline at end of file
+async def start_background() -> asyncio.Task:
+    return asyncio.create_task(scheduler_loop())
\ No newline at end of file
@@ -1,36 +1,108 @@
+import hashlib
+import io
 import os
+import time
 from b2sdk.v2 import InMemoryAccountInfo, B2Api, UploadSourceLocalFile
-from typing import Optional, List
-
-
-def upload(file_path: str, bucket_name: str, key_id: str, app_key: str, dest_name: Optional[str] = None) -> str:
-    info = InMemoryAccountInfo()
-    b2_api = B2Api(info)
-    b2_api.authorize_account("production", key_id, app_key)
-    bucket = b2_api.get_bucket_by_name(bucket_name)
-    name = dest_name or os.path.basename(file_path)
-    bucket.upload(UploadSourceLocalFile(file_path), name, content_type="application/x-tar")
-    return f"b2://{bucket_name}/{name}"
-
-
-def list_objects(bucket_name: str, key_id: str, app_key: str, prefix: str = "") -> List[dict]:
-    info = InMemoryAccountInfo()
-    b2_api = B2Api(info)
-    b2_api.authorize_account("production", key_id, app_key)
-    bucket = b2_api.get_bucket_by_name(bucket_name)
-    items: List[dict] = []
-    for f in bucket.ls(prefix=prefix):
-        items.append({"name": f.file_name, "updated_at": f.upload_timestamp})
-    return items
-
-
-def delete_objects(bucket_name: str, key_id: str, app_key: str, names: List[str]) -> None:
-    info = InMemoryAccountInfo()
-    b2_api = B2Api(info)
-    b2_api.authorize_account("production", key_id, app_key)
-    bucket = b2_api.get_bucket_by_name(bucket_name)
-    for n in names:
+from b2sdk.v2.exception import B2Error, BadRequest, FileNotPresent
+from typing import Any, Optional, List, Dict, Set
+
+from storage.base import StorageProvider
+from storage.checkpoint import UploadCheckpoint
+from storage.chunked import DEFAULT_CONCURRENCY, DEFAULT_PART_SIZE, plan_parts, upload_parts
+
+
+# B2 account authorization tokens last 24 hours; renew ahead of that.
+TOKEN_LIFETIME = 23 * 3600
+
+
+def confirmed_parts(session, file_id: str) -> Optional[Dict[int, str]]:
+    """Parts B2 already holds for an unfinished large file, or None when it no longer exists.
+
+    list_parts only takes the file id, so a not-found or bad-request answer
+    means the large file was finished, cancelled or expired. Any other error
+    (auth, network, server) is raised so the upload is retried, not restarted.
+    """
+    parts: Dict[int, str] = {}
+    start = 1
+    try:
+        while start:
+            page = session.list_parts(file_id, start, 1000)
+            for p in page.get("parts", []):
+                parts[p["partNumber"]] = p["contentSha1"]
+            start = page.get("nextPartNumber")
+    except (FileNotPresent, BadRequest):
+        return None
+    return parts
+
+
+class B2Provider(StorageProvider):
+    name = "b2"
+    credential_keys = ("bucket", "key_id", "app_key")
+
+    def authorize(self) -> None:
+        b2_api = B2Api(InMemoryAccountInfo())
+        b2_api.authorize_account("production", self.cfg.get("key_id", ""), self.cfg.get("app_key", ""))
+        self.bucket_name = self.cfg.get("bucket", "")
+        self.bucket = b2_api.get_bucket_by_name(self.bucket_name)
+        self.b2_api = b2_api
+        self.expires_at = time.time() + TOKEN_LIFETIME
+
+    def upload(self, file_path: str, dest_name: Optional[str] = None, part_size: int = DEFAULT_PART_SIZE,
+               concurrency: int = DEFAULT_CONCURRENCY, checkpoint: Optional[UploadCheckpoint] = None) -> str:
+        bucket, bucket_name = self.bucket, self.bucket_name
+        name = dest_name or os.path.basename(file_path)
+        session = self.b2_api.session
+        done: Dict[int, str] = {}
+        file_id = None
+        if checkpoint is not None and checkpoint.upload_id:
+            confirmed = confirmed_parts(session, checkpoint.upload_id)
+            if confirmed is not None:
+                file_id, part_size, done = checkpoint.upload_id, checkpoint.part_size, confirmed
+                checkpoint.set_parts(done)
+        parts = plan_parts(os.path.getsize(file_path), part_size)
+        if file_id is None:
+            if len(parts) == 1:
+                bucket.upload(UploadSourceLocalFile(file_path), name, content_type="application/x-tar")
+                return f"b2://{bucket_name}/{name}"
+            file_id = session.start_large_file(bucket.id_, name, "application/x-tar", {})["fileId"]
+            if checkpoint is not None:
+                checkpoint.start(file_id, parts[0][2])
+
+        def send(number: int, data: bytes) -> str:
+            sha1 = hashlib.sha1(data).hexdigest()
+            session.upload_part(file_id, number, len(data), sha1, io.BytesIO(data))
+            return sha1
+
+        sha1s = upload_parts(file_path, parts, concurrency, send, done=done,
+                             on_part=checkpoint.add_part if checkpoint is not None else None)
+        session.finish_large_file(file_id, [sha1s[n] for n in sorted(sha1s)])
+        return f"b2://{bucket_name}/{name}"
+
+    def abort_upload(self, state: Dict[str, Any]) -> None:
         try:
-            bucket.delete_file_version(n, None)
-        except Exception:
-            pass
\ No newline at end of file
+            self.b2_api.cancel_large_file(state["upload_id"])
+        except B2Error:
+            pass
+
+    def abort_stale_uploads(self, prefix: str, max_age_hours: int, keep: Set[str]) -> int:
+        threshold = (time.time() - max_age_hours * 3600) * 1000
+        aborted = 0
+        for f in self.bucket.list_unfinished_large_files(prefix=prefix):
+            if f.file_id in keep or f.upload_timestamp > threshold:
+                continue
+            self.b2_api.cancel_large_file(f.file_id)
+            aborted += 1
+        return aborted
+
+    def list_objects(self, prefix: str = "") -> List[dict]:
+        items: List[dict] = []
+        for f in self.bucket.ls(prefix=prefix):
+            items.append({"name": f.file_name, "updated_at": f.upload_timestamp})
+        return items
+
+    def delete_objects(self, names: List[str]) -> None:
+        for n in names:
+            try:
+                self.bucket.delete_file_version(n, None)
+            except Exception:
+                pass
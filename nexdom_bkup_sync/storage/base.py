@@ -0,0 +1,61 @@
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from storage.checkpoint import UploadCheckpoint
+from storage.chunked import DEFAULT_CONCURRENCY, DEFAULT_PART_SIZE
+
+
+class StorageProvider:
+    """Authorized client for one storage backend and credential set.
+
+    Instances are built and cached by storage.registry, so the SDK client, its
+    connection pool and any session token are shared by every call with the
+    same credentials. Subclasses whose token expires set expires_at in
+    authorize(); the registry calls authorize() again once it has passed.
+    """
+
+    name = ""
+    credential_keys: Tuple[str, ...] = ()
+
+    def __init__(self, cfg: Dict[str, Any], pool_size: int = 10):
+        self.cfg = cfg
+        self.pool_size = pool_size
+        self.expires_at: Optional[float] = None
+        self.authorize()
+
+    @classmethod
+    def credentials(cls, cfg: Dict[str, Any]) -> Tuple[Any, ...]:
+        return tuple(cfg.get(k, "") for k in cls.credential_keys)
+
+    def authorize(self) -> None:
+        pass
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    def close(self) -> None:
+        """Release the client's connection pool; called by the registry when it replaces this provider."""
+
+    def upload(self, file_path: str, dest_name: Optional[str] = None, part_size: int = DEFAULT_PART_SIZE,
+               concurrency: int = DEFAULT_CONCURRENCY, checkpoint: Optional[UploadCheckpoint] = None) -> str:
+        raise NotImplementedError
+
+    def abort_upload(self, state: Dict[str, Any]) -> None:
+        """Abort the provider session recorded in a checkpoint state."""
+        raise NotImplementedError
+
+    def abort_stale_uploads(self, prefix: str, max_age_hours: int, keep: Set[str]) -> int:
+        """Abort unfinished uploads under prefix older than max_age_hours, except the ids in keep."""
+        return 0
+
+    def list_objects(self, prefix: str = "") -> List[dict]:
+        raise NotImplementedError
+
+    def delete_objects(self, names: List[str]) -> None:
+        raise NotImplementedError
+
+    def expired_objects(self, prefix: str, keep: int) -> List[str]:
+        """Names under prefix beyond the `keep` most recently updated."""
+        objs = self.list_objects(prefix)
+        objs.sort(key=lambda o: (o.get("updated_at") is not None, o.get("updated_at") or 0), reverse=True)
+        return [o["name"] for o in objs[keep:]]
@@ -0,0 +1,126 @@
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+CHECKPOINT_DIR = "/data/uploads"
+
+
+class UploadCheckpoint:
+    """On-disk progress of one chunked upload: provider session id plus every confirmed part.
+
+    Saved after each part, so a retry or an add-on restart resumes from the
+    last confirmed part instead of byte zero. A checkpoint only applies while
+    the source file keeps the same size and mtime.
+    """
+
+    def __init__(self, source: str, provider: str, dest_name: str, directory: str = CHECKPOINT_DIR):
+        self.path = os.path.join(directory, os.path.basename(source) + ".json")
+        st = os.stat(source)
+        self.state: Dict[str, Any] = {
+            "provider": provider,
+            "source": source,
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "dest_name": dest_name,
+            "upload_id": None,
+            "part_size": None,
+            "parts": {},
+            "created_at": time.time(),
+        }
+        # Called with confirmed_bytes after every save; runs in the uploading thread.
+        self.listener: Optional[Callable[[int], None]] = None
+
+    @classmethod
+    def open(cls, source: str, provider: str, dest_name: str, directory: str = CHECKPOINT_DIR) -> "UploadCheckpoint":
+        """Load the checkpoint for source if it is still valid, otherwise start an empty one."""
+        cp = cls(source, provider, dest_name, directory)
+        saved = read_state(cp.path)
+        if saved and all(saved.get(k) == cp.state[k] for k in ("provider", "source", "size", "mtime")):
+            cp.state = saved
+        return cp
+
+    @property
+    def dest_name(self) -> str:
+        return self.state["dest_name"]
+
+    @property
+    def upload_id(self) -> Optional[str]:
+        return self.state.get("upload_id")
+
+    @property
+    def part_size(self) -> Optional[int]:
+        return self.state.get("part_size")
+
+    @property
+    def parts(self) -> Dict[int, Any]:
+        return {int(n): r for n, r in self.state["parts"].items()}
+
+    @property
+    def confirmed_bytes(self) -> int:
+        if not self.part_size:
+            return 0
+        return min(len(self.state["parts"]) * self.part_size, self.state["size"])
+
+    def start(self, upload_id: str, part_size: int):
+        self.state.update(upload_id=upload_id, part_size=part_size, parts={}, created_at=time.time())
+        self.save()
+
+    def set_parts(self, parts: Dict[int, Any]):
+        self.state["parts"] = {str(n): r for n, r in parts.items()}
+        self.save()
+
+    def add_part(self, number: int, result: Any):
+        self.state["parts"][str(number)] = result
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+        if self.listener is not None:
+            self.listener(self.confirmed_bytes)
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def read_state(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def list_checkpoints(directory: str = CHECKPOINT_DIR) -> List[Dict[str, Any]]:
+    """Saved checkpoint states, each with its file path under `path`."""
+    items = []
+    if not os.path.isdir(directory):
+        return items
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(directory, name)
+        state = read_state(path)
+        if state:
+            state["path"] = path
+            items.append(state)
+    return items
+
+
+def is_stale(state: Dict[str, Any], max_age_hours: int) -> bool:
+    """True when the source changed or vanished, or the session is older than max_age_hours."""
+    try:
+        st = os.stat(state.get("source", ""))
+    except OSError:
+        return True
+    if st.st_size != state.get("size") or st.st_mtime != state.get("mtime"):
+        return True
+    return time.time() - state.get("created_at", 0) > max_age_hours * 3600
@@ -0,0 +1,92 @@
+import math
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+DEFAULT_CONCURRENCY = 4
+
+Part = Tuple[int, int, int]
+
+
+def plan_parts(size: int, part_size: int, max_parts: Optional[int] = MAX_PARTS) -> List[Part]:
+    """Split size bytes into (part_number, offset, length), part numbers starting at 1.
+
+    part_size is raised to the provider minimum and, when max_parts is set,
+    until the file fits in max_parts parts.
+    """
+    part_size = max(part_size, MIN_PART_SIZE)
+    if max_parts:
+        part_size = max(part_size, math.ceil(size / max_parts))
+    parts = []
+    offset = 0
+    number = 1
+    while offset < size or number == 1:
+        length = min(part_size, size - offset)
+        parts.append((number, offset, length))
+        offset += length
+        number += 1
+    return parts
+
+
+def read_part(path: str, offset: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def upload_parts(path: str, parts: List[Part], concurrency: int, send: Callable[[int, bytes], Any],
+                 done: Optional[Dict[int, Any]] = None, on_part: Optional[Callable[[int, Any], None]] = None) -> Dict[int, Any]:
+    """Call send(part_number, data) for every part with at most `concurrency` parts in flight.
+
+    Each worker reads its own part right before sending it, so memory stays
+    at concurrency * part_size whatever the file size. Parts already in
+    `done` are skipped, and on_part(number, result) runs in the calling
+    thread as each part completes (used for checkpoints). Returns the send()
+    results by part number; the first failure cancels the parts not yet
+    started and is re-raised.
+    """
+    concurrency = max(1, concurrency)
+    results: Dict[int, Any] = dict(done or {})
+
+    def collect(futures) -> Optional[BaseException]:
+        error = None
+        for fut in futures:
+            if fut.cancelled():
+                continue
+            try:
+                number, result = fut.result()
+            except BaseException as e:
+                error = error or e
+                continue
+            results[number] = result
+            if on_part is not None:
+                on_part(number, result)
+        return error
+
+    def run(part: Part) -> Tuple[int, Any]:
+        number, offset, length = part
+        return number, send(number, read_part(path, offset, length))
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="upload") as pool:
+        pending = set()
+        error = None
+        for part in parts:
+            if part[0] in results:
+                continue
+            if len(pending) >= concurrency:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                error = collect(finished)
+                if error is not None:
+                    break
+            pending.add(pool.submit(run, part))
+        if error is not None:
+            for fut in pending:
+                fut.cancel()
+        # Parts still in flight are kept even after a failure so a resume does not resend them.
+        error = collect(wait(pending).done) or error
+        if error is not None:
+            raise error
+    return results
@@ -0,0 +1,55 @@
+import threading
+from typing import Any, Dict, Tuple, Type
+
+from storage.base import StorageProvider
+from storage.b2 import B2Provider
+from storage.s3 import S3Provider
+from storage.supabase import SupabaseProvider
+from utils.logger import setup_logger
+
+
+PROVIDERS: Dict[str, Type[StorageProvider]] = {p.name: p for p in (SupabaseProvider, S3Provider, B2Provider)}
+
+_providers: Dict[Tuple[Any, ...], StorageProvider] = {}
+_lock = threading.Lock()
+
+logger = setup_logger()
+
+
+def get_provider(storage_cfg: Dict[str, Any], pool_size: int = 10) -> StorageProvider:
+    """Cached, authorized provider for storage_cfg's credentials.
+
+    A provider is rebuilt when a larger connection pool is asked for and
+    re-authorized once its token has expired. Building one closes and drops
+    the cached providers of the same kind, so a pool rebuild or a credential
+    change does not leak the old client. Blocking: call through run_blocking
+    from async code.
+    """
+    cls = PROVIDERS.get(storage_cfg.get("provider", "supabase"))
+    if cls is None:
+        raise ValueError("invalid storage provider")
+    key = (cls.name,) + cls.credentials(storage_cfg)
+    with _lock:
+        provider = _providers.get(key)
+        if provider is None or provider.pool_size < pool_size:
+            provider = cls(storage_cfg, max(pool_size, provider.pool_size if provider else 0))
+            for old_key in [k for k in _providers if k[0] == cls.name]:
+                close(_providers.pop(old_key))
+            _providers[key] = provider
+        elif provider.expired():
+            provider.authorize()
+        return provider
+
+
+def close(provider: StorageProvider) -> None:
+    try:
+        provider.close()
+    except Exception as e:
+        logger.warning(f"closing {provider.name} provider failed: {e}")
+
+
+def clear() -> None:
+    with _lock:
+        for provider in _providers.values():
+            close(provider)
+        _providers.clear()
@@ -1,28 +1,98 @@
 import os
+from datetime import datetime, timedelta, timezone
 import boto3
-from typing import Optional, List
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from typing import Any, Optional, List, Dict, Set
 
+from storage.base import StorageProvider
+from storage.checkpoint import UploadCheckpoint
+from storage.chunked import DEFAULT_CONCURRENCY, DEFAULT_PART_SIZE, plan_parts, upload_parts
 
-def upload(file_path: str, bucket: str, access_key: str, secret_key: str, region: str = "us-east-1", dest_name: Optional[str] = None) -> str:
-    name = dest_name or os.path.basename(file_path)
-    s3 = boto3.client("s3", aws_access_key_id=access_key, aws_secret_access_key=secret_key, region_name=region)
-    s3.upload_file(file_path, bucket, name, ExtraArgs={"ContentType": "application/x-tar"})
-    return f"s3://{bucket}/{name}"
 
+def confirmed_parts(s3, bucket: str, name: str, upload_id: str) -> Optional[Dict[int, str]]:
+    """Parts S3 already holds for upload_id, or None when the upload no longer exists."""
+    parts: Dict[int, str] = {}
+    try:
+        for page in s3.get_paginator("list_parts").paginate(Bucket=bucket, Key=name, UploadId=upload_id):
+            for p in page.get("Parts", []) or []:
+                parts[p["PartNumber"]] = p["ETag"]
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "NoSuchUpload":
+            return None
+        raise
+    return parts
 
-def list_objects(bucket: str, access_key: str, secret_key: str, region: str = "us-east-1", prefix: str = "") -> List[dict]:
-    s3 = boto3.client("s3", aws_access_key_id=access_key, aws_secret_access_key=secret_key, region_name=region)
-    paginator = s3.get_paginator("list_objects_v2")
-    items: List[dict] = []
-    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-        for o in page.get("Contents", []) or []:
-            items.append({"name": o["Key"], "updated_at": o.get("LastModified")})
-    return items
 
+class S3Provider(StorageProvider):
+    name = "s3"
+    credential_keys = ("bucket", "access_key", "secret_key", "region")
 
-def delete_objects(bucket: str, access_key: str, secret_key: str, region: str, names: List[str]) -> None:
-    if not names:
-        return
-    s3 = boto3.client("s3", aws_access_key_id=access_key, aws_secret_access_key=secret_key, region_name=region)
-    objs = [{"Key": n} for n in names]
-    s3.delete_objects(Bucket=bucket, Delete={"Objects": objs})
\ No newline at end of file
+    def authorize(self) -> None:
+        # boto3 clients are thread-safe; one client (and its urllib3 pool) serves every upload worker.
+        self.bucket = self.cfg.get("bucket", "")
+        self.s3 = boto3.client("s3", aws_access_key_id=self.cfg.get("access_key", ""),
+                               aws_secret_access_key=self.cfg.get("secret_key", ""),
+                               region_name=self.cfg.get("region", "us-east-1"),
+                               config=Config(max_pool_connections=self.pool_size))
+
+    def close(self) -> None:
+        self.s3.close()
+
+    def upload(self, file_path: str, dest_name: Optional[str] = None, part_size: int = DEFAULT_PART_SIZE,
+               concurrency: int = DEFAULT_CONCURRENCY, checkpoint: Optional[UploadCheckpoint] = None) -> str:
+        s3, bucket = self.s3, self.bucket
+        name = dest_name or os.path.basename(file_path)
+        done: Dict[int, str] = {}
+        upload_id = None
+        if checkpoint is not None and checkpoint.upload_id:
+            confirmed = confirmed_parts(s3, bucket, name, checkpoint.upload_id)
+            if confirmed is not None:
+                upload_id, part_size, done = checkpoint.upload_id, checkpoint.part_size, confirmed
+                checkpoint.set_parts(done)
+        parts = plan_parts(os.path.getsize(file_path), part_size)
+        if upload_id is None:
+            if len(parts) == 1:
+                with open(file_path, "rb") as f:
+                    s3.put_object(Bucket=bucket, Key=name, Body=f, ContentType="application/x-tar")
+                return f"s3://{bucket}/{name}"
+            upload_id = s3.create_multipart_upload(Bucket=bucket, Key=name, ContentType="application/x-tar")["UploadId"]
+            if checkpoint is not None:
+                checkpoint.start(upload_id, parts[0][2])
+        etags = upload_parts(file_path, parts, concurrency, lambda n, data: s3.upload_part(
+            Bucket=bucket, Key=name, UploadId=upload_id, PartNumber=n, Body=data)["ETag"],
+            done=done, on_part=checkpoint.add_part if checkpoint is not None else None)
+        s3.complete_multipart_upload(Bucket=bucket, Key=name, UploadId=upload_id, MultipartUpload={
+            "Parts": [{"ETag": etags[n], "PartNumber": n} for n in sorted(etags)]})
+        return f"s3://{bucket}/{name}"
+
+    def abort_upload(self, state: Dict[str, Any]) -> None:
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=state.get("dest_name", ""), UploadId=state["upload_id"])
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "NoSuchUpload":
+                raise
+
+    def abort_stale_uploads(self, prefix: str, max_age_hours: int, keep: Set[str]) -> int:
+        threshold = datetime.now(timezone.utc) - timedelta(hours=max_age_hours)
+        aborted = 0
+        for page in self.s3.get_paginator("list_multipart_uploads").paginate(Bucket=self.bucket, Prefix=prefix):
+            for u in page.get("Uploads", []) or []:
+                if u["UploadId"] in keep or u["Initiated"] > threshold:
+                    continue
+                self.s3.abort_multipart_upload(Bucket=self.bucket, Key=u["Key"], UploadId=u["UploadId"])
+                aborted += 1
+        return aborted
+
+    def list_objects(self, prefix: str = "") -> List[dict]:
+        items: List[dict] = []
+        for page in self.s3.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix):
+            for o in page.get("Contents", []) or []:
+                items.append({"name": o["Key"], "updated_at": o.get("LastModified")})
+        return items
+
+    def delete_objects(self, names: List[str]) -> None:
+        # DeleteObjects takes at most 1000 keys per request.
+        for i in range(0, len(names), 1000):
+            objs = [{"Key": n} for n in names[i:i + 1000]]
+            self.s3.delete_objects(Bucket=self.bucket, Delete={"Objects": objs})
@@ -1,23 +1,120 @@
+import base64
 import os
-from typing import Optional
+from typing import Any, Dict, Optional
+import httpx
 from supabase import create_client
 from typing import List
 
+from storage.base import StorageProvider
+from storage.checkpoint import UploadCheckpoint
+from storage.chunked import plan_parts, upload_parts
 
-def upload(file_path: str, url: str, bucket: str, token: str, dest_name: Optional[str] = None) -> str:
-    client = create_client(url, token)
-    name = dest_name or os.path.basename(file_path)
-    with open(file_path, "rb") as f:
-        client.storage.from_(bucket).upload(name, f, {"content-type": "application/x-tar"})
-    return f"{url}/storage/v1/object/public/{bucket}/{name}"
 
+# Supabase's TUS endpoint only accepts 6 MB chunks (the last one may be shorter).
+TUS_CHUNK_SIZE = 6 * 1024 * 1024
 
-def list_objects(url: str, bucket: str, token: str, prefix: str) -> List[dict]:
-    client = create_client(url, token)
-    return client.storage.from_(bucket).list(path="", search=prefix)
 
+def tus_request(http: httpx.Client, method: str, url: str, headers: Dict[str, str], data: Optional[bytes] = None,
+                timeout: int = 120) -> httpx.Headers:
+    resp = http.request(method, url, content=data, headers={"Tus-Resumable": "1.0.0", **headers}, timeout=timeout)
+    resp.raise_for_status()
+    return resp.headers
 
-def delete_objects(url: str, bucket: str, token: str, names: List[str]) -> None:
-    client = create_client(url, token)
-    for n in names:
-        client.storage.from_(bucket).remove(n)
\ No newline at end of file
+
+def auth_headers(token: str) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {token}", "apikey": token}
+
+
+def gone(e: httpx.HTTPStatusError) -> bool:
+    return e.response.status_code in (403, 404, 410)
+
+
+def confirmed_offset(http: httpx.Client, location: str, token: str) -> Optional[int]:
+    """Bytes the server already holds for a TUS upload, or None when it expired or is unknown."""
+    try:
+        return int(tus_request(http, "HEAD", location, auth_headers(token))["Upload-Offset"])
+    except httpx.HTTPStatusError as e:
+        if gone(e):
+            return None
+        raise
+
+
+class SupabaseProvider(StorageProvider):
+    name = "supabase"
+    credential_keys = ("url", "bucket", "token")
+
+    def authorize(self) -> None:
+        self.url = self.cfg.get("url", "")
+        self.bucket = self.cfg.get("bucket", "")
+        self.token = self.cfg.get("token", "")
+        self.client = create_client(self.url, self.token)
+        # One keep-alive session (httpx ships with the supabase SDK) for every TUS request of this provider.
+        if getattr(self, "http", None) is None:
+            self.http = httpx.Client(limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size))
+
+    def upload(self, file_path: str, dest_name: Optional[str] = None, checkpoint: Optional[UploadCheckpoint] = None, **_) -> str:
+        """Upload through the resumable (TUS) endpoint in fixed 6 MB chunks.
+
+        TUS appends at a single offset, so chunks are sent one after another;
+        part size and concurrency options do not apply to this provider.
+        """
+        url, bucket, token, http = self.url, self.bucket, self.token, self.http
+        name = dest_name or os.path.basename(file_path)
+        size = os.path.getsize(file_path)
+        auth = auth_headers(token)
+        parts = plan_parts(size, TUS_CHUNK_SIZE, max_parts=None)
+        offsets = {n: offset for n, offset, _ in parts}
+        location = None
+        done: Dict[int, int] = {}
+        resume_at = 0
+        if checkpoint is not None and checkpoint.upload_id:
+            offset = confirmed_offset(http, checkpoint.upload_id, token)
+            if offset is not None:
+                location, resume_at = checkpoint.upload_id, offset
+                done = {n: o + length for n, o, length in parts if o + length <= offset}
+                checkpoint.set_parts(done)
+        if location is None:
+            metadata = {"bucketName": bucket, "objectName": name, "contentType": "application/x-tar"}
+            created = tus_request(http, "POST", f"{url}/storage/v1/upload/resumable", {
+                **auth,
+                "Upload-Length": str(size),
+                "Upload-Metadata": ",".join(f"{k} {base64.b64encode(v.encode()).decode()}" for k, v in metadata.items()),
+                "x-upsert": "true",
+            })
+            location = created["Location"]
+            if checkpoint is not None:
+                checkpoint.start(location, TUS_CHUNK_SIZE)
+
+        def send(number: int, data: bytes) -> int:
+            start = offsets[number]
+            # The server may hold part of this chunk; TUS only accepts a PATCH at its exact offset.
+            if start < resume_at:
+                data = data[resume_at - start:]
+                start = resume_at
+            headers = tus_request(http, "PATCH", location, {
+                **auth,
+                "Upload-Offset": str(start),
+                "Content-Type": "application/offset+octet-stream",
+            }, data)
+            return int(headers["Upload-Offset"])
+
+        upload_parts(file_path, parts, 1, send, done=done, on_part=checkpoint.add_part if checkpoint is not None else None)
+        return f"{url}/storage/v1/object/public/{bucket}/{name}"
+
+    def close(self) -> None:
+        self.http.close()
+
+    def abort_upload(self, state: Dict[str, Any]) -> None:
+        """Terminate a TUS upload; the server also expires unfinished uploads on its own."""
+        try:
+            tus_request(self.http, "DELETE", state["upload_id"], auth_headers(self.token))
+        except httpx.HTTPStatusError as e:
+            if not gone(e):
+                raise
+
+    def list_objects(self, prefix: str = "") -> List[dict]:
+        return self.client.storage.from_(self.bucket).list(path="", search=prefix)
+
+    def delete_objects(self, names: List[str]) -> None:
+        if names:
+            self.client.storage.from_(self.bucket).remove(names)
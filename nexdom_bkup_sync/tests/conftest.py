@@ -0,0 +1,48 @@
+import importlib
+import logging
+import pathlib
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+# setup_logger() returns early for a logger that already has handlers, so nothing is written to /data/logs.
+logging.getLogger("nexdom_backup").addHandler(logging.NullHandler())
+
+
+def _stub(name, **attrs):
+    """Placeholder for an SDK missing from the test environment; only what the provider modules import."""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+        return module
+
+
+class _B2Error(Exception):
+    pass
+
+
+_stub("boto3", client=None)
+_stub("botocore")
+_stub("botocore.config", Config=object)
+_stub("botocore.exceptions", ClientError=type("ClientError", (Exception,), {}))
+_stub("b2sdk")
+_stub("b2sdk.v2", InMemoryAccountInfo=object, B2Api=object, UploadSourceLocalFile=object)
+_stub("b2sdk.v2.exception", B2Error=_B2Error, BadRequest=type("BadRequest", (_B2Error,), {}),
+      FileNotPresent=type("FileNotPresent", (_B2Error,), {}))
+_stub("httpx", Client=object, Limits=object, Headers=dict, HTTPStatusError=type("HTTPStatusError", (Exception,), {}))
+_stub("supabase", create_client=None)
+
+
+@pytest.fixture
+def make_file(tmp_path):
+    def _make(size, name="backup.tar"):
+        path = tmp_path / name
+        path.write_bytes(bytes(i % 251 for i in range(size)))
+        return str(path)
+    return _make
@@ -0,0 +1,47 @@
+import os
+import time
+from storage.checkpoint import UploadCheckpoint, is_stale, list_checkpoints
+
+def test_checkpoint_resumes_same_file(make_file, tmp_path):
+    src = make_file(100)
+    cp = UploadCheckpoint.open(src, "s3", "c-1.tar", str(tmp_path / "uploads"))
+    cp.start("upload-1", 40)
+    cp.add_part(1, "etag1")
+    again = UploadCheckpoint.open(src, "s3", "c-2.tar", str(tmp_path / "uploads"))
+    assert (again.upload_id, again.part_size, again.parts, again.dest_name) == ("upload-1", 40, {1: "etag1"}, "c-1.tar")
+
+def test_checkpoint_invalid_after_source_or_provider_change(make_file, tmp_path):
+    src = make_file(100)
+    cp = UploadCheckpoint.open(src, "s3", "c.tar", str(tmp_path))
+    cp.start("upload-1", 40)
+    assert UploadCheckpoint.open(src, "b2", "c.tar", str(tmp_path)).upload_id is None
+    with open(src, "ab") as f:
+        f.write(b"more")
+    assert UploadCheckpoint.open(src, "s3", "c.tar", str(tmp_path)).upload_id is None
+
+def test_stale_checkpoints(make_file, tmp_path):
+    src = make_file(10)
+    cp = UploadCheckpoint.open(src, "s3", "c.tar", str(tmp_path))
+    cp.start("upload-1", 10)
+    [state] = list_checkpoints(str(tmp_path))
+    assert state["path"] == cp.path
+    assert not is_stale(state, 24)
+    state["created_at"] = time.time() - 25 * 3600
+    assert is_stale(state, 24)
+    state["created_at"] = time.time()
+    os.remove(src)
+    assert is_stale(state, 24)
+    cp.discard()
+    assert list_checkpoints(str(tmp_path)) == []
+
+def test_confirmed_bytes_and_listener(make_file, tmp_path):
+    src = make_file(100)
+    cp = UploadCheckpoint.open(src, "s3", "c.tar", str(tmp_path))
+    seen = []
+    cp.listener = seen.append
+    cp.start("upload-1", 40)
+    for n in (1, 2, 3):
+        cp.add_part(n, f"etag{n}")
+    assert seen == [0, 40, 80, 100]
+    cp.set_parts({1: "etag1"})
+    assert cp.confirmed_bytes == 40
@@ -0,0 +1,68 @@
+import threading
+import pytest
+from storage.chunked import MIN_PART_SIZE, plan_parts, upload_parts
+
+MB = 1024 * 1024
+
+def test_plan_parts_covers_file():
+    parts = plan_parts(20 * MB + 3, 8 * MB)
+    assert [n for n, _, _ in parts] == [1, 2, 3]
+    assert [(o, l) for _, o, l in parts] == [(0, 8 * MB), (8 * MB, 8 * MB), (16 * MB, 4 * MB + 3)]
+
+def test_plan_parts_minimum_and_max_parts():
+    assert plan_parts(12 * MB, 1)[0][2] == MIN_PART_SIZE
+    parts = plan_parts(100 * MB, MIN_PART_SIZE, max_parts=4)
+    assert len(parts) == 4 and parts[0][2] == 25 * MB
+    assert plan_parts(0, MIN_PART_SIZE) == [(1, 0, 0)]
+
+def test_upload_parts_sends_each_part_once(make_file):
+    path = make_file(23)
+    parts = [(1, 0, 10), (2, 10, 10), (3, 20, 3)]
+    sent = {}
+    lock = threading.Lock()
+    def send(number, data):
+        with lock:
+            sent[number] = data
+        return f"etag{number}"
+    results = upload_parts(path, parts, 2, send)
+    assert results == {1: "etag1", 2: "etag2", 3: "etag3"}
+    with open(path, "rb") as f:
+        assert b"".join(sent[n] for n in (1, 2, 3)) == f.read()
+
+def test_upload_parts_bounds_parts_in_flight(make_file):
+    path = make_file(80)
+    parts = [(n, (n - 1) * 10, 10) for n in range(1, 9)]
+    state = {"now": 0, "max": 0}
+    lock = threading.Lock()
+    release = threading.Event()
+    def send(number, data):
+        with lock:
+            state["now"] += 1
+            state["max"] = max(state["max"], state["now"])
+            if state["now"] == 3:
+                release.set()
+        release.wait(1)
+        with lock:
+            state["now"] -= 1
+        return number
+    upload_parts(path, parts, 3, send)
+    assert state["max"] == 3
+
+def test_resume_after_partial_failure(make_file):
+    path = make_file(50)
+    parts = [(n, (n - 1) * 10, 10) for n in range(1, 6)]
+    confirmed = {}
+    def failing(number, data):
+        if number == 3:
+            raise IOError("connection reset")
+        return f"etag{number}"
+    with pytest.raises(IOError):
+        upload_parts(path, parts, 1, failing, on_part=confirmed.__setitem__)
+    assert confirmed == {1: "etag1", 2: "etag2"}
+    resent = []
+    def send(number, data):
+        resent.append(number)
+        return f"etag{number}"
+    results = upload_parts(path, parts, 2, send, done=confirmed)
+    assert sorted(resent) == [3, 4, 5]
+    assert results == {n: f"etag{n}" for n in range(1, 6)}
@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+from utils import history, jobs as jobs_mod
+from utils.jobs import Job, JobManager, current_job, set_phase
+
+class _Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+async def _noop():
+    return {}
+
+def test_progress_throughput_and_eta(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(jobs_mod.time, "time", clock)
+    job = Job("remote", _noop)
+    job.status = "running"
+    job.start_transfer(1000)
+    job.progress(200)
+    assert job.throughput() is None
+    clock.now += 4
+    job.progress(600)
+    assert job.throughput() == 100
+    assert job.eta() == 4
+    data = job.to_dict()
+    assert (data["phase"], data["bytes_total"], data["bytes_uploaded"], data["throughput_bps"], data["eta_seconds"]) == (
+        "uploading", 1000, 600, 100, 4)
+    job.status = "done"
+    assert job.eta() is None
+
+@pytest.fixture
+def recorded(monkeypatch):
+    entries = []
+    monkeypatch.setattr(history, "append", entries.append)
+    return entries
+
+async def _wait(recorded, count):
+    for _ in range(100):
+        if len(recorded) >= count:
+            return
+        await asyncio.sleep(0.01)
+
+@pytest.mark.asyncio
+async def test_jobs_run_one_at_a_time_in_order(recorded):
+    manager = JobManager()
+    running = []
+    order = []
+    async def run(name):
+        running.append(name)
+        assert len(running) == 1
+        set_phase("snapshot")
+        assert current_job().phase == "snapshot"
+        await asyncio.sleep(0.02)
+        order.append(name)
+        running.remove(name)
+        return {"status": "ok"}
+    submitted = [manager.submit("local", lambda n=n: run(n)) for n in ("a", "b", "c")]
+    assert [j.status for j in manager.active()] == ["queued"] * 3
+    await _wait(recorded, 3)
+    manager.worker_task.cancel()
+    assert order == ["a", "b", "c"]
+    assert [j.status for j in submitted] == ["done"] * 3
+    assert [e["id"] for e in recorded] == [j.id for j in submitted]
+    assert current_job() is None
+
+@pytest.mark.asyncio
+async def test_failed_results_and_errors(recorded):
+    manager = JobManager()
+    async def busy():
+        return {"status": "busy"}
+    async def boom():
+        raise RuntimeError("boom")
+    a = manager.submit("remote", busy)
+    b = manager.submit("remote", boom)
+    await _wait(recorded, 2)
+    manager.worker_task.cancel()
+    assert (a.status, a.result) == ("failed", {"status": "busy"})
+    assert (b.status, b.error, b.phase) == ("failed", "boom", "failed")
+    assert [e["status"] for e in recorded] == ["failed", "failed"]
+
+def test_prune_keeps_recent_finished():
+    manager = JobManager(keep=2)
+    for i in range(4):
+        job = Job("local", _noop)
+        job.finished_at = float(i)
+        manager.jobs[job.id] = job
+    pending = Job("local", _noop)
+    manager.jobs[pending.id] = pending
+    manager.prune()
+    assert [j.finished_at for j in manager.jobs.values()] == [2.0, 3.0, None]
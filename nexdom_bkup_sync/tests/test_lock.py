@@ -0,0 +1,71 @@
+import errno
+import fcntl
+import os
+import subprocess
+import sys
+import pytest
+from utils import lock as lock_mod
+from utils.lock import FileLock
+
+def _dead_pid():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+def test_lock_is_exclusive_and_records_pid(tmp_path):
+    path = str(tmp_path / "backup.lock")
+    first, second = FileLock(path), FileLock(path)
+    assert first.try_acquire()
+    assert first.holder() == os.getpid()
+    assert not second.try_acquire()
+    first.release()
+    assert first.holder() is None
+    assert second.try_acquire()
+    second.release()
+
+def test_busy_flock_is_never_broken_by_a_dead_pid(tmp_path):
+    path = str(tmp_path / "backup.lock")
+    # A live fd holds the flock but the file still names a crashed holder, as right before the new one writes its PID.
+    fd = os.open(path, os.O_RDWR | os.O_CREAT)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    os.write(fd, str(_dead_pid()).encode())
+    lock = FileLock(path)
+    try:
+        assert not lock.try_acquire()
+        assert not lock.try_acquire()
+        assert os.path.exists(path)
+    finally:
+        os.close(fd)
+
+def test_pid_fallback_without_flock(tmp_path, monkeypatch):
+    path = str(tmp_path / "backup.lock")
+    def no_flock(fd, op):
+        raise OSError(errno.ENOLCK, "no locks available")
+    monkeypatch.setattr(lock_mod.fcntl, "flock", no_flock)
+    with open(path, "w") as f:
+        f.write(str(_dead_pid()))
+    first = FileLock(path)
+    assert first.try_acquire()
+    assert first.holder() == os.getpid()
+    with open(path, "w") as f:
+        f.write(str(os.getppid()))
+    assert not FileLock(path).try_acquire()
+    first.release()
+
+def test_live_holder_is_not_broken(tmp_path):
+    path = str(tmp_path / "backup.lock")
+    holder = FileLock(path)
+    assert holder.try_acquire()
+    other = FileLock(path)
+    assert not other.try_acquire()
+    assert os.path.exists(path) and holder.holder() == os.getpid()
+    holder.release()
+
+@pytest.mark.asyncio
+async def test_acquire_times_out(tmp_path):
+    path = str(tmp_path / "backup.lock")
+    holder = FileLock(path)
+    assert holder.try_acquire()
+    assert not await FileLock(path, timeout=0.2, poll=0.05).acquire()
+    holder.release()
+    assert await FileLock(path, timeout=0.2, poll=0.05).acquire()
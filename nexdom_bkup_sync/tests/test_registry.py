@@ -0,0 +1,85 @@
+import pytest
+from b2sdk.v2.exception import B2Error, FileNotPresent
+
+from storage import registry
+from storage.b2 import confirmed_parts
+from storage.base import StorageProvider
+
+
+class FakeProvider(StorageProvider):
+    name = "fake"
+    credential_keys = ("bucket", "token")
+    authorized = 0
+
+    def authorize(self):
+        FakeProvider.authorized += 1
+        self.expires_at = None
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    monkeypatch.setitem(registry.PROVIDERS, "fake", FakeProvider)
+    FakeProvider.authorized = 0
+    registry.clear()
+    yield {"provider": "fake", "bucket": "b", "token": "t"}
+    registry.clear()
+
+
+def test_provider_cached_per_credentials(fake):
+    first = registry.get_provider(fake)
+    assert registry.get_provider(dict(fake)) is first
+    assert registry.get_provider(dict(fake, token="other")) is not first
+    assert FakeProvider.authorized == 2
+
+
+def test_provider_rebuilt_for_larger_pool(fake):
+    first = registry.get_provider(fake, 4)
+    assert registry.get_provider(fake, 2) is first
+    bigger = registry.get_provider(fake, 16)
+    assert bigger is not first and bigger.pool_size == 16
+    assert registry.get_provider(fake, 8) is bigger
+
+
+def test_replaced_provider_is_closed(fake):
+    first = registry.get_provider(fake, 4)
+    bigger = registry.get_provider(fake, 16)
+    assert first.closed and not bigger.closed
+    other = registry.get_provider(dict(fake, token="other"))
+    assert bigger.closed and not other.closed
+    registry.clear()
+    assert other.closed
+
+
+def test_expired_provider_reauthorized(fake):
+    provider = registry.get_provider(fake)
+    provider.expires_at = 0
+    assert registry.get_provider(fake) is provider
+    assert FakeProvider.authorized == 2
+
+
+def test_unknown_provider():
+    with pytest.raises(ValueError):
+        registry.get_provider({"provider": "ftp"})
+
+
+class _Session:
+    def __init__(self, error=None):
+        self.error = error
+
+    def list_parts(self, file_id, start, count):
+        if self.error is not None:
+            raise self.error
+        if start == 1:
+            return {"parts": [{"partNumber": 1, "contentSha1": "a"}], "nextPartNumber": 2}
+        return {"parts": [{"partNumber": 2, "contentSha1": "b"}], "nextPartNumber": None}
+
+
+def test_b2_confirmed_parts_only_drops_missing_sessions():
+    assert confirmed_parts(_Session(), "f") == {1: "a", 2: "b"}
+    assert confirmed_parts(_Session(FileNotPresent()), "f") is None
+    with pytest.raises(B2Error):
+        confirmed_parts(_Session(B2Error("service unavailable")), "f")
@@ -0,0 +1,47 @@
+import os
+from types import SimpleNamespace
+from storage.checkpoint import UploadCheckpoint
+from storage.supabase import TUS_CHUNK_SIZE, SupabaseProvider
+
+class FakeTus:
+    """TUS server for one upload: PATCH must start exactly at the stored offset."""
+
+    def __init__(self, data=b""):
+        self.data = data
+        self.patches = []
+
+    def request(self, method, url, content=None, headers=None, timeout=None):
+        out = {}
+        status = 200
+        if method == "HEAD":
+            out["Upload-Offset"] = str(len(self.data))
+        elif method == "POST":
+            out["Location"] = "http://sb/upload/1"
+        elif method == "PATCH":
+            offset = int(headers["Upload-Offset"])
+            self.patches.append((offset, len(content)))
+            if offset != len(self.data):
+                status = 409
+            else:
+                self.data += content
+            out["Upload-Offset"] = str(len(self.data))
+        def raise_for_status():
+            if status >= 400:
+                raise RuntimeError(f"HTTP {status}")
+        return SimpleNamespace(headers=out, raise_for_status=raise_for_status)
+
+def _provider(http):
+    provider = SupabaseProvider.__new__(SupabaseProvider)
+    provider.url, provider.bucket, provider.token, provider.http = "http://sb", "b", "t", http
+    return provider
+
+def test_resume_from_mid_chunk_offset(tmp_path):
+    src = tmp_path / "backup.tar"
+    payload = os.urandom(TUS_CHUNK_SIZE + 1024 * 1024)
+    src.write_bytes(payload)
+    checkpoint = UploadCheckpoint.open(str(src), "supabase", "c.tar", str(tmp_path / "uploads"))
+    checkpoint.start("http://sb/upload/1", TUS_CHUNK_SIZE)
+    server = FakeTus(payload[:4 * 1024 * 1024])
+    _provider(server).upload(str(src), "c.tar", checkpoint=checkpoint)
+    assert server.patches == [(4 * 1024 * 1024, TUS_CHUNK_SIZE - 4 * 1024 * 1024), (TUS_CHUNK_SIZE, 1024 * 1024)]
+    assert server.data == payload
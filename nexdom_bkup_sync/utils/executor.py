@@ -0,0 +1,46 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+DEFAULT_WORKERS = 4
+
+_executor: Optional[ThreadPoolExecutor] = None
+_transfer_executor: Optional[ThreadPoolExecutor] = None
+
+
+def configure(workers: int) -> None:
+    """Size the blocking executor; only takes effect before its first use."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(2, workers), thread_name_prefix="blocking")
+
+
+def get_executor() -> ThreadPoolExecutor:
+    if _executor is None:
+        configure(DEFAULT_WORKERS)
+    return _executor
+
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking SDK or filesystem call on the dedicated executor.
+
+    This pool is kept apart from the loop's default executor and bounded by
+    limits.blocking_workers. Uploads go through run_transfer instead.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def run_transfer(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a provider upload on its own single-thread pool.
+
+    An upload can hold its thread for hours; jobs run one at a time, so one
+    thread is enough and the blocking_workers stay free for short calls.
+    """
+    global _transfer_executor
+    if _transfer_executor is None:
+        _transfer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="transfer")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_transfer_executor, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,34 @@
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+
+HISTORY_PATH = "/data/history.json"
+HISTORY_LIMIT = 100
+
+
+def load(path: str = HISTORY_PATH) -> List[Dict[str, Any]]:
+    """Finished jobs, newest first."""
+    try:
+        with open(path) as f:
+            items = json.load(f)
+        return items if isinstance(items, list) else []
+    except (OSError, ValueError):
+        return []
+
+
+def append(entry: Dict[str, Any], path: str = HISTORY_PATH, limit: int = HISTORY_LIMIT) -> None:
+    items = [entry] + load(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(items[:limit], f)
+    os.replace(tmp, path)
+
+
+def latest(kind: str, path: str = HISTORY_PATH) -> Optional[Dict[str, Any]]:
+    """Most recent successful job of this kind."""
+    for entry in load(path):
+        if entry.get("kind") == kind and entry.get("status") == "done":
+            return entry
+    return None
@@ -0,0 +1,167 @@
+import asyncio
+import contextvars
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from utils import history
+from utils.executor import run_blocking
+from utils.logger import setup_logger
+
+
+logger = setup_logger()
+
+# Job whose coroutine is running; lets snapshot code report phase and bytes without threading a job argument.
+CURRENT_JOB: contextvars.ContextVar[Optional["Job"]] = contextvars.ContextVar("job", default=None)
+
+FAILED_STATUSES = ("busy", "no_space", "no_backup", "too_large")
+
+
+class Job:
+    def __init__(self, kind: str, run: Callable[[], Awaitable[Dict[str, Any]]]):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.run = run
+        self.status = "queued"
+        self.phase = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.bytes_total: Optional[int] = None
+        self.bytes_done = 0
+        self.transfer_started: Optional[float] = None
+        self.transfer_base = 0
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+
+    def start_transfer(self, total: int) -> None:
+        self.phase = "uploading"
+        self.bytes_total = total
+        self.bytes_done = 0
+        self.transfer_started = None
+
+    def progress(self, done: int) -> None:
+        """Record confirmed bytes; the first report is the resume point and is left out of the throughput."""
+        if self.transfer_started is None:
+            self.transfer_started = time.time()
+            self.transfer_base = done
+        self.bytes_done = done
+
+    def throughput(self) -> Optional[float]:
+        if self.transfer_started is None:
+            return None
+        elapsed = (self.finished_at or time.time()) - self.transfer_started
+        if elapsed <= 0:
+            return None
+        return (self.bytes_done - self.transfer_base) / elapsed
+
+    def eta(self) -> Optional[float]:
+        rate = self.throughput()
+        if self.status != "running" or not rate or self.bytes_total is None:
+            return None
+        return max(0, self.bytes_total - self.bytes_done) / rate
+
+    def to_dict(self) -> Dict[str, Any]:
+        rate = self.throughput()
+        eta = self.eta()
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "phase": self.phase,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "bytes_total": self.bytes_total,
+            "bytes_uploaded": self.bytes_done,
+            "throughput_bps": round(rate) if rate is not None else None,
+            "eta_seconds": round(eta) if eta is not None else None,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+def current_job() -> Optional[Job]:
+    return CURRENT_JOB.get()
+
+
+def set_phase(phase: str) -> None:
+    job = CURRENT_JOB.get()
+    if job is not None:
+        job.phase = phase
+
+
+def failed(result: Any) -> bool:
+    if not isinstance(result, dict):
+        return False
+    return result.get("status") in FAILED_STATUSES or result.get("result") == "error"
+
+
+class JobManager:
+    """FIFO queue of backup jobs run one at a time by a single worker.
+
+    Every job takes the backup FileLock, so running them in parallel would
+    only park workers on the lock. Finished jobs stay in memory for
+    /service/jobs (the most recent `keep`) and are appended to the history
+    store.
+    """
+
+    def __init__(self, keep: int = 50):
+        self.keep = keep
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker_task: Optional[asyncio.Task] = None
+
+    def submit(self, kind: str, run: Callable[[], Awaitable[Dict[str, Any]]]) -> Job:
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+            self.worker_task = asyncio.create_task(self.worker())
+        job = Job(kind, run)
+        self.jobs[job.id] = job
+        self.prune()
+        self.queue.put_nowait(job)
+        logger.info(f"job {job.id} queued: {kind}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def active(self) -> List[Job]:
+        return [j for j in self.jobs.values() if j.status in ("queued", "running")]
+
+    def prune(self) -> None:
+        finished = [k for k, j in self.jobs.items() if j.finished_at is not None]
+        for k in finished[:max(0, len(finished) - self.keep)]:
+            del self.jobs[k]
+
+    async def worker(self) -> None:
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.execute(job)
+            finally:
+                self.queue.task_done()
+
+    async def execute(self, job: Job) -> None:
+        token = CURRENT_JOB.set(job)
+        job.status = "running"
+        job.phase = "starting"
+        job.started_at = time.time()
+        try:
+            job.result = await job.run()
+            job.status = "failed" if failed(job.result) else "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"job {job.id} ({job.kind}) failed: {e}")
+        finally:
+            CURRENT_JOB.reset(token)
+            job.finished_at = time.time()
+            job.phase = job.status
+        logger.info(f"job {job.id} ({job.kind}) {job.status}")
+        entry = job.to_dict()
+        try:
+            await run_blocking(history.append, entry)
+        except Exception as e:
+            logger.error(f"history write failed: {e}")
@@ -1,28 +1,99 @@
+import asyncio
+import errno
+import fcntl
 import os
 import time
+from typing import Optional
+
+from utils.logger import setup_logger
 
 
 LOCK_PATH = "/data/.nexdom_backup.lock"
 
+logger = setup_logger()
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
 
 class FileLock:
-    def __init__(self, path: str = LOCK_PATH, timeout: int = 5 * 60):
+    """Exclusive flock on LOCK_PATH, awaited without blocking the event loop.
+
+    The kernel drops the flock when its holder exits, so a crash cannot leave
+    the lock taken and a busy flock always means a live holder. The holder's
+    PID is written to the file for diagnostics. Only on filesystems without
+    flock support does the PID itself act as the lock, and a dead holder's
+    PID is then taken over.
+    """
+
+    NO_FLOCK = (errno.ENOLCK, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL)
+
+    def __init__(self, path: str = LOCK_PATH, timeout: int = 5 * 60, poll: float = 1.0):
         self.path = path
         self.timeout = timeout
+        self.poll = poll
+        self.fd: Optional[int] = None
+
+    def holder(self) -> Optional[int]:
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def try_acquire(self) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            if e.errno in self.NO_FLOCK:
+                return self.try_acquire_pid(fd)
+            os.close(fd)
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return False
+        self.take(fd)
+        return True
+
+    def try_acquire_pid(self, fd: int) -> bool:
+        """Fallback without flock: the lock is free when the recorded PID is ours, missing or dead."""
+        pid = self.holder()
+        if pid and pid != os.getpid():
+            if pid_alive(pid):
+                os.close(fd)
+                return False
+            logger.warning(f"lock held by dead pid {pid}; taking it over")
+        self.take(fd)
+        return True
+
+    def take(self, fd: int) -> None:
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self.fd = fd
 
-    def acquire(self) -> bool:
-        start = time.time()
-        while os.path.exists(self.path):
-            if time.time() - start > self.timeout:
+    async def acquire(self) -> bool:
+        deadline = time.monotonic() + self.timeout
+        while not self.try_acquire():
+            if time.monotonic() >= deadline:
                 return False
-            time.sleep(1)
-        with open(self.path, "w") as f:
-            f.write(str(os.getpid()))
+            await asyncio.sleep(self.poll)
         return True
 
     def release(self) -> None:
+        if self.fd is None:
+            return
         try:
-            if os.path.exists(self.path):
-                os.remove(self.path)
-        except Exception:
-            pass
\ No newline at end of file
+            os.ftruncate(self.fd, 0)
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        except OSError:
+            pass
+        finally:
+            os.close(self.fd)
+            self.fd = None
@@ -33,6 +33,10 @@ def ensure_policy_defaults(cfg: Dict[str, Any]) -> Dict[str, Any]:
     limits.setdefault("max_snapshot_size_gb", 20)
     limits.setdefault("retry_attempts", 3)
     limits.setdefault("retry_backoff_seconds", 30)
+    limits.setdefault("upload_part_size_mb", 16)
+    limits.setdefault("upload_concurrency", 4)
+    limits.setdefault("upload_resume_hours", 24)
+    limits.setdefault("blocking_workers", 4)
 
     logging = cfg["logging"]
     logging.setdefault("notify_on_failure", True)
@@ -0,0 +1,67 @@
+import json
+import logging
+import re
+from typing import Any, Iterator
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the image
+    orjson = None
+
+
+class StdlibCodec:
+    name = "json"
+
+    @staticmethod
+    def loads(data: Any) -> Any:
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), sort_keys=sort_keys, ensure_ascii=False, default=str).encode("utf-8")
+
+
+class OrjsonCodec:
+    name = "orjson"
+
+    @staticmethod
+    def loads(data: Any) -> Any:
+        return orjson.loads(data)
+
+    @staticmethod
+    def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0, default=str)
+
+
+_array_decoder = json.JSONDecoder()
+_array_sep = re.compile(r"[\s,]*")
+
+
+def iter_array(text: str, start: int) -> Iterator[Any]:
+    """Decode the elements of the JSON array whose body starts at text[start] one at a time.
+
+    Only the current element is materialized, so peak memory is the text
+    plus one element instead of the whole decoded array.
+    """
+    decode = _array_decoder.raw_decode
+    match = _array_sep.match
+    end = len(text)
+    idx = start
+    while True:
+        idx = match(text, idx).end()
+        if idx >= end or text[idx] == "]":
+            return
+        obj, idx = decode(text, idx)
+        yield obj
+
+
+def get_codec(name: str = "auto"):
+    """Return the JSON codec for `auto`, `orjson` or `json`; orjson falls back to stdlib if missing."""
+    name = (name or "auto").lower()
+    if name == "json":
+        return StdlibCodec
+    if orjson is None:
+        if name == "orjson":
+            logging.warning("orjson no está instalado, se usa json de la librería estándar")
+        return StdlibCodec
+    return OrjsonCodec
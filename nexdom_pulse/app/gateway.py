@@ -0,0 +1,121 @@
+import asyncio
+import contextvars
+import logging
+import os
+import re
+from typing import Any, Dict, List
+
+from .metrics import MergedRegistry, start_http_server
+
+# Name of the site whose task is logging; set once per site task and inherited by its subtasks.
+SITE: contextvars.ContextVar[str] = contextvars.ContextVar("site", default="")
+
+SITE_KEYS = ("name", "ws_url", "token")
+# Top-level options a site may override. The pool, in-flight budgets, metrics endpoint and log level are
+# shared; reporting_rules, attribute_rules and sinks are lists of objects, which the Supervisor schema
+# cannot nest inside sites, so they are inherited as is.
+SITE_OVERRIDES = (
+    "client_id", "client_name", "supabase_url", "supabase_token", "update_interval", "entities", "reporting_enabled",
+    "delivery_mode", "batch_max_entities", "batch_max_bytes", "http_timeout", "suppress_unchanged", "attribute_delta",
+    "full_refresh_interval", "outbox_enabled", "outbox_max_entries", "outbox_max_mb", "outbox_drain_batch",
+    "outbox_drain_rate", "event_source", "json_codec", "raw_prefilter", "attribute_max_bytes", "flush_max_entries",
+    "flush_max_bytes", "flush_max_age", "flush_min_gap", "flush_jitter", "history_mode", "history_capacity",
+    "history_samples", "history_report_states", "state_cache_enabled", "state_cache_interval", "report_removed",
+    "priority_entities", "priority_device_classes", "snapshot_chunk", "coalesce_messages",
+)
+# Site names become directory names under data_dir.
+SITE_NAME_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}\Z")
+
+
+class SiteLogFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        site = SITE.get()
+        if site and not getattr(record, "site", None):
+            record.site = site
+            record.msg = f"[{site}] {record.msg}"
+        return True
+
+
+class Gateway:
+    """Runs one reporter session per entry in `sites` inside a single process.
+
+    Every site keeps its own websocket, filter, client_id, token, reconnect
+    backoff, outbox, state cache and metrics. The HTTP pool, the Supabase
+    in-flight budget (http_max_in_flight / priority_max_in_flight) and the
+    metrics endpoint are created once from the top-level options and shared.
+    Site entries inherit every top-level option and may override those in SITE_OVERRIDES.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.sites: Dict[str, Any] = {}
+
+    def site_options(self, site: Dict[str, Any]) -> Dict[str, Any]:
+        options = {k: v for k, v in self.base.options.items() if k != "sites"}
+        options.update({k: v for k, v in site.items() if k not in SITE_KEYS})
+        return options
+
+    def build_sites(self):
+        for site in self.base.options.get("sites") or []:
+            name = str(site.get("name", "")).strip()
+            if not name:
+                raise ValueError("sites: falta name")
+            if not SITE_NAME_RE.match(name):
+                raise ValueError(f"sites: name {name!r} inválido (minúsculas, dígitos, - y _)")
+            if name in self.sites:
+                raise ValueError(f"sites: nombre repetido {name!r}")
+            if not site.get("ws_url") or not site.get("token"):
+                raise ValueError(f"sites: {name} requiere ws_url y token")
+            unknown = sorted(k for k in site if k not in SITE_KEYS and k not in SITE_OVERRIDES)
+            if unknown:
+                raise ValueError(f"sites: {name} no puede sobrescribir {', '.join(unknown)}")
+            reporter = type(self.base)()
+            reporter.options_path = self.base.options_path
+            reporter.apply_options(self.site_options(site))
+            reporter.data_dir = os.path.join(self.base.data_dir, "sites", name)
+            reporter.ws_url = site["ws_url"]
+            reporter.supervisor_token = site["token"]
+            reporter.validate_required()
+            self.sites[name] = reporter
+
+    def share_pipeline(self):
+        session = self.base.get_session()
+        for reporter in self.sites.values():
+            reporter.http_session = session
+            reporter.http_semaphore = self.base.http_semaphore
+            reporter.priority_semaphore = self.base.priority_semaphore
+
+    async def run_site(self, name: str, reporter):
+        SITE.set(name)
+        try:
+            os.makedirs(reporter.data_dir, exist_ok=True)
+            await reporter.run_session()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error("Sitio detenido por un error inesperado: %s", e)
+
+    async def run(self):
+        self.build_sites()
+        self.share_pipeline()
+        for handler in logging.getLogger().handlers:
+            handler.addFilter(SiteLogFilter())
+        logging.info("Gateway: %s sitios (%s)", len(self.sites), ", ".join(self.sites))
+        runner = None
+        if self.base.metrics_port:
+            metrics = MergedRegistry({name: r.metrics for name, r in self.sites.items()})
+            try:
+                runner = await start_http_server(metrics, self.base.metrics_host, self.base.metrics_port)
+            except Exception as e:
+                logging.error("No se pudo iniciar el endpoint de métricas en %s:%s: %s",
+                              self.base.metrics_host, self.base.metrics_port, e)
+        tasks: List[asyncio.Task] = [asyncio.create_task(self.run_site(name, r)) for name, r in self.sites.items()]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.base.close_session()
+            if runner is not None:
+                await runner.cleanup()
@@ -0,0 +1,104 @@
+import math
+import time
+from array import array
+from typing import Any, Dict, Optional
+
+
+class SeriesWindow:
+    """Numeric samples of one entity for the current flush window.
+
+    Samples live in two parallel float arrays (timestamps and values) that
+    act as a ring once `capacity` is reached. min/max/mean/last are kept as
+    running aggregates, so they stay exact even when old samples are
+    overwritten.
+    """
+
+    __slots__ = ("capacity", "ts", "values", "head", "dropped", "count", "min", "max", "sum", "last")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.reset()
+
+    def reset(self):
+        self.ts = array("d")
+        self.values = array("d")
+        self.head = 0
+        self.dropped = 0
+        self.count = 0
+        self.min = 0.0
+        self.max = 0.0
+        self.sum = 0.0
+        self.last = 0.0
+
+    def add(self, ts: float, value: float):
+        if len(self.ts) < self.capacity:
+            self.ts.append(ts)
+            self.values.append(value)
+        else:
+            self.ts[self.head] = ts
+            self.values[self.head] = value
+            self.head = (self.head + 1) % self.capacity
+            self.dropped += 1
+        if self.count == 0:
+            self.min = self.max = value
+        else:
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+        self.count += 1
+        self.sum += value
+        self.last = value
+
+    def summary(self, entity_id: str, include_samples: bool) -> Dict[str, Any]:
+        h = self.head
+        ts = self.ts[h:] + self.ts[:h]
+        data: Dict[str, Any] = {
+            "entity_id": entity_id,
+            "start": ts[0],
+            "end": ts[-1],
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.sum / self.count,
+            "last": self.last,
+        }
+        if include_samples:
+            data["ts"] = ts.tolist()
+            data["values"] = (self.values[h:] + self.values[:h]).tolist()
+            if self.dropped:
+                data["dropped"] = self.dropped
+        return data
+
+
+class History:
+    """Per-entity numeric history aggregated per flush window."""
+
+    def __init__(self, capacity: int = 120, include_samples: bool = True):
+        self.capacity = capacity
+        self.include_samples = include_samples
+        self.windows: Dict[str, SeriesWindow] = {}
+        self.window_start = time.time()
+
+    def record(self, entity_id: str, state: Any, ts: Optional[float] = None):
+        try:
+            value = float(state)
+        except (TypeError, ValueError):
+            return
+        if not math.isfinite(value):
+            return
+        window = self.windows.get(entity_id)
+        if window is None:
+            window = self.windows[entity_id] = SeriesWindow(self.capacity)
+        window.add(time.time() if ts is None else ts, value)
+
+    def take_window(self) -> Dict[str, Any]:
+        """Summarize and reset the current window; entities without samples are dropped."""
+        now = time.time()
+        series = []
+        for entity_id, window in list(self.windows.items()):
+            if not window.count:
+                del self.windows[entity_id]
+                continue
+            series.append(window.summary(entity_id, self.include_samples))
+            window.reset()
+        start, self.window_start = self.window_start, now
+        return {"start": start, "end": now, "series": series}
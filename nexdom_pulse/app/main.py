@@ -1,15 +1,38 @@
 import os
 import json
 import asyncio
+import hashlib
 import logging
+import random
+import re
 import time
-from fnmatch import fnmatch
-from typing import Dict, Any, List
-import websockets
-import requests
 import contextlib
+import contextvars
+from datetime import datetime, timezone
+from typing import Dict, Any, Callable, Iterable, List, Optional, Set, Tuple
+import websockets
+import aiohttp
+
+from .codec import get_codec, iter_array
+from .history import History
+from .metrics import MetricsRegistry, start_http_server
+from .outbox import Outbox
+from .projection import Projection
+from .patterns import EntityFilter
+from .sinks import Sink, create_sink
+from .state_cache import StateCache
+from .throttle import Throttle
+
+# Set inside priority-lane tasks so http_post uses the priority concurrency budget.
+URGENT_LANE: contextvars.ContextVar[bool] = contextvars.ContextVar("urgent_lane", default=False)
 
 class HAOSReporter:
+    EVENT_FRAME_RE = re.compile(r'^\{(?:"id":\s*\d+,\s*)?"type":\s*"event",\s*(?:"id":\s*\d+,\s*)?"event":\s*\{"event_type":\s*"state_changed"')
+    ENTITY_ID_RE = re.compile(r'"entity_id":\s*"([^"\\]+)"')
+    RESULT_FRAME_RE = re.compile(r'^\{"id":\s*(\d+),\s*"type":\s*"result"')
+    RESULT_ARRAY_RE = re.compile(r'"result":\s*\[')
+    MESSAGE_START_RE = re.compile(r'[\[,]\s*(\{(?:"id":\s*\d+,\s*)?"type":)')
+
     def __init__(self):
         self.options_path = "/data/options.json"
         self.options: Dict[str, Any] = {}
@@ -26,18 +49,220 @@ class HAOSReporter:
         self.id_counter = 1
         self.changed_buffer: Dict[str, Dict[str, Any]] = {}
         self.connected_once = False
+        self.pending_requests: Dict[int, Callable[[Dict[str, Any]], None]] = {}
+        self.raw_requests: Set[int] = set()
+        self.early_messages: List[Dict[str, Any]] = []
+        self.coalesce_messages = True
+        self.snapshot_chunk = 2000
+        self.snapshot_live: Optional[Set[str]] = None
+        self.snapshot_seen: Optional[Set[str]] = None
+        self.flush_lock = asyncio.Lock()
+        self.entity_filter = EntityFilter()
+        self.delivery_mode = "single"
+        self.batch_max_entities = 200
+        self.batch_max_bytes = 256 * 1024
+        self.http_pool_size = 10
+        self.http_max_in_flight = 4
+        self.http_timeout = 15
+        self.suppress_unchanged = True
+        self.attribute_delta = False
+        self.full_refresh_interval = 3600
+        self.reported_digests: Dict[str, str] = {}
+        self.reported_at: Dict[str, float] = {}
+        self.reported_attributes: Dict[str, Dict[str, Any]] = {}
+        self.suppressed_count = 0
+        self.data_dir = "/data"
+        self.outbox_enabled = True
+        self.outbox_max_entries = 50000
+        self.outbox_max_mb = 64
+        self.outbox_drain_batch = 200
+        self.outbox_drain_rate = 50
+        self.outbox: Optional[Outbox] = None
+        self.state_cache_enabled = True
+        self.state_cache_interval = 60
+        self.state_cache: Optional[StateCache] = None
+        self.state_cache_dirty = False
+        self.report_removed = True
+        self.event_source = "state_changed"
+        self.entities_sub_id: Optional[int] = None
+        self.entity_mirror: Dict[str, Dict[str, Any]] = {}
+        self.mirror_loaded = asyncio.Event()
+        self.codec = get_codec()
+        self.raw_prefilter = True
+        self.prefiltered_count = 0
+        self.throttle = Throttle()
+        self.projection = Projection()
+        self.sinks: List[Sink] = []
+        self.priority_filter: Optional[EntityFilter] = None
+        self.priority_device_classes: Set[str] = set()
+        self.priority_max_in_flight = 2
+        self.priority_semaphore: Optional[asyncio.Semaphore] = None
+        self.urgent_pending: Dict[str, Tuple[Dict[str, Any], float]] = {}
+        self.urgent_tasks: Dict[str, asyncio.Task] = {}
+        self.urgent_last_changed: Dict[str, str] = {}
+        self.supabase_filter: Optional[EntityFilter] = None
+        self.flush_max_entries = 1000
+        self.flush_max_bytes = 512 * 1024
+        self.flush_max_age = 0
+        self.flush_min_gap = 1.0
+        self.flush_jitter = 0.1
+        self.buffer_since: Optional[float] = None
+        self.buffer_bytes = 0
+        self.buffer_sizes: Dict[str, int] = {}
+        self.flush_requested = False
+        self.flush_wakeup = asyncio.Event()
+        self.flush_idle = asyncio.Event()
+        self.flush_idle.set()
+        self.flush_tasks: Set[asyncio.Task] = set()
+        self.supabase_pending: Dict[str, Dict[str, Any]] = {}
+        self.pending_bytes = 0
+        self.pending_since: Optional[float] = None
+        self.last_flush_stats: Dict[str, Any] = {}
+        self.history: Optional[History] = None
+        self.history_report_states = False
+        self.http_session: Optional[aiohttp.ClientSession] = None
+        self.http_semaphore: Optional[asyncio.Semaphore] = None
+        self.metrics_host = "127.0.0.1"
+        self.metrics_port = 9108
+        self.ws_connected = False
+        self.setup_metrics()
 
     def load_options(self):
         with open(self.options_path, "r", encoding="utf-8") as f:
-            self.options = json.load(f)
+            self.apply_options(json.load(f))
+
+    def apply_options(self, options: Dict[str, Any]):
+        self.options = options
         self.client_id = self.options.get("client_id", "")
         self.supabase_url = self.options.get("supabase_url", "")
         self.supabase_token = self.options.get("supabase_token", "")
         self.update_interval = int(self.options.get("update_interval", 60))
         self.entities_patterns = self.options.get("entities", ["*"])
+        self.compile_patterns()
         self.client_name = self.options.get("client_name", "")
         self.reporting_enabled = bool(self.options.get("reporting_enabled", True))
         self.log_level = self.options.get("log_level", "info").lower()
+        self.delivery_mode = self.options.get("delivery_mode", "single").lower()
+        self.batch_max_entities = max(1, int(self.options.get("batch_max_entities", 200)))
+        self.batch_max_bytes = max(1024, int(self.options.get("batch_max_bytes", 256 * 1024)))
+        self.http_pool_size = max(1, int(self.options.get("http_pool_size", 10)))
+        self.http_max_in_flight = max(1, int(self.options.get("http_max_in_flight", 4)))
+        self.http_timeout = max(1, int(self.options.get("http_timeout", 15)))
+        self.suppress_unchanged = bool(self.options.get("suppress_unchanged", True))
+        self.attribute_delta = bool(self.options.get("attribute_delta", False))
+        self.full_refresh_interval = max(60, int(self.options.get("full_refresh_interval", 3600)))
+        if not self.attribute_delta:
+            self.reported_attributes.clear()
+        self.data_dir = os.path.dirname(self.options_path) or "."
+        self.outbox_enabled = bool(self.options.get("outbox_enabled", True))
+        self.outbox_max_entries = max(100, int(self.options.get("outbox_max_entries", 50000)))
+        self.outbox_max_mb = max(1, int(self.options.get("outbox_max_mb", 64)))
+        self.outbox_drain_batch = max(1, int(self.options.get("outbox_drain_batch", 200)))
+        self.outbox_drain_rate = max(1, int(self.options.get("outbox_drain_rate", 50)))
+        self.state_cache_enabled = bool(self.options.get("state_cache_enabled", True))
+        self.state_cache_interval = max(5, int(self.options.get("state_cache_interval", 60)))
+        self.report_removed = bool(self.options.get("report_removed", True))
+        self.event_source = self.options.get("event_source", "state_changed").lower()
+        self.snapshot_chunk = max(0, int(self.options.get("snapshot_chunk", 2000)))
+        self.coalesce_messages = bool(self.options.get("coalesce_messages", True))
+        self.codec = get_codec(self.options.get("json_codec", "auto"))
+        self.raw_prefilter = bool(self.options.get("raw_prefilter", True))
+        self.throttle = Throttle(self.options.get("reporting_rules") or [])
+        self.projection = Projection(
+            self.options.get("attribute_rules") or [],
+            max_value_bytes=max(0, int(self.options.get("attribute_max_bytes", 0))),
+            dumps=self.codec.dumps,
+        )
+        self.flush_max_entries = max(0, int(self.options.get("flush_max_entries", 1000)))
+        self.flush_max_bytes = max(0, int(self.options.get("flush_max_bytes", 512 * 1024)))
+        self.flush_max_age = max(0.0, float(self.options.get("flush_max_age", 0)))
+        self.flush_min_gap = max(0.0, float(self.options.get("flush_min_gap", 1)))
+        self.flush_jitter = min(0.5, max(0.0, float(self.options.get("flush_jitter", 0.1))))
+        self.load_sinks(self.options.get("sinks") or [])
+        priority_entities = self.options.get("priority_entities", ["alarm_control_panel.*", "lock.*"])
+        self.priority_filter = EntityFilter(priority_entities) if priority_entities else None
+        self.priority_device_classes = set(
+            self.options.get("priority_device_classes", ["smoke", "moisture", "gas", "carbon_monoxide", "safety"])
+        )
+        self.priority_max_in_flight = max(1, int(self.options.get("priority_max_in_flight", 2)))
+        self.metrics_host = self.options.get("metrics_host", "127.0.0.1")
+        self.metrics_port = max(0, int(self.options.get("metrics_port", 9108)))
+        if self.options.get("history_mode", False):
+            self.history = History(
+                capacity=max(1, int(self.options.get("history_capacity", 120))),
+                include_samples=bool(self.options.get("history_samples", True)),
+            )
+        else:
+            self.history = None
+        self.history_report_states = bool(self.options.get("history_report_states", False))
+
+    def load_sinks(self, options: List[Dict[str, Any]]):
+        """Build secondary sinks; a `supabase` entry only restricts which entities go to Supabase.
+
+        Supabase stays the primary destination instead of a Sink because its
+        delivery owns the change suppression, the outbox and the state cache;
+        see stage_flush for how it is kept off the sinks' path.
+        """
+        self.sinks = []
+        self.supabase_filter = None
+        for option in options:
+            if str(option.get("type", "")).lower() == "supabase":
+                self.supabase_filter = EntityFilter(option.get("entities"))
+                continue
+            self.sinks.append(create_sink(option, client_id=self.client_id, dumps=self.codec.dumps, get_session=self.get_session))
+        names = [s.name for s in self.sinks]
+        if len(set(names)) != len(names):
+            raise ValueError("sinks: los nombres deben ser únicos (usa name)")
+
+    def setup_metrics(self):
+        """Create the metrics registry; hot paths keep direct references to their counters."""
+        m = self.metrics = MetricsRegistry()
+        self.m_frames = m.counter("ws_frames_total", "Frames WebSocket recibidos.")
+        self.m_messages = m.counter("ws_messages_total", "Mensajes WebSocket recibidos (un frame agrupado trae varios).")
+        events = m.counter("events_total", "Eventos de estado por resultado del filtro.", labels=("result",))
+        self.m_events_matched = events.labels("matched")
+        self.m_events_filtered = events.labels("filtered")
+        self.m_events_prefiltered = events.labels("prefiltered")
+        m.callback("throttled_total", "Eventos retenidos por reporting_rules.", lambda: self.throttle.throttled_count, "counter")
+        m.callback("suppressed_total", "Payloads omitidos por no tener cambios.", lambda: self.suppressed_count, "counter")
+        m.callback("attribute_dropped_bytes_total", "Bytes de atributos descartados por attribute_rules o attribute_max_bytes.",
+                   lambda: self.projection.dropped_bytes, "counter")
+        m.callback("attribute_truncated_total", "Valores de atributos truncados o descartados por tamaño.",
+                   lambda: self.projection.truncated_count, "counter")
+        m.callback("buffer_entities", "Entidades pendientes en el buffer.", lambda: len(self.changed_buffer))
+        m.callback("buffer_bytes", "Tamaño estimado del buffer en bytes.", lambda: self.buffer_bytes)
+        m.callback("throttle_held_entities", "Entidades retenidas por reporting_rules.", lambda: len(self.throttle.held))
+        m.callback("outbox_entities", "Entidades en el outbox.", lambda: self.outbox.count if self.outbox else 0)
+        m.callback("sink_queue_entities", "Entidades en la cola de cada sink.",
+                   lambda: {s.name: len(s.queue) for s in self.sinks}, labels=("sink",))
+        m.callback("sink_sent_total", "Entidades entregadas por sink.", lambda: {s.name: s.sent for s in self.sinks}, "counter", ("sink",))
+        m.callback("sink_failed_total", "Entidades descartadas tras agotar los reintentos por sink.",
+                   lambda: {s.name: s.failed for s in self.sinks}, "counter", ("sink",))
+        m.callback("sink_dropped_total", "Entidades descartadas por cola llena por sink.",
+                   lambda: {s.name: s.dropped for s in self.sinks}, "counter", ("sink",))
+        self.m_priority_sent = m.counter("priority_sent_total", "Entidades enviadas por el carril prioritario.")
+        self.m_priority_latency = m.histogram("priority_delivery_seconds", "Demora desde la recepción hasta la entrega en el carril prioritario.")
+        m.callback("priority_pending_entities", "Entidades en espera o en envío en el carril prioritario.", lambda: len(self.urgent_tasks))
+        m.callback("ws_connected", "1 si el WebSocket está conectado.", lambda: self.ws_connected)
+        self.m_flushes = m.counter("flushes_total", "Flushes con datos por disparador.", labels=("trigger",))
+        self.m_flush_duration = m.histogram("flush_duration_seconds", "Duración de cada flush con datos.")
+        self.m_flushed = m.counter("flushed_entities_total", "Entidades procesadas por flush.")
+        self.m_flush_failed = m.counter("flush_failed_entities_total", "Entidades que fallaron tras los reintentos.")
+        self.m_http_latency = m.histogram("supabase_request_duration_seconds", "Latencia de las peticiones a Supabase.")
+        self.m_http_status = m.counter("supabase_responses_total", "Respuestas de Supabase por código HTTP.", labels=("status",))
+        self.m_retries = m.counter("supabase_retries_total", "Reintentos de peticiones a Supabase por RPC.", labels=("rpc",))
+        self.m_reconnects = m.counter("ws_reconnects_total", "Desconexiones o fallos de conexión del WebSocket.")
+
+    async def start_metrics(self):
+        if not self.metrics_port:
+            return None
+        try:
+            runner = await start_http_server(self.metrics, self.metrics_host, self.metrics_port)
+        except Exception as e:
+            logging.error("No se pudo iniciar el endpoint de métricas en %s:%s: %s", self.metrics_host, self.metrics_port, e)
+            return None
+        logging.info("Métricas en http://%s:%s/metrics", self.metrics_host, self.metrics_port)
+        return runner
 
     def setup_logging(self):
         level = {
@@ -84,49 +309,323 @@ class HAOSReporter:
         self.id_counter += 1
         return i
 
+    def compile_patterns(self):
+        """Compile entities_patterns into the entity filter (and drop its cached decisions)."""
+        self.entity_filter = EntityFilter(self.entities_patterns)
+
     def matches(self, entity_id: str) -> bool:
-        for p in self.entities_patterns:
-            if p == "*":
-                return True
-            if "*" in p:
-                if fnmatch(entity_id, p):
-                    return True
-            else:
-                if entity_id == p:
-                    return True
-        return False
+        return self.entity_filter.matches(entity_id)
 
     def build_payload(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        attributes = state.get("attributes", {})
+        if self.projection.active:
+            attributes = self.projection.apply(state.get("entity_id"), attributes)
         return {
             "entity_id": state.get("entity_id"),
             "state": state.get("state"),
-            "attributes": state.get("attributes", {}),
+            "attributes": attributes,
             "last_changed": state.get("last_changed"),
         }
 
-    async def post_supabase(self, payload: Dict[str, Any]):
-        url = f"{self.supabase_url}/rest/v1/rpc/sp_report_entity"
-        body = {"p_client_id": self.client_id, "p_entity": payload}
-        headers = {
+    @staticmethod
+    def removal_payload(entity_id: str) -> Dict[str, Any]:
+        return {"entity_id": entity_id, "state": None, "attributes": {}, "last_changed": None, "removed": True}
+
+    def payload_digest(self, payload: Dict[str, Any]) -> str:
+        data = self.codec.dumps([payload.get("state"), payload.get("attributes")], sort_keys=True)
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    @staticmethod
+    def delta_payload(payload: Dict[str, Any], previous: Dict[str, Any]) -> Dict[str, Any]:
+        attributes = payload.get("attributes") or {}
+        delta = dict(payload)
+        delta["attributes"] = {k: v for k, v in attributes.items() if k not in previous or previous[k] != v}
+        delta["attributes_delta"] = True
+        removed = [k for k in previous if k not in attributes]
+        if removed:
+            delta["removed_attributes"] = removed
+        return delta
+
+    def prepare_payloads(self, payloads: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Tuple[str, bool, Dict[str, Any]]]]:
+        """Drop payloads identical to the last reported one and apply attribute deltas.
+
+        Returns the payloads to send and, per entity, the (digest, full, attributes)
+        to record once delivery succeeds.
+        """
+        now = time.monotonic()
+        to_send: List[Dict[str, Any]] = []
+        pending: Dict[str, Tuple[str, bool, Dict[str, Any]]] = {}
+        for payload in payloads:
+            eid = payload.get("entity_id")
+            digest = self.payload_digest(payload)
+            full = eid not in self.reported_at or now - self.reported_at[eid] >= self.full_refresh_interval
+            if self.suppress_unchanged and not full and self.reported_digests.get(eid) == digest:
+                self.suppressed_count += 1
+                continue
+            pending[eid] = (digest, full, payload.get("attributes") or {})
+            previous = self.reported_attributes.get(eid)
+            if self.attribute_delta and not full and previous is not None and not payload.get("removed"):
+                payload = self.delta_payload(payload, previous)
+            to_send.append(payload)
+        return to_send, pending
+
+    def mark_reported(self, pending: Dict[str, Tuple[str, bool, Dict[str, Any]]], failed: List[Dict[str, Any]]):
+        failed_ids = {p.get("entity_id") for p in failed}
+        now = time.monotonic()
+        for eid, (digest, full, attributes) in pending.items():
+            if eid in failed_ids:
+                continue
+            self.reported_digests[eid] = digest
+            if full:
+                self.reported_at[eid] = now
+            if self.attribute_delta:
+                self.reported_attributes[eid] = attributes
+            if self.snapshot_seen is not None:
+                self.snapshot_seen.add(eid)
+            self.state_cache_dirty = True
+
+    def forget_reported(self, entity_ids: Iterable[str]):
+        for eid in entity_ids:
+            self.reported_digests.pop(eid, None)
+            self.reported_at.pop(eid, None)
+            self.reported_attributes.pop(eid, None)
+            self.state_cache_dirty = True
+
+    def queue_removed(self, present: Iterable[str]) -> int:
+        """Buffer a removal for every reported entity missing from a fresh snapshot.
+
+        Cached entities that no longer match the filter are forgotten without
+        being reported. Entities with live events or reports since get_states
+        was requested (snapshot_seen) count as present: they may be newer than
+        the snapshot. Returns the number of removals queued.
+        """
+        present = set(present)
+        if self.snapshot_seen is not None:
+            present |= self.snapshot_seen
+            self.snapshot_seen = None
+        missing = [eid for eid in self.reported_digests if eid not in present and eid not in self.changed_buffer]
+        self.forget_reported(eid for eid in missing if not self.matches(eid))
+        if not self.report_removed:
+            return 0
+        queued = 0
+        for eid in missing:
+            if self.matches(eid):
+                self.enqueue(eid, self.removal_payload(eid))
+                queued += 1
+        return queued
+
+    def supabase_headers(self) -> Dict[str, str]:
+        return {
             "Authorization": f"Bearer {self.supabase_token}",
             "apikey": self.supabase_token,
             "Content-Type": "application/json",
         }
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.http_session is None or self.http_session.closed:
+            # Reserve connections for the priority lane so a bulk flush cannot use them all.
+            limit = max(self.http_pool_size, self.http_max_in_flight + self.priority_max_in_flight)
+            connector = aiohttp.TCPConnector(limit=limit, keepalive_timeout=60)
+            self.http_session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.http_timeout),
+            )
+            self.http_semaphore = asyncio.Semaphore(self.http_max_in_flight)
+            self.priority_semaphore = asyncio.Semaphore(self.priority_max_in_flight)
+        return self.http_session
+
+    async def close_session(self):
+        if self.http_session is not None and not self.http_session.closed:
+            await self.http_session.close()
+        self.http_session = None
+
+    async def http_post(self, url: str, body: Dict[str, Any]) -> Tuple[int, str]:
+        """POST a JSON body through the shared session, bounded by the current lane's in-flight budget."""
+        session = self.get_session()
+        data = self.codec.dumps(body)
+        async with (self.priority_semaphore if URGENT_LANE.get() else self.http_semaphore):
+            start = time.monotonic()
+            try:
+                async with session.post(url, data=data, headers=self.supabase_headers()) as resp:
+                    text = await resp.text()
+            except Exception:
+                self.m_http_status.labels("error").inc()
+                raise
+            finally:
+                self.m_http_latency.observe(time.monotonic() - start)
+            self.m_http_status.labels(resp.status).inc()
+            return resp.status, text
+
+    async def run_limited(self, func, items) -> List[Any]:
+        """Await func(item) for every item with at most http_max_in_flight running at once."""
+        it = iter(items)
+        results: List[Any] = []
+        async def worker():
+            for item in it:
+                results.append(await func(item))
+        await asyncio.gather(*(worker() for _ in range(self.http_max_in_flight)))
+        return results
+
+    async def post_supabase(self, payload: Dict[str, Any]) -> bool:
+        url = f"{self.supabase_url}/rest/v1/rpc/sp_report_entity"
+        body = {"p_client_id": self.client_id, "p_entity": payload}
         attempt = 1
         while True:
-            def do_post():
-                return requests.post(url, headers=headers, json=body, timeout=15)
-            resp = await asyncio.to_thread(do_post)
-            if resp.status_code < 300:
-                logging.debug("Supabase ok %s", resp.status_code)
-                return
-            logging.error("Supabase error %s %s", resp.status_code, resp.text)
+            status, text = await self.http_post(url, body)
+            if status < 300:
+                logging.debug("Supabase ok %s", status)
+                return True
+            logging.error("Supabase error %s %s", status, text)
             if attempt >= 3:
-                return
+                return False
+            self.m_retries.labels("sp_report_entity").inc()
             delay = min(2 ** (attempt - 1), 10)
             attempt += 1
             await asyncio.sleep(delay)
 
+    def make_batches(self, payloads: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Split payloads into batches bounded by entity count and encoded size."""
+        batches: List[List[Dict[str, Any]]] = []
+        current: List[Dict[str, Any]] = []
+        size = 0
+        for payload in payloads:
+            n = len(self.codec.dumps(payload)) + 1
+            if current and (len(current) >= self.batch_max_entities or size + n > self.batch_max_bytes):
+                batches.append(current)
+                current = []
+                size = 0
+            current.append(payload)
+            size += n
+        if current:
+            batches.append(current)
+        return batches
+
+    def failed_entity_ids(self, text: str) -> List[str]:
+        """Entity ids the bulk RPC reported as not stored.
+
+        Only an explicit {"failed": [...]} object counts; any other 2xx body
+        (for example the stored rows) means the whole batch was accepted.
+        """
+        try:
+            data = self.codec.loads(text) if text else None
+        except ValueError:
+            return []
+        if not isinstance(data, dict):
+            return []
+        data = data.get("failed")
+        if not isinstance(data, list):
+            return []
+        ids = []
+        for item in data:
+            if isinstance(item, dict):
+                item = item.get("entity_id")
+            if item:
+                ids.append(item)
+        return ids
+
+    async def post_supabase_bulk(self, payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Send a batch to the bulk RPC and return the payloads that could not be stored."""
+        url = f"{self.supabase_url}/rest/v1/rpc/sp_report_entities"
+        pending = payloads
+        attempt = 1
+        while True:
+            status, text = await self.http_post(url, {"p_client_id": self.client_id, "p_entities": pending})
+            if status < 300:
+                failed = set(self.failed_entity_ids(text))
+                if not failed:
+                    logging.debug("Supabase bulk ok %s (%s entidades)", status, len(pending))
+                    return []
+                logging.warning("Supabase rechazó %s de %s entidades", len(failed), len(pending))
+                pending = [p for p in pending if p.get("entity_id") in failed]
+            else:
+                logging.error("Supabase error %s %s", status, text)
+            if attempt >= 3:
+                return pending
+            self.m_retries.labels("sp_report_entities").inc()
+            delay = min(2 ** (attempt - 1), 10)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def post_timeseries(self, window: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Send one flush window of aggregated series, split by the bulk batch limits; returns the series that failed."""
+        url = f"{self.supabase_url}/rest/v1/rpc/sp_report_timeseries"
+        async def send(batch):
+            body = {
+                "p_client_id": self.client_id,
+                "p_window_start": window["start"],
+                "p_window_end": window["end"],
+                "p_series": batch,
+            }
+            attempt = 1
+            while True:
+                try:
+                    status, text = await self.http_post(url, body)
+                except Exception as e:
+                    status, text = 0, str(e)
+                if status and status < 300:
+                    return []
+                logging.error("Supabase error series %s %s", status, text)
+                if attempt >= 3:
+                    return batch
+                self.m_retries.labels("sp_report_timeseries").inc()
+                delay = min(2 ** (attempt - 1), 10)
+                attempt += 1
+                await asyncio.sleep(delay)
+        results = await self.run_limited(send, self.make_batches(window["series"]))
+        return [s for r in results for s in r]
+
+    async def ship_window(self, window: Dict[str, Any]) -> bool:
+        """Post a history window; series that still fail are kept in the outbox for drain_outbox."""
+        failed = await self.post_timeseries(window)
+        if not failed:
+            return True
+        if self.outbox is not None:
+            self.outbox.put_window(dict(window, series=failed))
+            logging.warning("Historial: %s series guardadas en el outbox para reintentar", len(failed))
+        else:
+            logging.error("Historial: se descartan %s series de la ventana", len(failed))
+        return False
+
+    @staticmethod
+    def covered_by_series(items: List[Dict[str, Any]], window: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Drop payloads whose state is the `last` value of their series in this window."""
+        last = {s["entity_id"]: s["last"] for s in window["series"]}
+        kept = []
+        for p in items:
+            eid = p.get("entity_id")
+            if eid in last and not p.get("removed"):
+                try:
+                    if float(p.get("state")) == last[eid]:
+                        continue
+                except (TypeError, ValueError):
+                    pass
+            kept.append(p)
+        return kept
+
+    async def deliver(self, payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Send payloads with the configured delivery mode and return the ones that failed."""
+        async def send_batch(batch):
+            try:
+                return await self.post_supabase_bulk(batch)
+            except Exception as e:
+                logging.error("Error enviando lote a Supabase: %s", e)
+                return batch
+        async def send_one(payload):
+            try:
+                if await self.post_supabase(payload):
+                    return []
+            except Exception as e:
+                logging.error("Error enviando a Supabase: %s", e)
+            return [payload]
+        if self.delivery_mode == "bulk":
+            results = await self.run_limited(send_batch, self.make_batches(payloads))
+        else:
+            results = await self.run_limited(send_one, payloads)
+        failed = [p for r in results for p in r]
+        if failed:
+            logging.error("%s entidades no se pudieron enviar a Supabase", len(failed))
+        return failed
+
     async def auth(self, ws):
         msg = await ws.recv()
         data = json.loads(msg)
@@ -138,93 +637,742 @@ class HAOSReporter:
         if data.get("type") != "auth_ok":
             raise RuntimeError("WebSocket auth fallida")
 
-    async def request_get_states(self, ws):
+    async def send_request(self, ws, message: Dict[str, Any], on_result: Optional[Callable[[Any], None]] = None,
+                           raw: bool = False) -> Any:
+        """Send a command and wait for its result, which is dispatched by receiver().
+
+        on_result runs inside receiver() before the next frame is processed, so it
+        sees the result in websocket order relative to events. With raw=True the
+        result frame is returned undecoded.
+        """
         req_id = self.next_id()
-        await ws.send(json.dumps({"id": req_id, "type": "get_states"}))
-        while True:
-            msg = await ws.recv()
-            data = json.loads(msg)
-            if data.get("id") == req_id and data.get("type") == "result":
-                if data.get("success"):
-                    return data.get("result", [])
-                else:
-                    raise RuntimeError("get_states sin éxito")
+        fut = asyncio.get_running_loop().create_future()
+        def handle(data):
+            if on_result is not None and data.get("success"):
+                on_result(data.get("result"))
+            if not fut.done():
+                fut.set_result(data)
+        self.pending_requests[req_id] = handle
+        if raw:
+            self.raw_requests.add(req_id)
+        try:
+            await ws.send(json.dumps({"id": req_id, **message}))
+            return await fut
+        finally:
+            self.pending_requests.pop(req_id, None)
+            self.raw_requests.discard(req_id)
 
-    async def subscribe_state_changed(self, ws):
+    def load_snapshot(self, states: List[Dict[str, Any]]):
+        for s in states or []:
+            self.load_snapshot_state(s)
+
+    def load_snapshot_state(self, state: Dict[str, Any]) -> bool:
+        """Queue one snapshot payload without replacing newer events; returns whether it matched the filter."""
+        eid = state.get("entity_id")
+        if not eid or not self.matches(eid):
+            return False
+        if self.snapshot_live is not None and eid in self.snapshot_live:
+            return True
+        payload = self.build_payload(state)
+        current = self.changed_buffer.get(eid)
+        if current and (current.get("last_changed") or "") > (payload.get("last_changed") or ""):
+            return True
+        if eid in self.urgent_last_changed and self.urgent_last_changed[eid] >= (payload.get("last_changed") or ""):
+            return True
+        self.changed_buffer[eid] = payload
+        self.throttle.accept(eid, payload)
+        return True
+
+    async def stream_snapshot(self, msg: Any) -> List[str]:
+        """Load a raw get_states result entity by entity and return the matching entity ids.
+
+        Each state is decoded, filtered and projected as it is read, and the
+        buffer is flushed every snapshot_chunk entities, so besides the frame
+        text only one chunk of payloads is alive at a time. A result that
+        arrived inside a coalesced frame is already decoded and is walked as is.
+        """
+        if isinstance(msg, dict):
+            if not msg.get("success"):
+                raise RuntimeError(f"get_states sin éxito: {msg.get('error')}")
+            states = iter(msg.get("result") or [])
+        else:
+            if isinstance(msg, bytes):
+                msg = msg.decode("utf-8")
+            m = self.RESULT_ARRAY_RE.search(msg)
+            if m is None:
+                data = self.codec.loads(msg)
+                raise RuntimeError(f"get_states sin éxito: {data.get('error')}")
+            states = iter_array(msg, m.end())
+        present: List[str] = []
+        for i, state in enumerate(states, 1):
+            if self.load_snapshot_state(state):
+                present.append(state["entity_id"])
+            if self.snapshot_chunk and len(self.changed_buffer) >= self.snapshot_chunk:
+                await self.flush_buffer("snapshot")
+            elif i % 200 == 0:
+                await asyncio.sleep(0)
+        return present
+
+    async def request_get_states(self, ws) -> List[str]:
+        """Stream the get_states result into the buffer; entities with live events meanwhile keep the event.
+
+        snapshot_seen keeps collecting live and reported entity ids after the
+        stream ends, until queue_removed consumes it.
+        """
+        self.snapshot_live = set()
+        self.snapshot_seen = set()
+        try:
+            msg = await self.send_request(ws, {"type": "get_states"}, raw=True)
+            return await self.stream_snapshot(msg)
+        finally:
+            self.snapshot_live = None
+
+    async def subscribe(self, ws, message: Dict[str, Any]) -> int:
+        """Send a command before receiver() runs and wait for its result.
+
+        Messages coalesced into the same frame after the result are kept in
+        early_messages for receiver() to handle first.
+        """
         req_id = self.next_id()
-        await ws.send(json.dumps({"id": req_id, "type": "subscribe_events", "event_type": "state_changed"}))
+        await ws.send(json.dumps({"id": req_id, **message}))
         while True:
-            msg = await ws.recv()
-            data = json.loads(msg)
-            if data.get("id") == req_id and data.get("type") == "result":
-                if data.get("success"):
+            messages = self.decode_messages(await ws.recv())
+            self.m_frames.inc()
+            self.m_messages.inc(len(messages))
+            for i, data in enumerate(messages):
+                if data.get("id") == req_id and data.get("type") == "result":
+                    if not data.get("success"):
+                        raise RuntimeError(f"{message['type']} sin éxito")
+                    self.early_messages.extend(messages[i + 1:])
+                    return req_id
+
+    async def negotiate_features(self, ws):
+        """Ask HA to coalesce queued messages into JSON-array frames; cores without support keep one message per frame."""
+        if not self.coalesce_messages:
+            return
+        try:
+            await self.subscribe(ws, {"type": "supported_features", "features": {"coalesce_messages": 1}})
+        except RuntimeError as e:
+            logging.warning("Home Assistant no acepta coalesce_messages, se continúa sin agrupar: %s", e)
+
+    async def subscribe_state_changed(self, ws):
+        await self.subscribe(ws, {"type": "subscribe_events", "event_type": "state_changed"})
+
+    def subscribed_entity_ids(self) -> Optional[List[str]]:
+        """Entity ids for subscribe_entities, or None when globs require the full stream."""
+        return self.entity_filter.exact_ids()
+
+    async def subscribe_entities(self, ws):
+        message: Dict[str, Any] = {"type": "subscribe_entities"}
+        entity_ids = self.subscribed_entity_ids()
+        if entity_ids is not None:
+            message["entity_ids"] = entity_ids
+        self.entity_mirror.clear()
+        self.mirror_loaded = asyncio.Event()
+        self.entities_sub_id = await self.subscribe(ws, message)
+
+    @staticmethod
+    def iso_timestamp(ts: Any) -> Optional[str]:
+        if ts is None:
+            return None
+        return datetime.fromtimestamp(float(ts), timezone.utc).isoformat()
+
+    def apply_entities_diff(self, event: Dict[str, Any]):
+        """Apply a compressed subscribe_entities message to the mirror and buffer the results."""
+        for eid, st in (event.get("a") or {}).items():
+            if not self.matches(eid):
+                self.m_events_filtered.inc()
+                continue
+            last_changed = self.iso_timestamp(st.get("lc"))
+            state = {
+                "entity_id": eid,
+                "state": st.get("s"),
+                "attributes": st.get("a") or {},
+                "last_changed": last_changed,
+                "last_updated": self.iso_timestamp(st.get("lu")) or last_changed,
+            }
+            self.entity_mirror[eid] = state
+            self.enqueue(eid, self.build_payload(state))
+        for eid, diff in (event.get("c") or {}).items():
+            state = self.entity_mirror.get(eid)
+            if state is None:
+                continue
+            added = diff.get("+") or {}
+            removed = diff.get("-") or {}
+            if "s" in added:
+                state["state"] = added["s"]
+            if "a" in added or "a" in removed:
+                attributes = dict(state["attributes"])
+                attributes.update(added.get("a") or {})
+                for key in removed.get("a") or []:
+                    attributes.pop(key, None)
+                state["attributes"] = attributes
+            if "lc" in added:
+                state["last_changed"] = state["last_updated"] = self.iso_timestamp(added["lc"])
+            elif "lu" in added:
+                state["last_updated"] = self.iso_timestamp(added["lu"])
+            self.enqueue(eid, self.build_payload(state))
+        for eid in event.get("r") or []:
+            if self.entity_mirror.pop(eid, None) is not None and self.report_removed:
+                self.enqueue(eid, self.removal_payload(eid))
+        self.mirror_loaded.set()
+
+    def enqueue(self, entity_id: str, payload: Dict[str, Any]):
+        """Buffer a payload and wake periodic_flush when a size trigger is crossed."""
+        self.m_events_matched.inc()
+        if self.history is not None:
+            self.history.record(entity_id, payload.get("state"))
+        if self.snapshot_live is not None:
+            self.snapshot_live.add(entity_id)
+        if self.snapshot_seen is not None:
+            self.snapshot_seen.add(entity_id)
+        if not self.throttle.admit(entity_id, payload):
+            return
+        if self.is_priority(entity_id, payload):
+            self.send_urgent(entity_id, payload)
+            return
+        if self.buffer_since is None:
+            self.buffer_since = time.monotonic()
+            if self.flush_max_age:
+                self.flush_wakeup.set()
+        self.changed_buffer[entity_id] = payload
+        if self.flush_max_bytes:
+            size = self.estimate_size(payload)
+            self.buffer_bytes += size - self.buffer_sizes.get(entity_id, 0)
+            self.buffer_sizes[entity_id] = size
+        if not self.flush_requested and (
+            (self.flush_max_entries and len(self.changed_buffer) >= self.flush_max_entries)
+            or (self.flush_max_bytes and self.buffer_bytes >= self.flush_max_bytes)
+        ):
+            self.flush_requested = True
+            self.flush_wakeup.set()
+
+    @staticmethod
+    def estimate_size(payload: Dict[str, Any]) -> int:
+        """Approximate encoded size of a payload from its projected attributes, without serializing it.
+
+        Strings count their length; scalars a fixed 8 bytes; nested lists
+        and dicts 16 bytes per item. Only used for the flush_max_bytes trigger.
+        """
+        size = 64 + len(payload.get("entity_id") or "") + len(str(payload.get("state"))) + len(payload.get("last_changed") or "")
+        for key, value in (payload.get("attributes") or {}).items():
+            size += len(key) + 4
+            if isinstance(value, str):
+                size += len(value) + 2
+            elif isinstance(value, (list, tuple, dict)):
+                size += 16 * len(value) + 2
+            else:
+                size += 8
+        return size
+
+    def is_priority(self, entity_id: str, payload: Dict[str, Any]) -> bool:
+        if self.priority_filter is not None and self.priority_filter.matches(entity_id):
+            return True
+        return bool(self.priority_device_classes) and (payload.get("attributes") or {}).get("device_class") in self.priority_device_classes
+
+    def send_urgent(self, entity_id: str, payload: Dict[str, Any]):
+        """Hand a priority payload to its entity's lane task, starting one if none is running."""
+        if not self.reporting_enabled:
+            return
+        self.drop_buffered(entity_id)
+        self.urgent_pending[entity_id] = (payload, time.monotonic())
+        self.urgent_last_changed[entity_id] = payload.get("last_changed") or ""
+        for sink in self.sinks:
+            sink.offer([payload])
+        if entity_id not in self.urgent_tasks:
+            self.urgent_tasks[entity_id] = asyncio.create_task(self.urgent_worker(entity_id))
+
+    async def urgent_worker(self, entity_id: str):
+        """Deliver an entity's priority payloads one at a time (latest wins) outside flush_lock."""
+        URGENT_LANE.set(True)
+        current = None
+        try:
+            while entity_id in self.urgent_pending:
+                current = self.urgent_pending.pop(entity_id)
+                if self.supabase_filter is not None and not self.supabase_filter.matches(entity_id):
+                    current = None
+                    continue
+                failed = await self.report([current[0]])
+                if not failed:
+                    self.m_priority_sent.inc()
+                    self.m_priority_latency.observe(time.monotonic() - current[1])
+                current = None
+        except asyncio.CancelledError:
+            # Keep the in-flight payload so close_outbox can persist it.
+            if current is not None:
+                self.urgent_pending.setdefault(entity_id, current)
+            raise
+        except Exception as e:
+            logging.error("Error en el envío prioritario de %s: %s", entity_id, e)
+        finally:
+            self.urgent_tasks.pop(entity_id, None)
+
+    def drop_buffered(self, entity_id: str):
+        """Forget an entity's buffered and staged payloads so a later bulk flush cannot overwrite its urgent state."""
+        if self.changed_buffer.pop(entity_id, None) is not None:
+            self.buffer_bytes -= self.buffer_sizes.pop(entity_id, 0)
+        self.supabase_pending.pop(entity_id, None)
+
+    def reset_buffer_stats(self):
+        self.buffer_since = None
+        self.buffer_bytes = 0
+        self.buffer_sizes.clear()
+        self.flush_requested = False
+
+    def raw_filtered_out(self, msg: str) -> bool:
+        """True for a state_changed event message whose entity the filter rejects.
+
+        HA serializes the event data with entity_id first, so the first match is
+        the event's entity; the message id may come first or, as HA sends
+        events, last. Anything that does not look like a plain
+        state_changed event message is left for the full decoder.
+        """
+        if not self.EVENT_FRAME_RE.match(msg):
+            return False
+        m = self.ENTITY_ID_RE.search(msg)
+        return m is not None and not self.matches(m.group(1))
+
+    def skip_raw_frame(self, msg: Any) -> bool:
+        """Cheaply drop state_changed frames for filtered-out entities before decoding them."""
+        if not isinstance(msg, str) or not self.raw_filtered_out(msg):
+            return False
+        self.prefiltered_count += 1
+        self.m_events_prefiltered.inc()
+        return True
+
+    def split_array_frame(self, msg: str) -> Optional[List[str]]:
+        """Split a coalesced `[{...},{...}]` frame into the raw text of its messages.
+
+        Every HA message starts with `{"type":`, or `{"id":N,"type":` when
+        HA puts the id first (results do, events carry it last); neither can
+        appear inside a JSON string, as its quotes would be escaped. Returns None when
+        the frame does not start with such a message; a split that lands
+        inside a nested object yields a fragment that fails to decode, and
+        handle_frame then falls back to decoding the whole frame.
+        """
+        starts = [m.start(1) for m in self.MESSAGE_START_RE.finditer(msg)]
+        if not starts or msg[1:starts[0]].strip():
+            return None
+        parts = [msg[a:b].rstrip().rstrip(",") for a, b in zip(starts, starts[1:])]
+        parts.append(msg[starts[-1]:].rstrip()[:-1])
+        return parts
+
+    def prefilter_array_frame(self, msg: str) -> Optional[List[Dict[str, Any]]]:
+        """Decode only the messages of a coalesced frame that survive the raw prefilter.
+
+        Returns None when the frame has to be decoded whole instead.
+        """
+        parts = self.split_array_frame(msg)
+        if parts is None:
+            return None
+        kept = [p for p in parts if not self.raw_filtered_out(p)]
+        if len(kept) == len(parts):
+            return None
+        try:
+            messages = [self.codec.loads(p) for p in kept]
+        except ValueError:
+            return None
+        if not all(isinstance(m, dict) for m in messages):
+            return None
+        skipped = len(parts) - len(kept)
+        self.prefiltered_count += skipped
+        self.m_events_prefiltered.inc(skipped)
+        self.m_messages.inc(skipped)
+        return messages
+
+    def handle_frame(self, msg: Any):
+        if self.raw_requests and isinstance(msg, str):
+            m = self.RESULT_FRAME_RE.match(msg)
+            if m and int(m.group(1)) in self.raw_requests:
+                handler = self.pending_requests.pop(int(m.group(1)), None)
+                if handler:
+                    handler(msg)
+                self.m_messages.inc()
+                return
+        if self.raw_prefilter and isinstance(msg, str):
+            if msg.startswith("["):
+                messages = self.prefilter_array_frame(msg)
+                if messages is not None:
+                    self.m_messages.inc(len(messages))
+                    for item in messages:
+                        self.handle_message(item)
                     return
-                else:
-                    raise RuntimeError("subscribe_events sin éxito")
+            elif self.skip_raw_frame(msg):
+                self.m_messages.inc()
+                return
+        data = self.codec.loads(msg)
+        if isinstance(data, list):
+            self.m_messages.inc(len(data))
+            for item in data:
+                self.handle_message(item)
+        else:
+            self.m_messages.inc()
+            self.handle_message(data)
+
+    def decode_messages(self, msg: Any) -> List[Dict[str, Any]]:
+        data = self.codec.loads(msg)
+        return data if isinstance(data, list) else [data]
+
+    def handle_message(self, data: Dict[str, Any]):
+        t = data.get("type")
+        if t == "event" and self.entities_sub_id is not None and data.get("id") == self.entities_sub_id:
+            self.apply_entities_diff(data.get("event", {}))
+        elif t == "event":
+            ev = data.get("event", {})
+            et = ev.get("event_type")
+            if et == "state_changed":
+                event_data = ev.get("data", {})
+                new_state = event_data.get("new_state")
+                if new_state:
+                    entity_id = new_state.get("entity_id")
+                    if entity_id and self.matches(entity_id):
+                        self.enqueue(entity_id, self.build_payload(new_state))
+                    else:
+                        self.m_events_filtered.inc()
+                elif self.report_removed:
+                    entity_id = event_data.get("entity_id")
+                    if entity_id and self.matches(entity_id):
+                        self.enqueue(entity_id, self.removal_payload(entity_id))
+        elif t == "result":
+            handler = self.pending_requests.pop(data.get("id"), None)
+            if handler:
+                handler(data)
 
     async def receiver(self, ws):
+        while self.early_messages:
+            self.handle_message(self.early_messages.pop(0))
         while True:
             msg = await ws.recv()
-            data = json.loads(msg)
-            if data.get("type") == "event":
-                ev = data.get("event", {})
-                et = ev.get("event_type")
-                if et == "state_changed":
-                    new_state = ev.get("data", {}).get("new_state")
-                    if new_state:
-                        entity_id = new_state.get("entity_id")
-                        if entity_id and self.matches(entity_id):
-                            payload = self.build_payload(new_state)
-                            self.changed_buffer[entity_id] = payload
-
-    async def flush_buffer(self):
+            self.m_frames.inc()
+            self.handle_frame(msg)
+
+    async def flush_buffer(self, trigger: str = "manual"):
+        """Hand the buffer to the sinks and to Supabase, and return once Supabase got it."""
+        await self.finish_flush(trigger, self.stage_flush())
+
+    def stage_flush(self) -> Optional[Dict[str, Any]]:
+        """Swap the buffer, feed the sinks and queue the payloads for Supabase; return the history window.
+
+        Nothing here waits for Supabase: payloads are merged (latest wins)
+        into supabase_pending, which a single reporter drains under
+        flush_lock, so a slow Supabase never holds back the sinks or the
+        next buffer swap.
+        """
         if not self.reporting_enabled:
             self.changed_buffer.clear()
-            return
-        items = list(self.changed_buffer.items())
-        for _, payload in items:
-            try:
-                await self.post_supabase(payload)
-            except Exception as e:
-                logging.error("Error enviando a Supabase: %s", e)
+            self.reset_buffer_stats()
+            self.supabase_pending.clear()
+            if self.history is not None:
+                self.history.take_window()
+            return None
+        for payload in self.throttle.release():
+            self.changed_buffer[payload["entity_id"]] = payload
+        items = list(self.changed_buffer.values())
+        if self.buffer_since is not None and (self.pending_since is None or self.buffer_since < self.pending_since):
+            self.pending_since = self.buffer_since
+        self.pending_bytes += self.buffer_bytes
         self.changed_buffer.clear()
+        self.reset_buffer_stats()
+        window = None
+        if self.history is not None:
+            window = self.history.take_window()
+            if not window["series"]:
+                window = None
+        if items:
+            for sink in self.sinks:
+                sink.offer(items)
+        if window is not None and not self.history_report_states:
+            items = self.covered_by_series(items, window)
+        if self.supabase_filter is not None:
+            items = [p for p in items if self.supabase_filter.matches(p["entity_id"])]
+        for payload in items:
+            self.supabase_pending.pop(payload["entity_id"], None)
+            self.supabase_pending[payload["entity_id"]] = payload
+        return window
+
+    async def finish_flush(self, trigger: str, window: Optional[Dict[str, Any]]):
+        """Report the staged payloads (or wait for the flush already reporting them), then ship the window."""
+        if self.flush_idle.is_set():
+            await self.report_pending(trigger)
+        else:
+            await self.flush_idle.wait()
+        # The series go out after the states so a slow series RPC never delays the next flush.
+        if window is not None:
+            await self.ship_window(window)
+
+    async def report_pending(self, trigger: str):
+        """Report supabase_pending under flush_lock until it is empty."""
+        self.flush_idle.clear()
+        try:
+            async with self.flush_lock:
+                while self.supabase_pending:
+                    items = list(self.supabase_pending.values())
+                    size = self.pending_bytes
+                    age = time.monotonic() - self.pending_since if self.pending_since is not None else 0.0
+                    self.supabase_pending.clear()
+                    self.pending_bytes = 0
+                    self.pending_since = None
+                    start = time.monotonic()
+                    failed = await self.report(items)
+                    self.m_flushes.labels(trigger).inc()
+                    self.m_flush_duration.observe(time.monotonic() - start)
+                    self.m_flushed.inc(len(items))
+                    self.m_flush_failed.inc(len(failed))
+                    self.last_flush_stats = {
+                        "trigger": trigger,
+                        "depth": len(items),
+                        "bytes": size,
+                        "oldest_age": round(age, 3),
+                        "duration": round(time.monotonic() - start, 3),
+                        "failed": len(failed),
+                    }
+                    logging.info(
+                        "Flush (%s): %s entidades, ~%s bytes, más antigua %.1fs, duración %.2fs, fallidas %s",
+                        trigger, len(items), size, age, self.last_flush_stats["duration"], len(failed),
+                    )
+                    self.save_state_cache()
+        finally:
+            self.flush_idle.set()
+
+    async def report(self, payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Suppress unchanged payloads, deliver the rest and remember what was stored.
+
+        Failed payloads are kept in the outbox (full, never as deltas) and
+        delivered entities are removed from it.
+        """
+        suppressed = self.suppressed_count
+        originals = {p.get("entity_id"): p for p in payloads}
+        to_send, pending = self.prepare_payloads(payloads)
+        failed = await self.deliver(to_send) if to_send else []
+        self.mark_reported(pending, failed)
+        failed_ids = {p.get("entity_id") for p in failed}
+        self.forget_reported(eid for eid, p in originals.items() if p.get("removed") and eid not in failed_ids)
+        if self.outbox is not None:
+            self.outbox.remove([eid for eid in originals if eid not in failed_ids])
+            if failed:
+                self.outbox.put_many(originals[eid] for eid in failed_ids if eid in originals)
+        logging.debug(
+            "Flush: %s enviados, %s suprimidos (total suprimidos %s)",
+            len(to_send), self.suppressed_count - suppressed, self.suppressed_count,
+        )
+        return failed
+
+    async def initial_snapshot(self, ws):
+        """Load the initial states into the buffer and upload them right away in the background.
+
+        With subscribe_entities the first message already carries every state,
+        so get_states is skipped.
+        """
+        try:
+            if self.entities_sub_id is not None:
+                await self.mirror_loaded.wait()
+                states = self.entity_mirror
+            else:
+                states = await self.request_get_states(ws)
+            removed = self.queue_removed(states)
+            logging.info("Snapshot inicial: %s entidades, %s eliminadas desde el último reporte", len(states), removed)
+            await self.flush_buffer()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error("Snapshot inicial fallido: %s", e)
+            self.snapshot_seen = None
+            await ws.close()
+
+    def open_outbox(self):
+        if not self.outbox_enabled:
+            return
+        self.outbox = Outbox(
+            os.path.join(self.data_dir, "outbox.db"),
+            max_entries=self.outbox_max_entries,
+            max_bytes=self.outbox_max_mb * 1024 * 1024,
+        )
+        try:
+            self.outbox.open()
+        except Exception as e:
+            logging.error("No se pudo abrir el outbox, se continúa sin persistencia: %s", e)
+            self.outbox = None
+
+    def close_outbox(self):
+        """Persist whatever is still buffered so a restart does not lose it."""
+        if self.outbox is None:
+            return
+        try:
+            if self.reporting_enabled and self.changed_buffer:
+                self.outbox.put_many(self.changed_buffer.values())
+            if self.reporting_enabled and self.supabase_pending:
+                self.outbox.put_many(self.supabase_pending.values())
+            if self.reporting_enabled and self.urgent_pending:
+                self.outbox.put_many(payload for payload, _ in self.urgent_pending.values())
+            self.outbox.close()
+        except Exception as e:
+            logging.error("Error cerrando el outbox: %s", e)
+        self.outbox = None
+
+    def open_state_cache(self):
+        """Restore the last reported digests so a restart resyncs only what changed."""
+        if not self.state_cache_enabled:
+            return
+        self.state_cache = StateCache(os.path.join(self.data_dir, "reported_state.json"))
+        digests, reported_at = self.state_cache.load()
+        self.reported_digests.update(digests)
+        self.reported_at.update(reported_at)
+        if digests:
+            logging.info("Caché de estados reportados: %s entidades", len(digests))
+
+    def save_state_cache(self, force: bool = False):
+        if self.state_cache is None or not self.state_cache_dirty:
+            return
+        if not force and time.monotonic() - self.state_cache.saved_at < self.state_cache_interval:
+            return
+        try:
+            self.state_cache.save(self.reported_digests, self.reported_at)
+            self.state_cache_dirty = False
+        except Exception as e:
+            logging.error("No se pudo guardar el caché de estados reportados: %s", e)
+
+    async def drain_outbox(self):
+        """Re-send outbox entries in rate-limited batches, backing off while Supabase keeps failing.
+
+        History windows kept after a failed sp_report_timeseries are re-sent
+        too, one window per cycle, outside flush_lock.
+        """
+        delay = self.update_interval
+        while True:
+            await asyncio.sleep(delay)
+            if not self.reporting_enabled or self.outbox is None or not (self.outbox.count or self.outbox.windows):
+                delay = self.update_interval
+                continue
+            payloads: List[Dict[str, Any]] = []
+            failed: List[Dict[str, Any]] = []
+            if self.outbox.count:
+                async with self.flush_lock:
+                    rows = self.outbox.take(self.outbox_drain_batch)
+                    queued = {p.get("entity_id") for p in rows}
+                    queued = {eid for eid in queued
+                              if eid in self.changed_buffer or eid in self.supabase_pending or eid in self.urgent_tasks}
+                    self.outbox.remove(queued)
+                    payloads = [p for p in rows if p.get("entity_id") not in queued]
+                    failed = await self.report(payloads) if payloads else []
+                    self.save_state_cache()
+            windows_failed = False
+            for window_id, window in self.outbox.take_windows(1):
+                self.outbox.remove_window(window_id)
+                windows_failed = not await self.ship_window(window)
+            if (payloads and len(failed) == len(payloads)) or windows_failed:
+                delay = min(max(delay * 2, 1), 300)
+                logging.warning("Outbox: Supabase sigue fallando, próximo intento en %ss", delay)
+            else:
+                delay = max(len(payloads) / self.outbox_drain_rate, 1 if self.outbox.windows else 0)
+                logging.info("Outbox: %s entidades reenviadas, %s pendientes", len(payloads) - len(failed), self.outbox.count)
 
     async def run(self):
         self.load_options()
         self.setup_logging()
+        if self.options.get("sites"):
+            from .gateway import Gateway
+            await Gateway(self).run()
+            return
         self.supervisor_token = self.load_supervisor_token()
         self.validate_required()
+        metrics_runner = await self.start_metrics()
+        try:
+            await self.run_session()
+        finally:
+            await self.close_session()
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+
+    async def run_session(self):
+        """Keep the websocket session alive, reconnecting with backoff, until cancelled.
+
+        Owns the outbox, state cache, sinks and priority lane; the HTTP session
+        and metrics endpoint are left to the caller so a gateway can share them.
+        """
+        self.open_outbox()
+        self.open_state_cache()
+        for sink in self.sinks:
+            sink.start()
+        drain_task = asyncio.create_task(self.drain_outbox())
         backoff = 1
-        while True:
-            try:
-                async with websockets.connect(self.ws_url, ping_interval=30, ping_timeout=20) as ws:
-                    await self.auth(ws)
-                    states = await self.request_get_states(ws)
-                    if self.reporting_enabled:
-                        for s in states:
-                            eid = s.get("entity_id")
-                            if eid and self.matches(eid):
-                                payload = self.build_payload(s)
-                                await self.post_supabase(payload)
-                    await self.subscribe_state_changed(ws)
-                    self.connected_once = True
-                    backoff = 1
-                    flush_task = asyncio.create_task(self.periodic_flush())
-                    try:
-                        await self.receiver(ws)
-                    finally:
-                        flush_task.cancel()
-                        with contextlib.suppress(Exception):
-                            await flush_task
-            except Exception as e:
-                logging.error("Desconectado del WebSocket: %s", e)
-                await asyncio.sleep(backoff)
-                backoff = min(backoff * 2, 60)
+        try:
+            while True:
+                try:
+                    async with websockets.connect(self.ws_url, ping_interval=30, ping_timeout=20, max_size=None) as ws:
+                        self.pending_requests.clear()
+                        self.early_messages.clear()
+                        self.entities_sub_id = None
+                        await self.auth(ws)
+                        await self.negotiate_features(ws)
+                        if self.event_source == "subscribe_entities":
+                            await self.subscribe_entities(ws)
+                        else:
+                            await self.subscribe_state_changed(ws)
+                        self.connected_once = True
+                        self.ws_connected = True
+                        backoff = 1
+                        tasks = [
+                            asyncio.create_task(self.periodic_flush()),
+                            asyncio.create_task(self.initial_snapshot(ws)),
+                        ]
+                        try:
+                            await self.receiver(ws)
+                        finally:
+                            self.ws_connected = False
+                            for task in tasks:
+                                task.cancel()
+                            await asyncio.gather(*tasks, return_exceptions=True)
+                except Exception as e:
+                    logging.error("Desconectado del WebSocket: %s", e)
+                    self.m_reconnects.inc()
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 60)
+        finally:
+            drain_task.cancel()
+            urgent = list(self.urgent_tasks.values())
+            for task in urgent:
+                task.cancel()
+            await asyncio.gather(drain_task, *urgent, return_exceptions=True)
+            self.close_outbox()
+            self.save_state_cache(force=True)
+            await asyncio.gather(*(sink.stop() for sink in self.sinks), return_exceptions=True)
+
+    def jittered(self, seconds: float) -> float:
+        return seconds * (1 + random.uniform(-self.flush_jitter, self.flush_jitter))
 
     async def periodic_flush(self):
-        while True:
-            await asyncio.sleep(self.update_interval)
-            await self.flush_buffer()
+        """Flush every update_interval (with jitter) or earlier when a trigger fires.
+
+        Triggers: buffer entry count (flush_max_entries), estimated size
+        (flush_max_bytes) and age of the oldest pending change (flush_max_age).
+        Consecutive flushes are always at least flush_min_gap apart.
+        """
+        last = time.monotonic()
+        interval = self.jittered(self.update_interval)
+        try:
+            while True:
+                self.flush_wakeup.clear()
+                now = time.monotonic()
+                due, trigger = last + interval, "interval"
+                if self.buffer_since is not None and self.flush_max_age and self.buffer_since + self.flush_max_age < due:
+                    due, trigger = self.buffer_since + self.flush_max_age, "age"
+                if self.flush_requested:
+                    due, trigger = now, "size"
+                due = max(due, last + self.flush_min_gap)
+                if due > now:
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(self.flush_wakeup.wait(), due - now)
+                    continue
+                task = asyncio.create_task(self.finish_flush(trigger, self.stage_flush()))
+                self.flush_tasks.add(task)
+                task.add_done_callback(self.flush_tasks.discard)
+                last = time.monotonic()
+                interval = self.jittered(self.update_interval)
+        finally:
+            tasks = list(self.flush_tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
 if __name__ == "__main__":
     reporter = HAOSReporter()
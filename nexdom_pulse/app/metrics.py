@@ -0,0 +1,185 @@
+import logging
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Histogram:
+    """Fixed-bucket histogram; observe() is one bisect plus three additions."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricFamily:
+    def __init__(self, name: str, help_text: str, kind: str, labelnames: Tuple[str, ...] = (), factory=None, func=None):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = labelnames
+        self.factory = factory
+        self.func: Optional[Callable[[], Any]] = func
+        self.children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *values: Any):
+        key = tuple(str(v) for v in values)
+        child = self.children.get(key)
+        if child is None:
+            child = self.children[key] = self.factory()
+        return child
+
+    @staticmethod
+    def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+        parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    @staticmethod
+    def format_value(value: float) -> str:
+        if isinstance(value, bool):
+            return "1" if value else "0"
+        if isinstance(value, int) or float(value).is_integer():
+            return str(int(value))
+        return repr(float(value))
+
+    def render(self, out: List[str], const: Tuple[Tuple[str, str], ...] = (), header: bool = True):
+        """Append this family's samples; const label pairs go first on every sample."""
+        if header:
+            out.append(f"# HELP {self.name} {self.help}")
+            out.append(f"# TYPE {self.name} {self.kind}")
+        names = tuple(n for n, _ in const) + self.labelnames
+        prefix = tuple(v for _, v in const)
+        if self.func is not None:
+            try:
+                value = self.func()
+            except Exception as e:
+                logging.debug("Métrica %s no disponible: %s", self.name, e)
+                return
+            if not self.labelnames:
+                out.append(f"{self.name}{self.format_labels(names, prefix)} {self.format_value(value)}")
+                return
+            for label, v in sorted(value.items()):
+                key = label if isinstance(label, tuple) else (label,)
+                out.append(f"{self.name}{self.format_labels(names, prefix + key)} {self.format_value(v)}")
+            return
+        for key, child in sorted(self.children.items()):
+            key = prefix + key
+            if self.kind == "histogram":
+                cumulative = 0
+                for bound, count in zip(child.buckets, child.counts):
+                    cumulative += count
+                    le = self.format_labels(names, key, f'le="{self.format_value(bound)}"')
+                    out.append(f"{self.name}_bucket{le} {cumulative}")
+                le = self.format_labels(names, key, 'le="+Inf"')
+                out.append(f"{self.name}_bucket{le} {child.count}")
+                labels = self.format_labels(names, key)
+                out.append(f"{self.name}_sum{labels} {self.format_value(child.sum)}")
+                out.append(f"{self.name}_count{labels} {child.count}")
+            else:
+                out.append(f"{self.name}{self.format_labels(names, key)} {self.format_value(child.value)}")
+
+
+class MetricsRegistry:
+    """Counters, histograms and callback gauges rendered in Prometheus text format.
+
+    Unlabeled counter() and histogram() return the metric itself; labeled
+    ones return the family, whose labels(...) children should be resolved
+    once and kept by the caller so hot paths only pay for inc()/observe().
+    """
+
+    def __init__(self, prefix: str = "nexdom_pulse"):
+        self.prefix = prefix
+        self.families: Dict[str, MetricFamily] = {}
+
+    def add(self, family: MetricFamily) -> MetricFamily:
+        self.families[family.name] = family
+        return family
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        family = self.add(MetricFamily(f"{self.prefix}_{name}", help_text, "counter", tuple(labels), factory=Counter))
+        return family if labels else family.labels()
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS, labels: Sequence[str] = ()):
+        family = self.add(
+            MetricFamily(f"{self.prefix}_{name}", help_text, "histogram", tuple(labels), factory=lambda: Histogram(buckets))
+        )
+        return family if labels else family.labels()
+
+    def callback(self, name: str, help_text: str, func: Callable[[], Any], kind: str = "gauge", labels: Sequence[str] = ()):
+        """Metric read from func() at scrape time, for values already tracked elsewhere.
+
+        With labels, func() returns a dict of label value (or tuple) to value.
+        """
+        self.add(MetricFamily(f"{self.prefix}_{name}", help_text, kind, tuple(labels), func=func))
+
+    def render(self) -> str:
+        out: List[str] = []
+        for family in self.families.values():
+            family.render(out)
+        return "\n".join(out) + "\n"
+
+
+class MergedRegistry:
+    """Renders several registries as one exposition, telling them apart with a `label` label.
+
+    Each family's HELP/TYPE is written once followed by the samples of every
+    registry, as Prometheus requires.
+    """
+
+    def __init__(self, registries: Dict[str, MetricsRegistry], label: str = "site"):
+        self.registries = registries
+        self.label = label
+
+    def render(self) -> str:
+        out: List[str] = []
+        names: Dict[str, None] = {}
+        for registry in self.registries.values():
+            names.update(dict.fromkeys(registry.families))
+        for name in names:
+            header = True
+            for value, registry in self.registries.items():
+                family = registry.families.get(name)
+                if family is not None:
+                    family.render(out, ((self.label, value),), header)
+                    header = False
+        return "\n".join(out) + "\n"
+
+
+async def start_http_server(registry: Any, host: str, port: int):
+    """Serve GET /metrics from registry.render() and return the aiohttp AppRunner (call cleanup() to stop it)."""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(
+            body=registry.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class Outbox:
+    """Persistent last-wins queue of payloads that could not be delivered.
+
+    Each entity keeps a single row (the newest failed payload). When the
+    store exceeds max_entries or max_bytes the oldest rows are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int = 50000, max_bytes: int = 64 * 1024 * 1024, max_windows: int = 1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_windows = max_windows
+        self.conn: Optional[sqlite3.Connection] = None
+        self.count = 0
+        self.size = 0
+        self.evicted = 0
+        self.windows = 0
+
+    def open(self):
+        if self.conn is not None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "entity_id TEXT PRIMARY KEY, payload TEXT NOT NULL, queued_at REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS outbox_queued_at ON outbox (queued_at)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS series (id INTEGER PRIMARY KEY AUTOINCREMENT, window TEXT NOT NULL)")
+        self.conn.commit()
+        self.refresh_stats()
+        if self.count:
+            logging.info("Outbox con %s entidades pendientes (%s bytes)", self.count, self.size)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def refresh_stats(self):
+        row = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM outbox").fetchone()
+        self.count, self.size = int(row[0]), int(row[1])
+        self.windows = int(self.conn.execute("SELECT COUNT(*) FROM series").fetchone()[0])
+
+    def stored_sizes(self, entity_ids: List[str]) -> Dict[str, int]:
+        sizes: Dict[str, int] = {}
+        for i in range(0, len(entity_ids), 500):
+            chunk = entity_ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            sizes.update(self.conn.execute(f"SELECT entity_id, size FROM outbox WHERE entity_id IN ({marks})", chunk).fetchall())
+        return sizes
+
+    def put_many(self, payloads: Iterable[Dict[str, Any]]) -> int:
+        """Store payloads (replacing older rows of the same entity) and return how many were evicted."""
+        now = time.time()
+        rows: Dict[str, Tuple[str, str, float, int]] = {}
+        for payload in payloads:
+            eid = payload.get("entity_id")
+            if not eid:
+                continue
+            data = json.dumps(payload, separators=(",", ":"), default=str)
+            rows.pop(eid, None)
+            rows[eid] = (eid, data, now, len(data))
+        if not rows:
+            return 0
+        replaced = self.stored_sizes(list(rows))
+        self.conn.executemany("INSERT OR REPLACE INTO outbox (entity_id, payload, queued_at, size) VALUES (?, ?, ?, ?)", rows.values())
+        self.conn.commit()
+        self.count += len(rows) - len(replaced)
+        self.size += sum(r[3] for r in rows.values()) - sum(replaced.values())
+        return self.evict()
+
+    def evict(self) -> int:
+        """Drop the oldest rows so the newest ones fit in max_entries and max_bytes, in a single pass."""
+        if self.count <= self.max_entries and self.size <= self.max_bytes:
+            return 0
+        victims = self.conn.execute(
+            "SELECT entity_id, size FROM ("
+            " SELECT entity_id, size,"
+            " SUM(size) OVER (ORDER BY queued_at DESC, rowid DESC) AS kept_bytes,"
+            " ROW_NUMBER() OVER (ORDER BY queued_at DESC, rowid DESC) AS kept_rows"
+            " FROM outbox) WHERE kept_rows > ? OR kept_bytes > ?",
+            (self.max_entries, self.max_bytes),
+        ).fetchall()
+        if not victims:
+            return 0
+        self.conn.executemany("DELETE FROM outbox WHERE entity_id = ?", [(eid,) for eid, _ in victims])
+        self.conn.commit()
+        evicted = len(victims)
+        self.count -= evicted
+        self.size -= sum(size for _, size in victims)
+        self.evicted += evicted
+        logging.warning("Outbox lleno: se descartaron %s entidades antiguas", evicted)
+        return evicted
+
+    def take(self, limit: int) -> List[Dict[str, Any]]:
+        """Return up to limit payloads, oldest first, without removing them."""
+        rows = self.conn.execute("SELECT payload FROM outbox ORDER BY queued_at LIMIT ?", (limit,)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def remove(self, entity_ids: Iterable[str]):
+        ids = list({eid for eid in entity_ids if eid})
+        if not ids or not self.count:
+            return
+        stored = self.stored_sizes(ids)
+        if not stored:
+            return
+        self.conn.executemany("DELETE FROM outbox WHERE entity_id = ?", [(eid,) for eid in stored])
+        self.conn.commit()
+        self.count -= len(stored)
+        self.size -= sum(stored.values())
+
+    def put_window(self, window: Dict[str, Any]):
+        """Keep a history window whose delivery failed; beyond max_windows the oldest are dropped."""
+        self.conn.execute("INSERT INTO series (window) VALUES (?)", (json.dumps(window, separators=(",", ":")),))
+        self.windows += 1
+        if self.windows > self.max_windows:
+            cur = self.conn.execute(
+                "DELETE FROM series WHERE id IN (SELECT id FROM series ORDER BY id LIMIT ?)", (self.windows - self.max_windows,))
+            self.windows -= cur.rowcount
+            logging.warning("Outbox lleno: se descartaron %s ventanas de historial antiguas", cur.rowcount)
+        self.conn.commit()
+
+    def take_windows(self, limit: int) -> List[Tuple[int, Dict[str, Any]]]:
+        rows = self.conn.execute("SELECT id, window FROM series ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(r[0], json.loads(r[1])) for r in rows]
+
+    def remove_window(self, window_id: int):
+        cur = self.conn.execute("DELETE FROM series WHERE id = ?", (window_id,))
+        self.conn.commit()
+        self.windows -= cur.rowcount
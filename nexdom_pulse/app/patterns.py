@@ -0,0 +1,79 @@
+import re
+from fnmatch import translate
+from typing import Any, Dict, List, Optional, Pattern, Set, Tuple
+
+Names = Tuple[Set[str], Optional[Pattern[str]]]
+
+
+def compile_pattern(pattern: str) -> Pattern[str]:
+    """Compile an entity id or glob into an anchored regex."""
+    return re.compile(translate(pattern) if "*" in pattern else re.escape(pattern) + r"\Z")
+
+
+def compile_names(names: List[str]) -> Names:
+    """Split names into an exact set and one combined regex for globs."""
+    exact = {n for n in names if "*" not in n}
+    globs = [translate(n) for n in names if "*" in n]
+    return exact, re.compile("|".join(globs)) if globs else None
+
+
+def name_matches(names: Names, key: str) -> bool:
+    exact, regex = names
+    return key in exact or (regex is not None and regex.match(key) is not None)
+
+
+class RuleSet:
+    """Ordered per-pattern rules where the first match wins.
+
+    Rules need a compiled `regex`; the lookup per entity id is cached and the
+    cache is bounded to CACHE_SIZE entries with FIFO eviction.
+    """
+
+    CACHE_SIZE = 10000
+
+    def __init__(self, rules: List[Any]):
+        self.rules = rules
+        self.rule_cache: Dict[str, Optional[Any]] = {}
+
+    def rule_for(self, entity_id: str) -> Optional[Any]:
+        if entity_id in self.rule_cache:
+            return self.rule_cache[entity_id]
+        rule = next((r for r in self.rules if r.regex.match(entity_id)), None)
+        if len(self.rule_cache) >= self.CACHE_SIZE:
+            self.rule_cache.pop(next(iter(self.rule_cache)))
+        self.rule_cache[entity_id] = rule
+        return rule
+
+
+class EntityFilter:
+    """entities-style patterns: ids, globs and `!` exclusions, which always win.
+
+    Without include patterns every entity matches. Used for `entities`,
+    `priority_entities` and each sink's `entities`; results are cached per
+    entity id with the same FIFO bound as RuleSet.
+    """
+
+    CACHE_SIZE = 10000
+
+    def __init__(self, patterns: Optional[List[str]] = None):
+        patterns = [p.strip() for p in patterns or ["*"] if p and p.strip()]
+        includes = [p for p in patterns if not p.startswith("!")]
+        self.match_all = not includes or "*" in includes
+        self.include = compile_names(includes)
+        self.exclude = compile_names([p[1:].strip() for p in patterns if p.startswith("!")])
+        self.cache: Dict[str, bool] = {}
+
+    def matches(self, entity_id: str) -> bool:
+        result = self.cache.get(entity_id)
+        if result is None:
+            result = (self.match_all or name_matches(self.include, entity_id)) and not name_matches(self.exclude, entity_id)
+            if len(self.cache) >= self.CACHE_SIZE:
+                self.cache.pop(next(iter(self.cache)))
+            self.cache[entity_id] = result
+        return result
+
+    def exact_ids(self) -> Optional[List[str]]:
+        """The included entity ids when they are all exact (no globs), else None."""
+        if self.match_all or self.include[1] is not None:
+            return None
+        return sorted(eid for eid in self.include[0] if self.matches(eid))
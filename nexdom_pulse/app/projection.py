@@ -0,0 +1,91 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Pattern
+
+from .patterns import Names, RuleSet, compile_names, compile_pattern, name_matches
+
+
+@dataclass
+class AttributeRule:
+    pattern: str
+    regex: Pattern[str]
+    include: Optional[Names] = None
+    exclude: Optional[Names] = None
+    decisions: Dict[str, bool] = field(default_factory=dict)
+
+    @classmethod
+    def from_option(cls, option: Dict[str, Any]) -> "AttributeRule":
+        pattern = str(option.get("pattern", "")).strip()
+        if not pattern:
+            raise ValueError("attribute_rules: falta pattern")
+        include = option.get("include")
+        exclude = option.get("exclude")
+        return cls(
+            pattern=pattern,
+            regex=compile_pattern(pattern),
+            include=compile_names(include) if include else None,
+            exclude=compile_names(exclude) if exclude else None,
+        )
+
+    def keeps(self, key: str) -> bool:
+        decision = self.decisions.get(key)
+        if decision is None:
+            decision = (self.include is None or name_matches(self.include, key)) and (
+                self.exclude is None or not name_matches(self.exclude, key)
+            )
+            self.decisions[key] = decision
+        return decision
+
+
+class Projection(RuleSet):
+    """Per-pattern attribute allow/deny lists plus a global cap on attribute value size.
+
+    The rule for an entity (first match wins) is cached by RuleSet, and
+    each rule memoizes its keep/drop decision per attribute name, so the
+    per-event cost is a few dict lookups. Oversized strings are truncated to
+    max_value_bytes; oversized lists and dicts are dropped.
+    """
+
+    def __init__(self, rules: Optional[List[Dict[str, Any]]] = None, max_value_bytes: int = 0,
+                 dumps: Optional[Callable[[Any], bytes]] = None):
+        super().__init__([AttributeRule.from_option(r) for r in rules or []])
+        self.max_value_bytes = max_value_bytes
+        self.dumps = dumps
+        self.dropped_bytes = 0
+        self.truncated_count = 0
+
+    @property
+    def active(self) -> bool:
+        return bool(self.rules) or self.max_value_bytes > 0
+
+    def value_size(self, key: str, value: Any) -> int:
+        if isinstance(value, str):
+            return len(key) + len(value.encode("utf-8")) + 6
+        return len(key) + len(self.dumps(value)) + 4
+
+    def apply(self, entity_id: str, attributes: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the projected attributes; the input dict is never modified."""
+        rule = self.rule_for(entity_id) if self.rules else None
+        cap = self.max_value_bytes
+        if rule is None and not cap:
+            return attributes
+        projected: Dict[str, Any] = {}
+        for key, value in attributes.items():
+            if rule is not None and not rule.keeps(key):
+                self.dropped_bytes += self.value_size(key, value)
+                continue
+            if cap:
+                if isinstance(value, str):
+                    if len(value) > cap // 4:
+                        data = value.encode("utf-8")
+                        if len(data) > cap:
+                            value = data[:cap].decode("utf-8", "ignore")
+                            self.dropped_bytes += len(data) - len(value.encode("utf-8"))
+                            self.truncated_count += 1
+                elif isinstance(value, (list, dict)):
+                    size = len(self.dumps(value))
+                    if size > cap:
+                        self.dropped_bytes += size + len(key) + 4
+                        self.truncated_count += 1
+                        continue
+            projected[key] = value
+        return projected
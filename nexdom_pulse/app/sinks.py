@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import os
+import struct
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from .patterns import EntityFilter
+
+
+class Sink:
+    """Secondary destination with its own bounded queue, batching and retry policy.
+
+    offer() never blocks: payloads are queued last-wins per entity and, once
+    max_queue is exceeded, the oldest entities are dropped. A single worker
+    task sends batches of up to batch_size and retries each batch with
+    exponential backoff before giving up on it, so a slow or dead sink only
+    delays itself.
+    """
+
+    kind = "sink"
+
+    def __init__(self, option: Dict[str, Any], client_id: str = "", dumps: Optional[Callable[[Any], bytes]] = None,
+                 get_session: Optional[Callable[[], Any]] = None):
+        self.name = option.get("name") or self.kind
+        self.client_id = client_id
+        self.dumps = dumps
+        self.get_session = get_session
+        self.filter = EntityFilter(option.get("entities"))
+        self.max_queue = max(1, int(option.get("max_queue", 10000)))
+        self.batch_size = max(1, int(option.get("batch_size", 100)))
+        self.retries = max(1, int(option.get("retries", 3)))
+        self.retry_backoff = max(0.0, float(option.get("retry_backoff", 1)))
+        self.queue: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def offer(self, payloads: List[Dict[str, Any]]):
+        for payload in payloads:
+            eid = payload.get("entity_id")
+            if not eid or not self.filter.matches(eid):
+                continue
+            self.queue.pop(eid, None)
+            self.queue[eid] = payload
+            if len(self.queue) > self.max_queue:
+                self.queue.popitem(last=False)
+                self.dropped += 1
+        if self.queue:
+            self.wakeup.set()
+
+    def take(self) -> List[Dict[str, Any]]:
+        return [self.queue.popitem(last=False)[1] for _ in range(min(self.batch_size, len(self.queue)))]
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.queue:
+                await self.send_with_retry(self.take())
+
+    async def send_with_retry(self, batch: List[Dict[str, Any]]) -> bool:
+        for attempt in range(1, self.retries + 1):
+            try:
+                await self.send(batch)
+                self.sent += len(batch)
+                return True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning("Sink %s: intento %s/%s fallido: %s", self.name, attempt, self.retries, e)
+            if attempt < self.retries:
+                await asyncio.sleep(min(self.retry_backoff * 2 ** (attempt - 1), 60))
+        self.failed += len(batch)
+        logging.error("Sink %s: se descartan %s entidades tras %s intentos", self.name, len(batch), self.retries)
+        return False
+
+    async def send(self, batch: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.close()
+
+    async def close(self):
+        pass
+
+
+class WebhookSink(Sink):
+    """POSTs {"client_id", "entities": [...]} to `url` through the shared HTTP pool."""
+
+    kind = "webhook"
+
+    def __init__(self, option: Dict[str, Any], **kwargs):
+        super().__init__(option, **kwargs)
+        self.url = option.get("url") or ""
+        if not self.url:
+            raise ValueError(f"sinks: {self.name} requiere url")
+        self.headers = {"Content-Type": "application/json"}
+        headers = option.get("headers") or []
+        if isinstance(headers, dict):
+            headers = [f"{k}: {v}" for k, v in headers.items()]
+        for header in headers:
+            key, _, value = header.partition(":")
+            self.headers[key.strip()] = value.strip()
+
+    async def send(self, batch: List[Dict[str, Any]]):
+        data = self.dumps({"client_id": self.client_id, "entities": batch})
+        async with self.get_session().post(self.url, data=data, headers=self.headers) as resp:
+            if resp.status >= 300:
+                raise RuntimeError(f"HTTP {resp.status} {await resp.text()}")
+
+
+class MqttSink(Sink):
+    """Publishes each payload to `<topic_prefix>/<entity_id>` over plain MQTT 3.1.1 (QoS 0).
+
+    Only CONNECT and PUBLISH are implemented, which is enough for any
+    MQTT-compatible broker or bridge. The connection is opened lazily and
+    re-opened by the retry policy after an error.
+    """
+
+    kind = "mqtt"
+
+    def __init__(self, option: Dict[str, Any], **kwargs):
+        super().__init__(option, **kwargs)
+        self.host = option.get("host") or "localhost"
+        self.port = int(option.get("port", 1883))
+        self.topic_prefix = (option.get("topic_prefix") or f"nexdom_pulse/{self.client_id}").rstrip("/")
+        self.username = option.get("username") or ""
+        self.password = option.get("password") or ""
+        self.retain = bool(option.get("retain", False))
+        self.timeout = max(1.0, float(option.get("timeout", 10)))
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    @staticmethod
+    def encode_length(length: int) -> bytes:
+        out = bytearray()
+        while True:
+            byte, length = length % 128, length // 128
+            out.append(byte | 0x80 if length else byte)
+            if not length:
+                return bytes(out)
+
+    @staticmethod
+    def encode_string(value: str) -> bytes:
+        data = value.encode("utf-8")
+        return struct.pack("!H", len(data)) + data
+
+    def connect_packet(self) -> bytes:
+        flags = 0x02
+        payload = self.encode_string(f"nexdom_pulse-{self.client_id}"[:64])
+        if self.username:
+            flags |= 0x80
+            payload += self.encode_string(self.username)
+            if self.password:
+                flags |= 0x40
+                payload += self.encode_string(self.password)
+        body = self.encode_string("MQTT") + bytes([4, flags]) + struct.pack("!H", 0) + payload
+        return b"\x10" + self.encode_length(len(body)) + body
+
+    def publish_packet(self, topic: str, payload: bytes) -> bytes:
+        body = self.encode_string(topic) + payload
+        return bytes([0x31 if self.retain else 0x30]) + self.encode_length(len(body)) + body
+
+    async def connect(self):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        writer.write(self.connect_packet())
+        await writer.drain()
+        ack = await asyncio.wait_for(reader.readexactly(4), self.timeout)
+        if ack[0] != 0x20 or ack[3] != 0:
+            writer.close()
+            raise ConnectionError(f"CONNACK rechazado ({ack[3]})")
+        self.writer = writer
+
+    async def send(self, batch: List[Dict[str, Any]]):
+        if self.writer is None or self.writer.is_closing():
+            await self.connect()
+        try:
+            for payload in batch:
+                self.writer.write(self.publish_packet(f"{self.topic_prefix}/{payload['entity_id']}", self.dumps(payload)))
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+        except Exception:
+            await self.close()
+            raise
+
+    async def close(self):
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+
+class FileSink(Sink):
+    """Appends one JSON payload per line to `path`, rotating to `<path>.1` past max_mb."""
+
+    kind = "file"
+
+    def __init__(self, option: Dict[str, Any], **kwargs):
+        super().__init__(option, **kwargs)
+        self.path = option.get("path") or ""
+        if not self.path:
+            raise ValueError(f"sinks: {self.name} requiere path")
+        self.max_bytes = max(0, int(option.get("max_mb", 100))) * 1024 * 1024
+
+    def write(self, data: bytes):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+            os.replace(self.path, f"{self.path}.1")
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    async def send(self, batch: List[Dict[str, Any]]):
+        data = b"".join(self.dumps(p) + b"\n" for p in batch)
+        await asyncio.to_thread(self.write, data)
+
+
+SINK_TYPES = {cls.kind: cls for cls in (WebhookSink, MqttSink, FileSink)}
+
+
+def create_sink(option: Dict[str, Any], **kwargs) -> Sink:
+    kind = str(option.get("type", "")).lower()
+    cls = SINK_TYPES.get(kind)
+    if cls is None:
+        raise ValueError(f"sinks: tipo desconocido {kind!r}")
+    return cls(option, **kwargs)
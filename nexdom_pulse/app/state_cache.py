@@ -0,0 +1,48 @@
+import json
+import logging
+import os
+import time
+from typing import Dict, Tuple
+
+
+class StateCache:
+    """Digest of the last successfully reported state per entity, persisted as JSON.
+
+    Report times are kept in memory as time.monotonic() values and stored
+    as wall-clock seconds, so an entity's age survives a restart.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.saved_at = 0.0
+
+    def load(self) -> Tuple[Dict[str, str], Dict[str, float]]:
+        if not os.path.exists(self.path):
+            return {}, {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as exc:
+            logging.warning("No se pudo leer el caché de estados reportados %s: %s", self.path, exc)
+            return {}, {}
+        offset = time.monotonic() - time.time()
+        digests: Dict[str, str] = {}
+        reported_at: Dict[str, float] = {}
+        for eid, (digest, at) in (data.get("entities") or {}).items():
+            digests[eid] = digest
+            reported_at[eid] = at + offset
+        self.saved_at = time.monotonic()
+        return digests, reported_at
+
+    def save(self, digests: Dict[str, str], reported_at: Dict[str, float]):
+        """Atomically replace the cache file."""
+        offset = time.time() - time.monotonic()
+        entities = {eid: [digest, round(reported_at.get(eid, 0.0) + offset, 3)] for eid, digest in digests.items()}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "entities": entities}, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        self.saved_at = time.monotonic()
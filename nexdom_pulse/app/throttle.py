@@ -0,0 +1,105 @@
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+
+from .patterns import RuleSet, compile_pattern
+
+
+@dataclass
+class ReportingRule:
+    pattern: str
+    regex: Pattern[str]
+    min_interval: float = 0
+    deadband: float = 0
+    deadband_pct: float = 0
+    max_age: float = 0
+
+    @classmethod
+    def from_option(cls, option: Dict[str, Any]) -> "ReportingRule":
+        pattern = str(option.get("pattern", "")).strip()
+        if not pattern:
+            raise ValueError("reporting_rules: falta pattern")
+        return cls(
+            pattern=pattern,
+            regex=compile_pattern(pattern),
+            min_interval=float(option.get("min_interval") or 0),
+            deadband=float(option.get("deadband") or 0),
+            deadband_pct=float(option.get("deadband_pct") or 0),
+            max_age=float(option.get("max_age") or 0),
+        )
+
+
+def numeric_state(payload: Dict[str, Any]) -> Optional[float]:
+    try:
+        return float(payload.get("state"))
+    except (TypeError, ValueError):
+        return None
+
+
+class Throttle(RuleSet):
+    """Per-entity reporting rules applied between the receiver and the buffer.
+
+    Each event costs one dict lookup for the (cached) rule plus one for the
+    entity's last reported time and value. Rejected events are held (latest
+    wins) and released by release() once they become reportable, so the
+    trailing value of a burst is never lost.
+    """
+
+    def __init__(self, rules: Optional[List[Dict[str, Any]]] = None):
+        super().__init__([ReportingRule.from_option(r) for r in rules or []])
+        self.last: Dict[str, Tuple[float, Optional[float]]] = {}
+        self.held: Dict[str, Dict[str, Any]] = {}
+        self.throttled_count = 0
+
+    def reportable(self, rule: ReportingRule, entity_id: str, payload: Dict[str, Any], now: float) -> bool:
+        last = self.last.get(entity_id)
+        if last is None:
+            return True
+        last_time, last_value = last
+        age = now - last_time
+        if rule.max_age and age >= rule.max_age:
+            return True
+        if age < rule.min_interval:
+            return False
+        if not rule.deadband and not rule.deadband_pct:
+            return True
+        value = numeric_state(payload)
+        if value is None or last_value is None:
+            return True
+        change = abs(value - last_value)
+        if rule.deadband and change < rule.deadband:
+            return False
+        if rule.deadband_pct and last_value and change * 100 < rule.deadband_pct * abs(last_value):
+            return False
+        return True
+
+    def accept(self, entity_id: str, payload: Dict[str, Any], now: Optional[float] = None):
+        if self.rule_for(entity_id) is None:
+            return
+        self.last[entity_id] = (time.monotonic() if now is None else now, numeric_state(payload))
+        self.held.pop(entity_id, None)
+
+    def admit(self, entity_id: str, payload: Dict[str, Any], now: Optional[float] = None) -> bool:
+        """Return True if the payload should be buffered now; otherwise hold it."""
+        rule = self.rule_for(entity_id)
+        if rule is None:
+            return True
+        now = time.monotonic() if now is None else now
+        if self.reportable(rule, entity_id, payload, now):
+            self.accept(entity_id, payload, now)
+            return True
+        self.held[entity_id] = payload
+        self.throttled_count += 1
+        return False
+
+    def release(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Return held payloads that became reportable (interval elapsed, band exceeded or max age)."""
+        now = time.monotonic() if now is None else now
+        released = []
+        for entity_id, payload in list(self.held.items()):
+            rule = self.rule_for(entity_id)
+            if rule is None or self.reportable(rule, entity_id, payload, now):
+                self.accept(entity_id, payload, now)
+                self.held.pop(entity_id, None)
+                released.append(payload)
+        return released
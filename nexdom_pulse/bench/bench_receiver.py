@@ -0,0 +1,102 @@
+"""Microbenchmark for the receiver hot path (frame decode + filter + buffer).
+
+Replays a recorded stream of raw websocket frames (one per line) through
+HAOSReporter.handle_frame and prints events/s on a single core for the
+stdlib baseline, orjson alone, and orjson plus the raw prefilter.
+
+    python bench/bench_receiver.py                      # synthetic stream
+    python bench/bench_receiver.py --record stream.jsonl
+    python bench/bench_receiver.py --stream stream.jsonl --entities 'sensor.*_power'
+"""
+import argparse
+import json
+import pathlib
+import random
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from app.codec import get_codec  # noqa: E402
+from app.main import HAOSReporter  # noqa: E402
+
+DOMAINS = ["sensor", "binary_sensor", "light", "switch", "media_player"]
+
+
+def synth_state(entity_id: str, i: int) -> dict:
+    return {
+        "entity_id": entity_id,
+        "state": str(round(random.uniform(0, 500), 2)),
+        "attributes": {
+            "unit_of_measurement": "W",
+            "device_class": "power",
+            "state_class": "measurement",
+            "friendly_name": entity_id.split(".")[1].replace("_", " ").title(),
+        },
+        "last_changed": f"2025-02-02T12:{i // 60 % 60:02d}:{i % 60:02d}+00:00",
+        "last_updated": f"2025-02-02T12:{i // 60 % 60:02d}:{i % 60:02d}+00:00",
+        "context": {"id": f"01HX{i:022d}", "parent_id": None, "user_id": None},
+    }
+
+
+def synth_stream(events: int, entities: int) -> list:
+    """Build HA-formatted state_changed frames (compact JSON, entity_id first in data)."""
+    random.seed(1234)
+    ids = [f"{DOMAINS[n % len(DOMAINS)]}.device_{n}_power" for n in range(entities)]
+    frames = []
+    for i in range(events):
+        eid = random.choice(ids)
+        event = {
+            "event_type": "state_changed",
+            "data": {"entity_id": eid, "old_state": synth_state(eid, i), "new_state": synth_state(eid, i + 1)},
+            "origin": "LOCAL",
+            "time_fired": "2025-02-02T12:30:00.000000+00:00",
+            "context": {"id": f"01HX{i:022d}", "parent_id": None, "user_id": None},
+        }
+        frames.append(json.dumps({"type": "event", "event": event, "id": 2}, separators=(",", ":")))
+    return frames
+
+
+def run_case(frames: list, patterns: list, codec: str, prefilter: bool) -> float:
+    r = HAOSReporter()
+    r.entities_patterns = patterns
+    r.compile_patterns()
+    r.codec = get_codec(codec)
+    r.raw_prefilter = prefilter
+    start = time.perf_counter()
+    for frame in frames:
+        r.handle_frame(frame)
+    return len(frames) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stream", help="JSONL file with one raw websocket frame per line")
+    parser.add_argument("--record", help="write the synthetic stream to this file and exit")
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--entities", type=int, default=2000, dest="entity_count")
+    parser.add_argument("--filter", nargs="+", default=["sensor.*", "!sensor.*_rssi", "light.*"], help="entities patterns")
+    args = parser.parse_args()
+
+    if args.stream:
+        frames = pathlib.Path(args.stream).read_text(encoding="utf-8").splitlines()
+    else:
+        frames = synth_stream(args.events, args.entity_count)
+    if args.record:
+        pathlib.Path(args.record).write_text("\n".join(frames) + "\n", encoding="utf-8")
+        print(f"{len(frames)} frames escritos en {args.record}")
+        return
+
+    print(f"{len(frames)} frames, filtro {args.filter}")
+    baseline = run_case(frames, args.filter, "json", False)
+    cases = [
+        ("json (antes)", baseline),
+        (f"{get_codec('orjson').name}", run_case(frames, args.filter, "orjson", False)),
+        (f"{get_codec('orjson').name} + prefiltro", run_case(frames, args.filter, "orjson", True)),
+    ]
+    for name, rate in cases:
+        print(f"{name:<24} {rate:>12,.0f} eventos/s  x{rate / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
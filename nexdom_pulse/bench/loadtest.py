@@ -0,0 +1,353 @@
+"""End-to-end load test: fake Home Assistant -> HAOSReporter.run() -> fake Supabase.
+
+A child process serves a fake HA websocket (same protocol as the
+`ws_handler` test fixture, scaled to N entities and a configurable event
+rate) and a fake Supabase REST endpoint that records request bodies and
+can inject latency and errors. The reporter runs unmodified in this
+process, so peak RSS is the reporter's own. Everything binds to
+127.0.0.1; no network access is needed.
+
+    python bench/loadtest.py --entities 20000 --rate 2000 --duration 20
+    python bench/loadtest.py --entities 100000 --delivery bulk --latency-ms 50 --error-rate 0.02
+    python bench/loadtest.py --save-baseline baseline.json
+    python bench/loadtest.py --baseline baseline.json --tolerance 0.25   # exit 1 on regression
+
+Event states carry a sequence number, so the fake Supabase can match each
+stored state to its emission time; latency percentiles therefore cover
+the values that survive buffer coalescing.
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import pathlib
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from app.main import HAOSReporter  # noqa: E402
+
+DOMAINS = ["sensor", "binary_sensor", "light", "switch", "climate"]
+
+
+@dataclass
+class LoadConfig:
+    entities: int = 5000
+    rate: float = 500.0
+    duration: float = 10.0
+    drain: Optional[float] = None
+    latency_ms: float = 0.0
+    error_rate: float = 0.0
+    delivery: str = "bulk"
+    update_interval: int = 2
+    filter: Optional[List[str]] = None
+    record_bodies: Optional[str] = None
+    coalesce: bool = True
+    seed: int = 1234
+
+    def drain_seconds(self) -> float:
+        if self.drain is not None:
+            return self.drain
+        drain = self.update_interval * 2 + self.latency_ms / 1000 * 4 + 2
+        if self.error_rate:
+            # A failed request is retried after 1 s and 2 s (3 attempts per RPC).
+            drain += 3 + self.latency_ms / 1000 * 3
+        return drain
+
+
+def entity_ids(count: int) -> List[str]:
+    return [f"{DOMAINS[n % len(DOMAINS)]}.load_{n}" for n in range(count)]
+
+
+def entity_state(entity_id: str, state: str, ts: str) -> Dict[str, Any]:
+    return {
+        "entity_id": entity_id,
+        "state": state,
+        "attributes": {"friendly_name": entity_id.split(".")[1], "unit_of_measurement": "W"},
+        "last_changed": ts,
+        "last_updated": ts,
+        "context": {"id": "01HXLOADTEST", "parent_id": None, "user_id": None},
+    }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class FakeServers:
+    """Fake HA websocket and fake Supabase sharing one clock for latency measurement."""
+
+    def __init__(self, cfg: LoadConfig):
+        self.cfg = cfg
+        self.ids = entity_ids(cfg.entities)
+        self.rng = random.Random(cfg.seed)
+        self.emitted: Dict[int, float] = {}
+        self.latencies: List[float] = []
+        self.status: Counter = Counter()
+        self.requests = 0
+        self.rpc_calls: Counter = Counter()
+        self.entities_received = 0
+        self.bytes_received = 0
+        self.bodies: List[Any] = []
+
+    async def ha_handler(self, ws, path=None):
+        await ws.send(json.dumps({"type": "auth_required"}))
+        await ws.recv()
+        await ws.send(json.dumps({"type": "auth_ok"}))
+        emitter = None
+        coalesce = False
+        try:
+            async for msg in ws:
+                data = json.loads(msg)
+                t = data.get("type")
+                if t == "supported_features":
+                    coalesce = self.cfg.coalesce and bool(data.get("features", {}).get("coalesce_messages"))
+                    await ws.send(json.dumps({"id": data.get("id"), "type": "result", "success": True, "result": None}))
+                elif t == "get_states":
+                    ts = "2025-02-02T12:30:00+00:00"
+                    result = [entity_state(eid, "init", ts) for eid in self.ids]
+                    await ws.send(json.dumps({"id": data.get("id"), "type": "result", "success": True, "result": result}))
+                elif t == "subscribe_events":
+                    await ws.send(json.dumps({"id": data.get("id"), "type": "result", "success": True}))
+                    emitter = asyncio.create_task(self.emit(ws, data.get("id"), coalesce))
+        finally:
+            if emitter is not None:
+                emitter.cancel()
+
+    async def emit(self, ws, sub_id: int, coalesce: bool = False):
+        """Emit state_changed events at cfg.rate; with coalesce each tick goes out as one array frame, like HA."""
+        seq = 0
+        start = time.monotonic()
+        while True:
+            elapsed = time.monotonic() - start
+            if elapsed >= self.cfg.duration:
+                return
+            due = int(elapsed * self.cfg.rate) - seq
+            frames = []
+            for _ in range(due):
+                seq += 1
+                eid = self.rng.choice(self.ids)
+                new_state = entity_state(eid, str(seq), "2025-02-02T12:31:00+00:00")
+                event = {"event_type": "state_changed", "data": {"entity_id": eid, "old_state": None, "new_state": new_state}}
+                self.emitted[seq] = time.monotonic()
+                frames.append(json.dumps({"type": "event", "event": event, "id": sub_id}, separators=(",", ":")))
+            if coalesce and len(frames) > 1:
+                frames = ["[" + ",".join(frames) + "]"]
+            for frame in frames:
+                await ws.send(frame)
+            await asyncio.sleep(0.005)
+
+    async def supabase_handler(self, request):
+        from aiohttp import web
+
+        raw = await request.read()
+        if self.cfg.latency_ms:
+            await asyncio.sleep(self.cfg.latency_ms / 1000)
+        self.requests += 1
+        # Errors are spaced evenly (every 1/error_rate requests) so a run is reproducible.
+        if self.cfg.error_rate and int(self.requests * self.cfg.error_rate) > int((self.requests - 1) * self.cfg.error_rate):
+            self.status[500] += 1
+            return web.Response(status=500, text="injected error")
+        rpc = request.match_info["rpc"]
+        body = json.loads(raw)
+        now = time.monotonic()
+        entities = body.get("p_entities") or ([body["p_entity"]] if "p_entity" in body else [])
+        for payload in entities:
+            state = payload.get("state")
+            if isinstance(state, str) and state.isdigit():
+                emitted = self.emitted.get(int(state))
+                if emitted is not None:
+                    self.latencies.append(now - emitted)
+        self.rpc_calls[rpc] += 1
+        self.status[200] += 1
+        self.entities_received += len(entities)
+        self.bytes_received += len(raw)
+        if self.cfg.record_bodies:
+            self.bodies.append(body)
+        return web.json_response({"failed": []})
+
+    def results(self) -> Dict[str, Any]:
+        if self.cfg.record_bodies:
+            with open(self.cfg.record_bodies, "w", encoding="utf-8") as f:
+                for body in self.bodies:
+                    f.write(json.dumps(body, separators=(",", ":")) + "\n")
+        return {
+            "emitted_events": len(self.emitted),
+            "delivered_entities": self.entities_received,
+            "latency_samples": len(self.latencies),
+            "latency_p50_ms": round(percentile(self.latencies, 50) * 1000, 1),
+            "latency_p95_ms": round(percentile(self.latencies, 95) * 1000, 1),
+            "latency_p99_ms": round(percentile(self.latencies, 99) * 1000, 1),
+            "latency_max_ms": round(max(self.latencies, default=0) * 1000, 1),
+            "http_requests": sum(self.status.values()),
+            "http_status": {str(k): v for k, v in sorted(self.status.items())},
+            "http_rpc_calls": dict(self.rpc_calls),
+            "http_bytes": self.bytes_received,
+        }
+
+
+async def serve_fakes_async(cfg: LoadConfig, conn):
+    import websockets
+    from aiohttp import web
+
+    fakes = FakeServers(cfg)
+    app = web.Application(client_max_size=256 * 1024 * 1024)
+    app.router.add_post("/rest/v1/rpc/{rpc}", fakes.supabase_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    supabase_port = runner.addresses[0][1]
+    ha = await websockets.serve(fakes.ha_handler, "127.0.0.1", 0, max_size=None)
+    ha_port = ha.sockets[0].getsockname()[1]
+    conn.send({"ha_port": ha_port, "supabase_port": supabase_port})
+    await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+    conn.send(fakes.results())
+    ha.close()
+    await runner.cleanup()
+
+
+def serve_fakes(cfg: LoadConfig, conn):
+    asyncio.run(serve_fakes_async(cfg, conn))
+
+
+async def drive_reporter(cfg: LoadConfig, ha_port: int, supabase_port: int, data_dir: str) -> Dict[str, Any]:
+    options = {
+        "client_id": "00000000-0000-0000-0000-00000000load",
+        "supabase_url": f"http://127.0.0.1:{supabase_port}",
+        "supabase_token": "loadtest",
+        "update_interval": cfg.update_interval,
+        "entities": cfg.filter or ["*"],
+        "log_level": "warning",
+        "delivery_mode": cfg.delivery,
+        "coalesce_messages": cfg.coalesce,
+        "metrics_port": 0,
+    }
+    options_path = os.path.join(data_dir, "options.json")
+    with open(options_path, "w", encoding="utf-8") as f:
+        json.dump(options, f)
+    os.environ.setdefault("SUPERVISOR_TOKEN", "loadtest")
+    r = HAOSReporter()
+    r.options_path = options_path
+    r.ws_url = f"ws://127.0.0.1:{ha_port}"
+    task = asyncio.create_task(r.run())
+    deadline = time.monotonic() + cfg.duration + cfg.drain_seconds()
+    first = last = None
+    messages = 0
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+        if r.m_messages.value != messages:
+            messages = r.m_messages.value
+            last = time.monotonic()
+            first = first or last
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return {
+        "frames_processed": r.m_frames.value,
+        "messages_processed": messages,
+        "events_per_s": round(messages / (last - first), 1) if first and last > first else 0.0,
+        "flushes": sum(c.value for c in r.m_flushes.children.values()),
+        "retries": sum(c.value for c in r.m_retries.children.values()),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def run_load(cfg: LoadConfig) -> Dict[str, Any]:
+    """Run one load scenario and return the merged reporter and server measurements."""
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe()
+    proc = ctx.Process(target=serve_fakes, args=(cfg, child), daemon=True)
+    proc.start()
+    try:
+        ports = parent.recv()
+        with tempfile.TemporaryDirectory() as data_dir:
+            reporter = asyncio.run(drive_reporter(cfg, ports["ha_port"], ports["supabase_port"], data_dir))
+        parent.send("stop")
+        servers = parent.recv()
+    finally:
+        proc.join(timeout=10)
+        if proc.is_alive():
+            proc.terminate()
+    return {"config": asdict(cfg), **servers, **reporter}
+
+
+GATES = {
+    "events_per_s": "higher",
+    "latency_p95_ms": "lower",
+    "peak_rss_mb": "lower",
+}
+
+
+def check_regressions(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return a message per gated metric that is worse than baseline by more than tolerance."""
+    failures = []
+    for key, better in GATES.items():
+        if key not in baseline or key not in result:
+            continue
+        base, value = baseline[key], result[key]
+        if better == "higher" and value < base * (1 - tolerance):
+            failures.append(f"{key}: {value} < {base} (-{tolerance:.0%})")
+        if better == "lower" and base and value > base * (1 + tolerance):
+            failures.append(f"{key}: {value} > {base} (+{tolerance:.0%})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=500, help="events per second emitted by the fake HA")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of event emission")
+    parser.add_argument("--drain", type=float, help="seconds to keep running after emission (default: derived)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="latency injected per Supabase request")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of Supabase requests answered with 500 (evenly spaced)")
+    parser.add_argument("--delivery", choices=["single", "bulk"], default="bulk")
+    parser.add_argument("--update-interval", type=int, default=2)
+    parser.add_argument("--filter", nargs="+", help="entities patterns (default: *)")
+    parser.add_argument("--record-bodies", help="write every stored request body to this JSONL file")
+    parser.add_argument("--no-coalesce", action="store_true", help="send one websocket frame per event")
+    parser.add_argument("--baseline", help="JSON result to compare against; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save-baseline", help="write this run's result as a baseline")
+    args = parser.parse_args()
+
+    cfg = LoadConfig(
+        entities=args.entities,
+        rate=args.rate,
+        duration=args.duration,
+        drain=args.drain,
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        delivery=args.delivery,
+        update_interval=args.update_interval,
+        filter=args.filter,
+        record_bodies=args.record_bodies,
+        coalesce=not args.no_coalesce,
+    )
+    result = run_load(cfg)
+    print(json.dumps(result, indent=2))
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            failures = check_regressions(result, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f"REGRESIÓN {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 #!/usr/bin/with-contenv sh
 set -euo pipefail
 
-exec python3 -u /app/main.py
+cd /app
+exec python3 -u -m app.main
@@ -4,10 +4,11 @@ import os
 import pytest
 import websockets
 from websockets.server import serve
-import responses
+from aioresponses import aioresponses, CallbackResult
 import sys
 import pathlib
 import pytest_asyncio
+from types import SimpleNamespace
 
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
 
@@ -42,24 +43,46 @@ def reporter(make_options):
     r.supervisor_token = "token"
     return r
 
+class SupabaseMock:
+    """Register `responses`-style callbacks on top of aioresponses."""
+
+    def __init__(self, mocked):
+        self.mocked = mocked
+
+    def add_callback(self, method, url, callback, content_type="application/json"):
+        def _cb(request_url, **kwargs):
+            request = SimpleNamespace(url=str(request_url), headers=kwargs.get("headers") or {}, body=kwargs.get("data"))
+            status, headers, body = callback(request)
+            return CallbackResult(status=status, headers=headers, body=body, content_type=content_type)
+        self.mocked.add(url, method=method, callback=_cb, repeat=True)
+
 @pytest.fixture
 def supabase_mock():
     calls = []
-    rsps = responses.RequestsMock(assert_all_requests_are_fired=False)
-    rsps.start()
-    yield rsps, calls
-    rsps.stop()
-    rsps.reset()
+    with aioresponses() as mocked:
+        yield SupabaseMock(mocked), calls
+
+async def send_messages(websocket, messages, coalesce):
+    """Send like HA: one frame per message, or a single JSON array once coalesce_messages is negotiated."""
+    if coalesce and len(messages) > 1:
+        await websocket.send("[" + ",".join(json.dumps(m) for m in messages) + "]")
+        return
+    for m in messages:
+        await websocket.send(json.dumps(m))
 
 async def ws_handler(websocket):
     await websocket.send(json.dumps({"type": "auth_required"}))
     msg = await websocket.recv()
     data = json.loads(msg)
     await websocket.send(json.dumps({"type": "auth_ok"}))
+    coalesce = False
     while True:
         msg = await websocket.recv()
         data = json.loads(msg)
-        if data.get("type") == "get_states":
+        if data.get("type") == "supported_features":
+            coalesce = bool(data.get("features", {}).get("coalesce_messages"))
+            await websocket.send(json.dumps({"id": data.get("id"), "type": "result", "success": True, "result": None}))
+        elif data.get("type") == "get_states":
             result = [
                 {
                     "entity_id": "sensor.temp",
@@ -76,8 +99,7 @@ async def ws_handler(websocket):
             ]
             await websocket.send(json.dumps({"id": data.get("id"), "type": "result", "success": True, "result": result}))
         elif data.get("type") == "subscribe_events" and data.get("event_type") == "state_changed":
-            await websocket.send(json.dumps({"id": data.get("id"), "type": "result", "success": True}))
-            await websocket.send(json.dumps({
+            await send_messages(websocket, [{"id": data.get("id"), "type": "result", "success": True}, {
                 "type": "event",
                 "event": {
                     "event_type": "state_changed",
@@ -89,8 +111,24 @@ async def ws_handler(websocket):
                             "last_changed": "2025-02-02T12:31:00+00:00",
                         }
                     }
-                }
-            }))
+                },
+                "id": data.get("id"),
+            }], coalesce)
+        elif data.get("type") == "subscribe_entities":
+            await send_messages(websocket, [{"id": data.get("id"), "type": "result", "success": True}, {
+                "type": "event",
+                "event": {
+                    "a": {
+                        "sensor.temp": {"s": "22.5", "a": {"unit_of_measurement": "°C"}, "c": "01H", "lc": 1738499400.0},
+                        "light.sala": {"s": "on", "a": {}, "c": "01H", "lc": 1738499400.0},
+                    }
+                },
+                "id": data.get("id"),
+            }, {
+                "type": "event",
+                "event": {"c": {"sensor.temp": {"+": {"s": "23.0", "c": "01J", "lc": 1738499460.0}}}},
+                "id": data.get("id"),
+            }], coalesce)
 
 @pytest_asyncio.fixture
 async def ws_test_server(unused_tcp_port):
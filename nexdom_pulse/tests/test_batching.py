@@ -0,0 +1,60 @@
+import json
+import pytest
+from haos_reporter_addon.app.main import HAOSReporter
+
+def _payload(i, size=10):
+    return {
+        "entity_id": f"sensor.s{i}",
+        "state": "x" * size,
+        "attributes": {},
+        "last_changed": "2025-02-02T12:30:00+00:00",
+    }
+
+def test_batches_bounded_by_count(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"delivery_mode": "bulk", "batch_max_entities": 3})
+    r.load_options()
+    batches = r.make_batches([_payload(i) for i in range(7)])
+    assert [len(b) for b in batches] == [3, 3, 1]
+
+def test_batches_bounded_by_bytes(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"delivery_mode": "bulk", "batch_max_bytes": 2048})
+    r.load_options()
+    payloads = [_payload(i, size=900) for i in range(5)]
+    batches = r.make_batches(payloads)
+    assert [len(b) for b in batches] == [2, 2, 1]
+    assert sum(batches, []) == payloads
+
+@pytest.mark.asyncio
+async def test_bulk_retries_only_failed(supabase_mock, make_options, monkeypatch):
+    rsps, calls = supabase_mock
+    def cb(request):
+        b = json.loads(request.body)
+        calls.append([e["entity_id"] for e in b["p_entities"]])
+        if len(calls) == 1:
+            return (200, {}, json.dumps({"failed": ["sensor.s1"]}))
+        return (200, {}, json.dumps({"failed": []}))
+    rsps.add_callback(
+        "POST",
+        "http://test-supabase.local/rest/v1/rpc/sp_report_entities",
+        callback=cb,
+        content_type="application/json",
+    )
+    async def no_sleep(_):
+        return None
+    monkeypatch.setattr("asyncio.sleep", no_sleep)
+    r = HAOSReporter()
+    r.options_path = make_options({"delivery_mode": "bulk"})
+    r.load_options()
+    r.supervisor_token = "t"
+    failed = await r.deliver([_payload(i) for i in range(3)])
+    await r.close_session()
+    assert failed == []
+    assert calls == [["sensor.s0", "sensor.s1", "sensor.s2"], ["sensor.s1"]]
+
+def test_failed_ids_require_explicit_shape():
+    r = HAOSReporter()
+    assert r.failed_entity_ids('[{"entity_id": "sensor.s0"}]') == []
+    assert r.failed_entity_ids('{"stored": 3}') == []
+    assert r.failed_entity_ids('{"failed": ["sensor.s0", {"entity_id": "sensor.s1"}]}') == ["sensor.s0", "sensor.s1"]
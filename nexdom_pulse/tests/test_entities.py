@@ -0,0 +1,31 @@
+from haos_reporter_addon.app.main import HAOSReporter
+
+def _reporter(make_options, entities):
+    r = HAOSReporter()
+    r.options_path = make_options({"entities": entities, "event_source": "subscribe_entities"})
+    r.load_options()
+    return r
+
+def test_subscribed_entity_ids(make_options):
+    assert _reporter(make_options, ["light.sala", "sensor.temp"]).subscribed_entity_ids() == ["light.sala", "sensor.temp"]
+    assert _reporter(make_options, ["sensor.*"]).subscribed_entity_ids() is None
+    assert _reporter(make_options, ["*"]).subscribed_entity_ids() is None
+
+def test_apply_entities_diff(make_options):
+    r = _reporter(make_options, ["*"])
+    r.apply_entities_diff({"a": {"light.sala": {"s": "on", "a": {"brightness": 10, "effect": "none"}, "lc": 1738499400.0, "lu": 1738499410.0}}})
+    state = r.entity_mirror["light.sala"]
+    assert state["last_changed"] == "2025-02-02T12:30:00+00:00"
+    assert state["last_updated"] == "2025-02-02T12:30:10+00:00"
+    r.apply_entities_diff({"c": {"light.sala": {"+": {"a": {"brightness": 20}, "lu": 1738499420.0}, "-": {"a": ["effect"]}}}})
+    assert r.changed_buffer["light.sala"] == {
+        "entity_id": "light.sala",
+        "state": "on",
+        "attributes": {"brightness": 20},
+        "last_changed": "2025-02-02T12:30:00+00:00",
+    }
+    r.apply_entities_diff({"c": {"light.sala": {"+": {"s": "off", "lc": 1738499430.0}}}})
+    assert r.entity_mirror["light.sala"]["state"] == "off"
+    assert r.entity_mirror["light.sala"]["last_changed"] == "2025-02-02T12:30:30+00:00"
+    r.apply_entities_diff({"r": ["light.sala"]})
+    assert "light.sala" not in r.entity_mirror
@@ -1,3 +1,4 @@
+import json
 from haos_reporter_addon.app.main import HAOSReporter
 
 def test_filter_wildcards(make_options):
@@ -19,4 +20,124 @@ def test_filter_exact(make_options):
     r.options_path = make_options({"entities": ["light.sala"]})
     r.load_options()
     assert r.matches("light.sala")
-    assert not r.matches("light.cocina")
\ No newline at end of file
+    assert not r.matches("light.cocina")
+
+def test_filter_exclude(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"entities": ["sensor.*", "!sensor.*_rssi", "!sensor.debug"]})
+    r.load_options()
+    assert r.matches("sensor.temp")
+    assert not r.matches("sensor.door_rssi")
+    assert not r.matches("sensor.debug")
+    assert not r.matches("light.sala")
+
+def test_filter_only_excludes(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"entities": ["!sensor.*_rssi"]})
+    r.load_options()
+    assert r.matches("light.sala")
+    assert not r.matches("sensor.door_rssi")
+
+def test_filter_cache_cleared_on_reload(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"entities": ["sensor.*"]})
+    r.load_options()
+    assert not r.matches("light.sala")
+    assert r.entity_filter.cache["light.sala"] is False
+    r.options_path = make_options({"entities": ["light.*"]})
+    r.load_options()
+    assert r.entity_filter.cache == {}
+    assert r.matches("light.sala")
+
+def test_filter_cache_bounded(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"entities": ["sensor.*"]})
+    r.load_options()
+    r.entity_filter.CACHE_SIZE = 5
+    for i in range(20):
+        r.matches(f"sensor.s{i}")
+    assert len(r.entity_filter.cache) == 5
+    assert "sensor.s19" in r.entity_filter.cache
+
+def _frame(entity_id, state="1"):
+    new_state = {"entity_id": entity_id, "state": state, "attributes": {}, "last_changed": "2025-02-02T12:30:00+00:00"}
+    event = {"event_type": "state_changed", "data": {"entity_id": entity_id, "old_state": None, "new_state": new_state}}
+    return json.dumps({"type": "event", "event": event, "id": 2}, separators=(",", ":"))
+
+def test_raw_prefilter(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"entities": ["sensor.*", "!sensor.*_rssi"]})
+    r.load_options()
+    r.handle_frame(_frame("light.sala"))
+    r.handle_frame(_frame("sensor.door_rssi"))
+    r.handle_frame(_frame("sensor.temp", "22.5"))
+    assert r.prefiltered_count == 2
+    assert list(r.changed_buffer) == ["sensor.temp"]
+    assert r.changed_buffer["sensor.temp"]["state"] == "22.5"
+
+def test_raw_prefilter_accepts_id_first(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"entities": ["sensor.*"]})
+    r.load_options()
+    frame = json.loads(_frame("light.sala"))
+    assert r.skip_raw_frame(json.dumps({"id": frame.pop("id"), **frame}, separators=(",", ":")))
+
+def test_raw_prefilter_ignores_other_frames(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"entities": ["sensor.*"]})
+    r.load_options()
+    assert not r.skip_raw_frame(json.dumps({"id": 3, "type": "result", "success": True, "result": [{"entity_id": "light.sala"}]}))
+    assert not r.skip_raw_frame(b'{"id":2,"type":"event"}')
+
+def test_stdlib_codec(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"entities": ["sensor.*"], "json_codec": "json"})
+    r.load_options()
+    assert r.codec.name == "json"
+    r.handle_frame(_frame("sensor.temp"))
+    assert "sensor.temp" in r.changed_buffer
+
+def test_entities_priority_and_sinks_share_the_filter(make_options, tmp_path):
+    patterns = ["sensor.*", "! sensor.*_rssi", "light.sala"]
+    r = HAOSReporter()
+    r.options_path = make_options({"entities": patterns, "priority_entities": patterns,
+                                   "sinks": [{"type": "file", "path": str(tmp_path / "s.jsonl"), "entities": patterns}]})
+    r.load_options()
+    for f in (r.priority_filter, r.sinks[0].filter):
+        assert type(f) is type(r.entity_filter)
+    for eid in ("sensor.temp", "sensor.door_rssi", "light.sala", "light.cocina"):
+        assert r.matches(eid) == r.priority_filter.matches(eid) == r.sinks[0].filter.matches(eid)
+    assert not r.matches("sensor.door_rssi")
+
+def test_raw_prefilter_array_frame(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"entities": ["sensor.*", "!sensor.*_rssi"]})
+    r.load_options()
+    results = []
+    r.pending_requests[7] = results.append
+    ids = ["light.sala", "sensor.temp", "sensor.door_rssi", "switch.x", "sensor.hum"]
+    frame = "[" + ",".join(_frame(eid) for eid in ids) + ',{"id":7,"type":"result","success":true,"result":null}]'
+    r.handle_frame(frame)
+    assert r.prefiltered_count == 3
+    assert list(r.changed_buffer) == ["sensor.temp", "sensor.hum"]
+    assert results and results[0]["id"] == 7
+    assert r.m_messages.value == 6
+
+def test_raw_prefilter_array_frame_falls_back_on_nested_messages(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"entities": ["sensor.*"]})
+    r.load_options()
+    nested = json.loads(_frame("sensor.temp"))
+    nested["event"]["data"]["new_state"]["attributes"]["items"] = [{"id": 1, "type": "x"}]
+    frame = "[" + json.dumps(nested, separators=(",", ":")) + "," + _frame("light.sala") + "]"
+    r.handle_frame(frame)
+    assert list(r.changed_buffer) == ["sensor.temp"]
+    assert r.changed_buffer["sensor.temp"]["attributes"]["items"] == [{"id": 1, "type": "x"}]
+
+def test_split_array_frame_with_id_last(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options()
+    r.load_options()
+    event = '{"type":"event","event":{"event_type":"state_changed","data":{"entity_id":"sensor.a"}},"id":2}'
+    result = '{"id":7,"type":"result","success":true,"result":null}'
+    assert r.split_array_frame("[" + event + "," + result + "," + event + "]") == [event, result, event]
@@ -0,0 +1,93 @@
+import asyncio
+import time
+import pytest
+from haos_reporter_addon.app.main import HAOSReporter
+
+def _payload(i):
+    return {"entity_id": f"sensor.s{i}", "state": str(i), "attributes": {}, "last_changed": "2025-02-02T12:30:00+00:00"}
+
+def _reporter(make_options, overrides):
+    base = {"update_interval": 60, "flush_min_gap": 0, "flush_jitter": 0}
+    base.update(overrides)
+    r = HAOSReporter()
+    r.options_path = make_options(base)
+    r.load_options()
+    flushes = []
+    async def report(items):
+        flushes.append((time.monotonic(), [p["entity_id"] for p in items]))
+        return []
+    r.report = report
+    return r, flushes
+
+async def _stop(task):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+@pytest.mark.asyncio
+async def test_flush_on_entry_count(make_options):
+    r, flushes = _reporter(make_options, {"flush_max_entries": 3})
+    task = asyncio.create_task(r.periodic_flush())
+    for i in range(3):
+        r.enqueue(f"sensor.s{i}", _payload(i))
+    await asyncio.sleep(0.1)
+    await _stop(task)
+    assert [ids for _, ids in flushes] == [["sensor.s0", "sensor.s1", "sensor.s2"]]
+    assert r.last_flush_stats["trigger"] == "size"
+    assert r.last_flush_stats["depth"] == 3
+
+@pytest.mark.asyncio
+async def test_flush_on_byte_size(make_options):
+    r, flushes = _reporter(make_options, {"flush_max_entries": 0, "flush_max_bytes": 200})
+    task = asyncio.create_task(r.periodic_flush())
+    r.enqueue("sensor.s0", _payload(0))
+    await asyncio.sleep(0.05)
+    assert flushes == []
+    r.enqueue("sensor.s1", _payload(1))
+    r.enqueue("sensor.s2", _payload(2))
+    await asyncio.sleep(0.05)
+    await _stop(task)
+    assert len(flushes) == 1
+    assert r.last_flush_stats["bytes"] >= 200
+
+@pytest.mark.asyncio
+async def test_flush_on_oldest_age(make_options):
+    r, flushes = _reporter(make_options, {"flush_max_age": 0.2})
+    task = asyncio.create_task(r.periodic_flush())
+    await asyncio.sleep(0.05)
+    start = time.monotonic()
+    r.enqueue("sensor.s0", _payload(0))
+    await asyncio.sleep(0.4)
+    await _stop(task)
+    assert len(flushes) == 1
+    assert 0.15 <= flushes[0][0] - start < 0.35
+    assert r.last_flush_stats["trigger"] == "age"
+
+@pytest.mark.asyncio
+async def test_flush_min_gap(make_options):
+    r, flushes = _reporter(make_options, {"flush_max_entries": 1, "flush_min_gap": 0.3})
+    task = asyncio.create_task(r.periodic_flush())
+    await asyncio.sleep(0.35)
+    r.enqueue("sensor.s0", _payload(0))
+    await asyncio.sleep(0.05)
+    r.enqueue("sensor.s1", _payload(1))
+    await asyncio.sleep(0.5)
+    await _stop(task)
+    assert len(flushes) == 2
+    assert flushes[1][0] - flushes[0][0] >= 0.29
+
+def test_jitter_bounds(make_options):
+    r, _ = _reporter(make_options, {"flush_jitter": 0.2})
+    values = [r.jittered(60) for _ in range(200)]
+    assert all(48 <= v <= 72 for v in values)
+    assert len(set(values)) > 1
+
+def test_estimate_size_tracks_encoded_size():
+    r = HAOSReporter()
+    payloads = [
+        _payload(1),
+        {"entity_id": "light.sala", "state": "on", "last_changed": "2025-02-02T12:30:00+00:00",
+         "attributes": {"friendly_name": "Luz sala", "brightness": 254, "rgb_color": [255, 180, 90], "supported_features": 44}},
+    ]
+    for p in payloads:
+        encoded = len(r.codec.dumps(p))
+        assert encoded * 0.5 <= r.estimate_size(p) <= encoded * 1.5
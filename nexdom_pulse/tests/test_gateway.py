@@ -0,0 +1,90 @@
+import asyncio
+import json
+import os
+import pytest
+from haos_reporter_addon.app.gateway import SITE_KEYS, SITE_OVERRIDES, Gateway
+from haos_reporter_addon.app.main import HAOSReporter
+from haos_reporter_addon.app.metrics import MergedRegistry
+
+def _gateway(make_options, ws_url, overrides=None):
+    options = {
+        "update_interval": 1,
+        "metrics_port": 0,
+        "sites": [
+            {"name": "casa", "ws_url": ws_url, "token": "t1", "client_id": "client-casa", "entities": ["sensor.*"]},
+            {"name": "oficina", "ws_url": ws_url, "token": "t2", "client_id": "client-oficina", "entities": ["light.*"]},
+        ],
+    }
+    options.update(overrides or {})
+    r = HAOSReporter()
+    r.options_path = make_options(options)
+    r.load_options()
+    return r
+
+@pytest.mark.asyncio
+async def test_gateway_runs_isolated_sites(ws_test_server, supabase_mock, make_options):
+    rsps, calls = supabase_mock
+    def cb(request):
+        body = json.loads(request.body)
+        calls.append((body["p_client_id"], body["p_entity"]["entity_id"]))
+        return (200, {}, json.dumps({}))
+    rsps.add_callback("POST", "http://test-supabase.local/rest/v1/rpc/sp_report_entity", callback=cb, content_type="application/json")
+    r = _gateway(make_options, ws_test_server)
+    task = asyncio.create_task(r.run())
+    await asyncio.sleep(2)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert set(calls) == {("client-casa", "sensor.temp"), ("client-oficina", "light.sala")}
+
+@pytest.mark.asyncio
+async def test_gateway_site_options(make_options, tmp_path):
+    r = _gateway(make_options, "ws://127.0.0.1:1/", {"sites": [
+        {"name": "a", "ws_url": "ws://a/", "token": "ta", "client_id": "ca"},
+        {"name": "b", "ws_url": "ws://b/", "token": "tb", "client_id": "cb", "update_interval": 5, "entities": ["light.*"]},
+    ]})
+    gw = Gateway(r)
+    gw.build_sites()
+    gw.share_pipeline()
+    a, b = gw.sites["a"], gw.sites["b"]
+    assert (a.ws_url, a.supervisor_token, a.client_id, a.update_interval) == ("ws://a/", "ta", "ca", 1)
+    assert (b.client_id, b.update_interval, b.matches("sensor.x")) == ("cb", 5, False)
+    assert a.data_dir == str(tmp_path / "sites" / "a")
+    assert a.get_session() is b.get_session() is r.http_session
+    assert a.http_semaphore is b.http_semaphore
+    await r.close_session()
+
+def test_gateway_rejects_duplicate_sites(make_options):
+    site = {"name": "a", "ws_url": "ws://a/", "token": "t", "client_id": "c"}
+    r = _gateway(make_options, "ws://127.0.0.1:1/", {"sites": [site, site]})
+    with pytest.raises(ValueError):
+        Gateway(r).build_sites()
+
+def test_merged_metrics_single_header():
+    a, b = HAOSReporter(), HAOSReporter()
+    a.m_frames.inc(3)
+    text = MergedRegistry({"a": a.metrics, "b": b.metrics}).render()
+    assert text.count("# TYPE nexdom_pulse_ws_frames_total counter") == 1
+    assert 'nexdom_pulse_ws_frames_total{site="a"} 3' in text
+    assert 'nexdom_pulse_ws_frames_total{site="b"} 0' in text
+    assert 'nexdom_pulse_supabase_responses_total' in text
+
+@pytest.mark.parametrize("name", ["../casa", "Casa", "a/b", "-x", ".."])
+def test_gateway_rejects_unsafe_site_names(make_options, name):
+    r = _gateway(make_options, "ws://127.0.0.1:1/", {"sites": [{"name": name, "ws_url": "ws://a/", "token": "t", "client_id": "c"}]})
+    with pytest.raises(ValueError):
+        Gateway(r).build_sites()
+
+def test_gateway_rejects_unknown_site_overrides(make_options):
+    r = _gateway(make_options, "ws://127.0.0.1:1/", {"sites": [
+        {"name": "a", "ws_url": "ws://a/", "token": "t", "client_id": "c", "http_pool_size": 50},
+    ]})
+    with pytest.raises(ValueError, match="http_pool_size"):
+        Gateway(r).build_sites()
+
+def test_sites_schema_matches_overrides():
+    path = os.path.join(os.path.dirname(__file__), "..", "config.json")
+    with open(path, encoding="utf-8") as f:
+        schema = json.load(f)["schema"]
+    assert list(schema["sites"][0]) == list(SITE_KEYS) + list(SITE_OVERRIDES)
+    assert all(k in schema for k in SITE_OVERRIDES)
@@ -0,0 +1,94 @@
+import json
+import pytest
+from haos_reporter_addon.app.history import History, SeriesWindow
+from haos_reporter_addon.app.main import HAOSReporter
+
+def test_ring_keeps_latest_samples_and_exact_aggregates():
+    w = SeriesWindow(capacity=3)
+    for i, v in enumerate([5.0, 1.0, 9.0, 4.0, 2.0]):
+        w.add(float(i), v)
+    s = w.summary("sensor.p", include_samples=True)
+    assert s["ts"] == [2.0, 3.0, 4.0]
+    assert s["values"] == [9.0, 4.0, 2.0]
+    assert s["dropped"] == 2
+    assert (s["count"], s["min"], s["max"], s["last"]) == (5, 1.0, 9.0, 2.0)
+    assert s["mean"] == pytest.approx(4.2)
+    assert (s["start"], s["end"]) == (2.0, 4.0)
+
+def test_window_ignores_non_numeric_and_resets():
+    h = History(capacity=10, include_samples=False)
+    h.record("sensor.p", "10", ts=1.0)
+    h.record("sensor.p", "unavailable", ts=2.0)
+    h.record("sensor.p", "20", ts=3.0)
+    h.record("light.sala", "on", ts=3.0)
+    window = h.take_window()
+    assert [s["entity_id"] for s in window["series"]] == ["sensor.p"]
+    assert window["series"][0]["mean"] == 15.0
+    assert "values" not in window["series"][0]
+    assert h.take_window()["series"] == []
+
+def test_window_ignores_non_finite_values():
+    h = History(capacity=10, include_samples=True)
+    for state in ("1", "nan", "inf", "-inf", "Infinity", "3"):
+        h.record("sensor.p", state, ts=1.0)
+    series = h.take_window()["series"][0]
+    assert series["values"] == [1.0, 3.0]
+    assert (series["min"], series["max"], series["mean"]) == (1.0, 3.0, 2.0)
+
+def _payload(eid, state):
+    return {"entity_id": eid, "state": state, "attributes": {}, "last_changed": None}
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("report_states", [False, True])
+async def test_flush_ships_timeseries(supabase_mock, make_options, report_states):
+    rsps, calls = supabase_mock
+    def cb(request):
+        calls.append((request.url, json.loads(request.body)))
+        return (200, {}, json.dumps({}))
+    for rpc in ("sp_report_entity", "sp_report_timeseries"):
+        rsps.add_callback("POST", f"http://test-supabase.local/rest/v1/rpc/{rpc}", callback=cb, content_type="application/json")
+    r = HAOSReporter()
+    r.options_path = make_options({"history_mode": True, "history_report_states": report_states})
+    r.load_options()
+    for v in ("1", "2", "3"):
+        r.enqueue("sensor.p", _payload("sensor.p", v))
+    r.enqueue("sensor.q", _payload("sensor.q", "4"))
+    r.enqueue("sensor.q", _payload("sensor.q", "unavailable"))
+    await r.flush_buffer()
+    await r.close_session()
+    series = [b for url, b in calls if url.endswith("sp_report_timeseries")]
+    entities = [b for url, b in calls if url.endswith("sp_report_entity")]
+    assert len(series) == 1
+    assert series[0]["p_series"][0]["values"] == [1.0, 2.0, 3.0]
+    assert series[0]["p_series"][0]["max"] == 3.0
+    reported = sorted((b["p_entity"]["entity_id"], b["p_entity"]["state"]) for b in entities)
+    if report_states:
+        assert reported == [("sensor.p", "3"), ("sensor.q", "unavailable")]
+    else:
+        assert reported == [("sensor.q", "unavailable")]
+
+@pytest.mark.asyncio
+async def test_failed_window_kept_in_outbox(make_options, monkeypatch):
+    async def no_sleep(_):
+        return None
+    monkeypatch.setattr("asyncio.sleep", no_sleep)
+    r = HAOSReporter()
+    r.options_path = make_options({"history_mode": True})
+    r.load_options()
+    r.open_outbox()
+    sent = []
+    ok = {"value": False}
+    async def http_post(url, body):
+        sent.append(body)
+        return (200 if ok["value"] else 500), ""
+    r.http_post = http_post
+    r.enqueue("sensor.p", _payload("sensor.p", "5"))
+    await r.flush_buffer()
+    assert r.outbox.windows == 1
+    ok["value"] = True
+    (window_id, window), = r.outbox.take_windows(10)
+    r.outbox.remove_window(window_id)
+    assert await r.ship_window(window)
+    assert sent[-1]["p_series"][0]["last"] == 5.0
+    assert r.outbox.windows == 0
+    r.close_outbox()
@@ -0,0 +1,26 @@
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "bench"))
+
+import loadtest  # noqa: E402
+
+def test_check_regressions():
+    baseline = {"events_per_s": 1000, "latency_p95_ms": 200, "peak_rss_mb": 50}
+    ok = {"events_per_s": 900, "latency_p95_ms": 240, "peak_rss_mb": 55}
+    assert loadtest.check_regressions(ok, baseline, 0.25) == []
+    bad = {"events_per_s": 500, "latency_p95_ms": 400, "peak_rss_mb": 55}
+    failures = loadtest.check_regressions(bad, baseline, 0.25)
+    assert [f.split(":")[0] for f in failures] == ["events_per_s", "latency_p95_ms"]
+
+def test_load_smoke():
+    cfg = loadtest.LoadConfig(entities=300, rate=200, duration=1, update_interval=1, latency_ms=5, error_rate=0.34)
+    result = loadtest.run_load(cfg)
+    assert result["emitted_events"] > 100
+    assert result["messages_processed"] >= result["emitted_events"]
+    assert result["http_requests"] == sum(result["http_status"].values())
+    assert result["http_status"]["500"] >= 1
+    assert result["retries"] >= 1
+    assert result["latency_samples"] > 0
+    assert result["latency_p50_ms"] <= result["latency_p95_ms"] <= result["latency_max_ms"]
+    assert result["peak_rss_mb"] > 0
@@ -0,0 +1,76 @@
+import socket
+import aiohttp
+import pytest
+from haos_reporter_addon.app.main import HAOSReporter
+from haos_reporter_addon.app.metrics import MetricsRegistry, start_http_server
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def test_registry_renders_prometheus_text():
+    m = MetricsRegistry(prefix="t")
+    c = m.counter("requests_total", "Requests.", labels=("status",))
+    c.labels(200).inc()
+    c.labels(200).inc(2)
+    h = m.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    h.observe(0.05)
+    h.observe(0.5)
+    h.observe(3)
+    m.callback("depth", "Depth.", lambda: 7)
+    text = m.render()
+    assert '# TYPE t_requests_total counter' in text
+    assert 't_requests_total{status="200"} 3' in text
+    assert 't_latency_seconds_bucket{le="0.1"} 1' in text
+    assert 't_latency_seconds_bucket{le="1"} 2' in text
+    assert 't_latency_seconds_bucket{le="+Inf"} 3' in text
+    assert 't_latency_seconds_count 3' in text
+    assert 't_depth 7' in text
+
+def test_receiver_counters(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"entities": ["sensor.*"]})
+    r.load_options()
+    for eid in ("sensor.a", "light.b"):
+        r.handle_frame('{"id":1,"type":"event","event":{"event_type":"state_changed","data":{"entity_id":"%s","new_state":{"entity_id":"%s","state":"1"}}}}' % (eid, eid))
+    text = r.metrics.render()
+    assert 'nexdom_pulse_events_total{result="matched"} 1' in text
+    assert 'nexdom_pulse_events_total{result="prefiltered"} 1' in text
+    assert "nexdom_pulse_buffer_entities 1" in text
+
+@pytest.mark.asyncio
+async def test_supabase_status_and_retries(supabase_mock, make_options, monkeypatch):
+    rsps, calls = supabase_mock
+    def cb(request):
+        calls.append(1)
+        return (503 if len(calls) == 1 else 200, {}, "")
+    rsps.add_callback("POST", "http://test-supabase.local/rest/v1/rpc/sp_report_entity", callback=cb, content_type="application/json")
+    async def no_sleep(_):
+        return None
+    monkeypatch.setattr("asyncio.sleep", no_sleep)
+    r = HAOSReporter()
+    r.options_path = make_options()
+    r.load_options()
+    assert await r.post_supabase({"entity_id": "sensor.a", "state": "1"})
+    await r.close_session()
+    text = r.metrics.render()
+    assert 'nexdom_pulse_supabase_responses_total{status="503"} 1' in text
+    assert 'nexdom_pulse_supabase_responses_total{status="200"} 1' in text
+    assert 'nexdom_pulse_supabase_retries_total{rpc="sp_report_entity"} 1' in text
+    assert "nexdom_pulse_supabase_request_duration_seconds_count 2" in text
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint():
+    m = MetricsRegistry()
+    m.counter("hits_total", "Hits.").inc()
+    port = _free_port()
+    runner = await start_http_server(m, "127.0.0.1", port)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{port}/metrics") as resp:
+                assert resp.status == 200
+                assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+                assert "nexdom_pulse_hits_total 1" in await resp.text()
+    finally:
+        await runner.cleanup()
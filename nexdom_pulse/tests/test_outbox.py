@@ -0,0 +1,64 @@
+import json
+import pytest
+from haos_reporter_addon.app.main import HAOSReporter
+from haos_reporter_addon.app.outbox import Outbox
+
+def _payload(eid, state="1"):
+    return {"entity_id": eid, "state": state, "attributes": {}, "last_changed": "2025-02-02T12:30:00+00:00"}
+
+def test_outbox_last_wins_and_persistence(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    box = Outbox(path)
+    box.open()
+    box.put_many([_payload("sensor.a", "1"), _payload("sensor.b", "1")])
+    box.put_many([_payload("sensor.a", "2")])
+    assert box.count == 2
+    box.close()
+    box = Outbox(path)
+    box.open()
+    rows = {p["entity_id"]: p["state"] for p in box.take(10)}
+    assert rows == {"sensor.a": "2", "sensor.b": "1"}
+    box.remove(["sensor.a"])
+    assert box.count == 1
+    box.close()
+
+def test_outbox_evicts_oldest(tmp_path):
+    box = Outbox(str(tmp_path / "outbox.db"), max_entries=3)
+    box.open()
+    for i in range(5):
+        box.put_many([_payload(f"sensor.s{i}")])
+    assert box.count == 3
+    assert box.evicted == 2
+    assert [p["entity_id"] for p in box.take(10)] == ["sensor.s2", "sensor.s3", "sensor.s4"]
+    box.close()
+
+@pytest.mark.asyncio
+async def test_failed_payloads_go_to_outbox(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options()
+    r.load_options()
+    r.open_outbox()
+    state = {"fail": True}
+    async def deliver(payloads):
+        return list(payloads) if state["fail"] else []
+    r.deliver = deliver
+    await r.report([_payload("sensor.a"), _payload("sensor.b")])
+    assert r.outbox.count == 2
+    state["fail"] = False
+    await r.report(r.outbox.take(10))
+    assert r.outbox.count == 0
+    r.close_outbox()
+
+def test_outbox_evicts_to_byte_cap_in_one_pass(tmp_path):
+    box = Outbox(str(tmp_path / "outbox.db"))
+    box.open()
+    box.put_many([_payload(f"sensor.s{i}") for i in range(10)])
+    row = len(json.dumps(_payload("sensor.s0"), separators=(",", ":")))
+    box.max_bytes = row * 4
+    box.put_many([_payload("sensor.s3", "2")])
+    assert box.count == 4
+    assert box.size == sum(len(json.dumps(p, separators=(",", ":"))) for p in box.take(10))
+    assert [p["entity_id"] for p in box.take(10)] == ["sensor.s7", "sensor.s8", "sensor.s9", "sensor.s3"]
+    box.refresh_stats()
+    assert box.count == 4
+    box.close()
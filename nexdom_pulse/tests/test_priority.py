@@ -0,0 +1,92 @@
+import asyncio
+import json
+import pytest
+from haos_reporter_addon.app.main import HAOSReporter
+
+def _state(eid, state, attributes=None, last_changed="2025-02-02T12:31:00+00:00"):
+    return {"entity_id": eid, "state": state, "attributes": attributes or {}, "last_changed": last_changed}
+
+def _event(state):
+    return json.dumps({"id": 1, "type": "event", "event": {"event_type": "state_changed", "data": {"entity_id": state["entity_id"], "new_state": state}}})
+
+def _reporter(make_options, overrides=None):
+    r = HAOSReporter()
+    r.options_path = make_options(overrides)
+    r.load_options()
+    sent = []
+    async def deliver(payloads):
+        sent.extend(payloads)
+        return []
+    r.deliver = deliver
+    return r, sent
+
+async def _settle(r):
+    while r.urgent_tasks:
+        await asyncio.gather(*r.urgent_tasks.values())
+
+@pytest.mark.asyncio
+async def test_priority_entities_skip_the_buffer(make_options):
+    r, sent = _reporter(make_options)
+    r.handle_frame(_event(_state("lock.door", "unlocked")))
+    r.handle_frame(_event(_state("binary_sensor.kitchen_leak", "on", {"device_class": "moisture"})))
+    r.handle_frame(_event(_state("sensor.power", "120")))
+    await _settle(r)
+    assert sorted(p["entity_id"] for p in sent) == ["binary_sensor.kitchen_leak", "lock.door"]
+    assert list(r.changed_buffer) == ["sensor.power"]
+    assert "nexdom_pulse_priority_sent_total 2" in r.metrics.render()
+
+@pytest.mark.asyncio
+async def test_priority_can_be_disabled(make_options):
+    r, sent = _reporter(make_options, {"priority_entities": [], "priority_device_classes": []})
+    r.handle_frame(_event(_state("lock.door", "unlocked")))
+    assert sent == [] and list(r.changed_buffer) == ["lock.door"]
+
+@pytest.mark.asyncio
+async def test_priority_lane_not_starved_by_bulk(supabase_mock, make_options):
+    rsps, calls = supabase_mock
+    def cb(request):
+        calls.append(json.loads(request.body)["p_entity"]["entity_id"])
+        return (200, {}, "")
+    rsps.add_callback("POST", "http://test-supabase.local/rest/v1/rpc/sp_report_entity", callback=cb, content_type="application/json")
+    r = HAOSReporter()
+    r.options_path = make_options({"http_max_in_flight": 2})
+    r.load_options()
+    r.get_session()
+    for _ in range(2):
+        await r.http_semaphore.acquire()
+    async with r.flush_lock:
+        r.enqueue("alarm_control_panel.home", _state("alarm_control_panel.home", "triggered"))
+        await asyncio.wait_for(_settle(r), timeout=2)
+    await r.close_session()
+    assert calls == ["alarm_control_panel.home"]
+
+@pytest.mark.asyncio
+async def test_snapshot_does_not_replace_newer_priority_state(make_options):
+    r, sent = _reporter(make_options)
+    r.handle_frame(_event(_state("lock.door", "unlocked", last_changed="2025-02-02T12:31:00+00:00")))
+    r.load_snapshot([_state("lock.door", "locked", last_changed="2025-02-02T12:30:00+00:00")])
+    await _settle(r)
+    assert "lock.door" not in r.changed_buffer
+    assert [p["state"] for p in sent] == ["unlocked"]
+
+@pytest.mark.asyncio
+async def test_urgent_state_not_overwritten_by_snapshot(make_options):
+    r, sent = _reporter(make_options)
+    r.load_snapshot([_state("lock.door", "locked", last_changed="2025-02-02T12:30:00+00:00")])
+    r.handle_frame(_event(_state("lock.door", "unlocked", last_changed="2025-02-02T12:31:00+00:00")))
+    await _settle(r)
+    await r.flush_buffer()
+    assert [p["state"] for p in sent] == ["unlocked"]
+
+@pytest.mark.asyncio
+async def test_urgent_state_not_overwritten_by_buffered_event(make_options):
+    r, sent = _reporter(make_options, {"flush_max_bytes": 1 << 20})
+    r.handle_frame(_event(_state("binary_sensor.leak", "off", last_changed="2025-02-02T12:30:00+00:00")))
+    r.stage_flush()
+    r.handle_frame(_event(_state("binary_sensor.leak", "off", last_changed="2025-02-02T12:30:30+00:00")))
+    assert "binary_sensor.leak" in r.changed_buffer and "binary_sensor.leak" in r.supabase_pending
+    r.handle_frame(_event(_state("binary_sensor.leak", "on", {"device_class": "moisture"}, "2025-02-02T12:31:00+00:00")))
+    await _settle(r)
+    await r.flush_buffer()
+    assert [p["state"] for p in sent] == ["on"]
+    assert r.buffer_bytes == 0 and not r.buffer_sizes
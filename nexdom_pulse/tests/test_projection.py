@@ -0,0 +1,39 @@
+import json
+from haos_reporter_addon.app.main import HAOSReporter
+from haos_reporter_addon.app.projection import Projection
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+def test_allowlist_and_denylist_first_match_wins():
+    p = Projection([
+        {"pattern": "media_player.*", "include": ["friendly_name", "volume_*", "media_title"], "exclude": ["volume_muted"]},
+        {"pattern": "*", "exclude": ["entity_picture", "*_list"]},
+    ], dumps=_dumps)
+    attrs = {"friendly_name": "TV", "volume_level": 0.4, "volume_muted": False, "source_list": ["a", "b"], "media_title": "x"}
+    assert p.apply("media_player.tv", attrs) == {"friendly_name": "TV", "volume_level": 0.4, "media_title": "x"}
+    assert p.apply("sensor.t", {"unit": "W", "entity_picture": "/a.png", "effect_list": [1]}) == {"unit": "W"}
+    assert "source_list" in attrs
+    assert p.dropped_bytes > 0
+
+def test_value_size_cap():
+    p = Projection(max_value_bytes=16, dumps=_dumps)
+    attrs = {"short": "ok", "long": "x" * 40, "forecast": [{"t": i} for i in range(10)], "n": 3}
+    out = p.apply("weather.home", attrs)
+    assert out == {"short": "ok", "long": "x" * 16, "n": 3}
+    assert p.truncated_count == 2
+    assert p.dropped_bytes >= 24
+
+def test_build_payload_projection_and_metrics(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"attribute_rules": [{"pattern": "weather.*", "include": ["temperature"]}]})
+    r.load_options()
+    payload = r.build_payload({"entity_id": "weather.home", "state": "sunny", "attributes": {"temperature": 20, "forecast": [1, 2, 3]}})
+    assert payload["attributes"] == {"temperature": 20}
+    other = r.build_payload({"entity_id": "sensor.a", "state": "1", "attributes": {"forecast": [1]}})
+    assert other["attributes"] == {"forecast": [1]}
+    assert "nexdom_pulse_attribute_dropped_bytes_total 19" in r.metrics.render()
+
+def test_empty_include_is_not_an_allowlist():
+    p = Projection([{"pattern": "sensor.*", "include": [], "exclude": ["icon"]}], dumps=_dumps)
+    assert p.apply("sensor.t", {"unit": "W", "icon": "mdi:flash"}) == {"unit": "W"}
@@ -1,7 +1,6 @@
 import asyncio
 import json
 import pytest
-import responses
 from haos_reporter_addon.app.main import HAOSReporter
 
 @pytest.mark.asyncio
@@ -11,7 +10,7 @@ async def test_reporting_enabled_false(ws_test_server, supabase_mock, make_optio
         calls.append(request)
         return (200, {}, json.dumps({}))
     rsps.add_callback(
-        responses.POST,
+        "POST",
         "http://test-supabase.local/rest/v1/rpc/sp_report_entity",
         callback=cb,
         content_type="application/json",
@@ -35,7 +34,7 @@ async def test_update_interval_flush(ws_test_server, supabase_mock, make_options
         calls.append(request)
         return (200, {}, json.dumps({}))
     rsps.add_callback(
-        responses.POST,
+        "POST",
         "http://test-supabase.local/rest/v1/rpc/sp_report_entity",
         callback=cb,
         content_type="application/json",
@@ -50,7 +49,10 @@ async def test_update_interval_flush(ws_test_server, supabase_mock, make_options
     task.cancel()
     with pytest.raises(asyncio.CancelledError):
         await task
-    assert len(calls) >= 2
+    states = [json.loads(c.body)["p_entity"]["state"] for c in calls]
+    # The event arrives after subscribing and before get_states; it is newer than the snapshot entry
+    assert states and states[-1] == "23.0"
+    assert "22.5" not in states
 
 @pytest.mark.asyncio
 async def test_supabase_headers_and_body(ws_test_server, supabase_mock, make_options):
@@ -64,7 +66,7 @@ async def test_supabase_headers_and_body(ws_test_server, supabase_mock, make_opt
         calls.append(request)
         return (200, {}, json.dumps({}))
     rsps.add_callback(
-        responses.POST,
+        "POST",
         "http://test-supabase.local/rest/v1/rpc/sp_report_entity",
         callback=cb,
         content_type="application/json",
@@ -91,7 +93,7 @@ async def test_http_retry_on_500(supabase_mock, make_options):
             return (500, {}, json.dumps({}))
         return (200, {}, json.dumps({}))
     rsps.add_callback(
-        responses.POST,
+        "POST",
         "http://test-supabase.local/rest/v1/rpc/sp_report_entity",
         callback=cb,
         content_type="application/json",
@@ -107,4 +109,99 @@ async def test_http_retry_on_500(supabase_mock, make_options):
         "last_changed": "2025-02-02T12:30:00+00:00",
     }
     await r.post_supabase(payload)
-    assert attempts["n"] >= 3
\ No newline at end of file
+    await r.close_session()
+    assert attempts["n"] >= 3
+
+@pytest.mark.asyncio
+async def test_in_flight_limit(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"http_max_in_flight": 3})
+    r.load_options()
+    state = {"running": 0, "peak": 0}
+    async def work(i):
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        await asyncio.sleep(0.01)
+        state["running"] -= 1
+        return i
+    results = await r.run_limited(work, range(10))
+    assert sorted(results) == list(range(10))
+    assert state["peak"] == 3
+
+def test_snapshot_does_not_replace_newer_event(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options()
+    r.load_options()
+    r.changed_buffer["sensor.a"] = {"entity_id": "sensor.a", "state": "2", "attributes": {}, "last_changed": "2025-02-02T12:31:00+00:00"}
+    r.changed_buffer["sensor.b"] = {"entity_id": "sensor.b", "state": "1", "attributes": {}, "last_changed": "2025-02-02T12:29:00+00:00"}
+    r.load_snapshot([
+        {"entity_id": "sensor.a", "state": "1", "attributes": {}, "last_changed": "2025-02-02T12:30:00+00:00"},
+        {"entity_id": "sensor.b", "state": "2", "attributes": {}, "last_changed": "2025-02-02T12:30:00+00:00"},
+        {"entity_id": "sensor.c", "state": "3", "attributes": {}, "last_changed": "2025-02-02T12:30:00+00:00"},
+    ])
+    assert r.changed_buffer["sensor.a"]["state"] == "2"
+    assert r.changed_buffer["sensor.b"]["state"] == "2"
+    assert r.changed_buffer["sensor.c"]["state"] == "3"
+
+@pytest.mark.asyncio
+async def test_subscribe_entities_mode(ws_test_server, supabase_mock, make_options):
+    rsps, calls = supabase_mock
+    def cb(request):
+        calls.append(json.loads(request.body)["p_entity"])
+        return (200, {}, json.dumps({}))
+    rsps.add_callback(
+        "POST",
+        "http://test-supabase.local/rest/v1/rpc/sp_report_entity",
+        callback=cb,
+        content_type="application/json",
+    )
+    r = HAOSReporter()
+    r.options_path = make_options({"update_interval": 1, "entities": ["sensor.temp"], "event_source": "subscribe_entities"})
+    r.load_options()
+    r.supervisor_token = "t"
+    r.ws_url = ws_test_server
+    task = asyncio.create_task(r.run())
+    await asyncio.sleep(2)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert calls
+    assert calls[-1]["entity_id"] == "sensor.temp"
+    assert calls[-1]["state"] == "23.0"
+    assert calls[-1]["attributes"] == {"unit_of_measurement": "°C"}
+    assert calls[-1]["last_changed"] == "2025-02-02T12:31:00+00:00"
+    assert "light.sala" not in r.entity_mirror
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("coalesce", [True, False])
+@pytest.mark.parametrize("event_source", ["state_changed", "subscribe_entities"])
+async def test_coalesced_messages(ws_test_server, supabase_mock, make_options, monkeypatch, coalesce, event_source):
+    monkeypatch.setenv("SUPERVISOR_TOKEN", "t")
+    rsps, calls = supabase_mock
+    def cb(request):
+        calls.append(json.loads(request.body)["p_entity"])
+        return (200, {}, json.dumps({}))
+    rsps.add_callback(
+        "POST",
+        "http://test-supabase.local/rest/v1/rpc/sp_report_entity",
+        callback=cb,
+        content_type="application/json",
+    )
+    r = HAOSReporter()
+    r.options_path = make_options({
+        "update_interval": 1, "entities": ["sensor.temp"], "event_source": event_source, "coalesce_messages": coalesce,
+    })
+    r.load_options()
+    r.supervisor_token = "t"
+    r.ws_url = ws_test_server
+    task = asyncio.create_task(r.run())
+    await asyncio.sleep(2)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert calls and calls[-1]["state"] == "23.0"
+    assert "22.5" not in [c["state"] for c in calls]
+    if coalesce:
+        assert r.m_messages.value > r.m_frames.value
+    else:
+        assert r.m_messages.value == r.m_frames.value
@@ -0,0 +1,65 @@
+import pytest
+from haos_reporter_addon.app.main import HAOSReporter
+
+def _state(entity_id, state):
+    return {
+        "entity_id": entity_id,
+        "state": state,
+        "attributes": {},
+        "last_changed": "2025-02-02T12:30:00+00:00",
+    }
+
+def _reporter(make_options, overrides=None):
+    r = HAOSReporter()
+    r.options_path = make_options(overrides)
+    r.load_options()
+    sent = []
+    async def deliver(payloads):
+        sent.extend(payloads)
+        return []
+    r.deliver = deliver
+    return r, sent
+
+@pytest.mark.asyncio
+async def test_state_cache_survives_restart(make_options):
+    r, sent = _reporter(make_options)
+    r.open_state_cache()
+    await r.report([r.build_payload(_state("sensor.a", "1")), r.build_payload(_state("sensor.b", "2"))])
+    r.save_state_cache(force=True)
+    age = r.reported_at["sensor.a"]
+
+    r2, sent2 = _reporter(make_options)
+    r2.open_state_cache()
+    assert r2.reported_digests == r.reported_digests
+    assert r2.reported_at["sensor.a"] == pytest.approx(age, abs=0.5)
+    await r2.report([r2.build_payload(_state("sensor.a", "1"))])
+    assert sent2 == []
+
+@pytest.mark.asyncio
+async def test_resync_sends_changed_and_removed_only(make_options):
+    r, sent = _reporter(make_options, {"entities": ["sensor.*"]})
+    await r.report([r.build_payload(_state(eid, "1")) for eid in ("sensor.same", "sensor.changed", "sensor.gone")])
+    r.reported_digests["switch.filtered"] = "x"
+    sent.clear()
+
+    states = [_state("sensor.same", "1"), _state("sensor.changed", "2"), _state("sensor.new", "1")]
+    r.load_snapshot(states)
+    assert r.queue_removed(s["entity_id"] for s in states) == 1
+    await r.flush_buffer()
+
+    by_id = {p["entity_id"]: p for p in sent}
+    assert set(by_id) == {"sensor.changed", "sensor.new", "sensor.gone"}
+    assert by_id["sensor.gone"]["removed"] is True
+    assert by_id["sensor.gone"]["state"] is None
+    assert "sensor.gone" not in r.reported_digests
+    assert "switch.filtered" not in r.reported_digests
+
+@pytest.mark.asyncio
+async def test_removed_event_reported(make_options):
+    r, sent = _reporter(make_options)
+    r.handle_frame('{"id":1,"type":"event","event":{"event_type":"state_changed","data":{"entity_id":"light.sala","old_state":{"entity_id":"light.sala","state":"on"},"new_state":null}}}')
+    assert r.changed_buffer["light.sala"]["removed"] is True
+
+    r2, _ = _reporter(make_options, {"report_removed": False})
+    r2.handle_frame('{"id":1,"type":"event","event":{"event_type":"state_changed","data":{"entity_id":"light.sala","old_state":{"entity_id":"light.sala","state":"on"},"new_state":null}}}')
+    assert r2.changed_buffer == {}
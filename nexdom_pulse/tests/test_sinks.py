@@ -0,0 +1,160 @@
+import asyncio
+import json
+import struct
+import pytest
+from haos_reporter_addon.app.main import HAOSReporter
+from haos_reporter_addon.app.sinks import FileSink, MqttSink, Sink, WebhookSink
+
+def _payload(eid, state="1"):
+    return {"entity_id": eid, "state": state, "attributes": {}, "last_changed": "2025-02-02T12:30:00+00:00"}
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+async def _wait_sent(sink, count):
+    for _ in range(200):
+        if sink.sent >= count:
+            return
+        await asyncio.sleep(0.01)
+
+def _reporter(make_options, overrides=None):
+    r = HAOSReporter()
+    r.options_path = make_options(overrides)
+    r.load_options()
+    sent = []
+    async def deliver(payloads):
+        sent.extend(payloads)
+        return []
+    r.deliver = deliver
+    return r, sent
+
+@pytest.mark.asyncio
+async def test_file_sink_filters_and_writes_jsonl(tmp_path):
+    path = tmp_path / "out" / "states.jsonl"
+    sink = FileSink({"type": "file", "path": str(path), "entities": ["sensor.*", "!sensor.*_rssi"]}, dumps=_dumps)
+    sink.start()
+    sink.offer([_payload("sensor.a"), _payload("sensor.a_rssi"), _payload("light.b")])
+    await _wait_sent(sink, 1)
+    await sink.stop()
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [p["entity_id"] for p in lines] == ["sensor.a"]
+    assert sink.sent == 1
+
+@pytest.mark.asyncio
+async def test_mqtt_sink_publishes_to_local_broker():
+    packets = []
+    async def broker(reader, writer):
+        while True:
+            try:
+                header = await reader.readexactly(1)
+            except asyncio.IncompleteReadError:
+                return
+            length, shift = 0, 0
+            while True:
+                b = (await reader.readexactly(1))[0]
+                length |= (b & 0x7F) << shift
+                shift += 7
+                if not b & 0x80:
+                    break
+            body = await reader.readexactly(length)
+            packets.append((header[0], body))
+            if header[0] == 0x10:
+                writer.write(b"\x20\x02\x00\x00")
+                await writer.drain()
+    server = await asyncio.start_server(broker, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    sink = MqttSink({"type": "mqtt", "port": port, "host": "127.0.0.1", "topic_prefix": "casa", "username": "u", "password": "p"},
+                    client_id="c1", dumps=_dumps)
+    await sink.send([_payload("sensor.a", "x" * 200), _payload("light.b")])
+    await sink.stop()
+    server.close()
+    await server.wait_closed()
+    assert packets[0][0] == 0x10 and packets[0][1][:6] == b"\x00\x04MQTT"
+    publishes = []
+    for kind, body in packets[1:]:
+        assert kind == 0x30
+        (n,) = struct.unpack("!H", body[:2])
+        publishes.append((body[2:2 + n].decode(), json.loads(body[2 + n:])))
+    assert [t for t, _ in publishes] == ["casa/sensor.a", "casa/light.b"]
+    assert publishes[0][1]["state"] == "x" * 200
+
+@pytest.mark.asyncio
+async def test_webhook_sink_retries(supabase_mock, make_options, monkeypatch):
+    rsps, calls = supabase_mock
+    def cb(request):
+        assert request.headers["X-Key"] == "k"
+        calls.append(json.loads(request.body))
+        return (500 if len(calls) == 1 else 200, {}, "")
+    rsps.add_callback("POST", "http://hooks.local/ingest", callback=cb, content_type="application/json")
+    async def no_sleep(_):
+        return None
+    monkeypatch.setattr("asyncio.sleep", no_sleep)
+    r, _ = _reporter(make_options, {"sinks": [{"type": "webhook", "url": "http://hooks.local/ingest", "headers": ["X-Key: k"]}]})
+    sink = r.sinks[0]
+    assert isinstance(sink, WebhookSink)
+    assert await sink.send_with_retry([_payload("sensor.a")])
+    await r.close_session()
+    assert len(calls) == 2
+    assert calls[1] == {"client_id": r.client_id, "entities": [_payload("sensor.a")]}
+
+class _StuckSink(Sink):
+    kind = "stuck"
+
+    async def send(self, batch):
+        await asyncio.Event().wait()
+
+@pytest.mark.asyncio
+async def test_slow_sink_does_not_stall_flush(make_options, tmp_path):
+    r, sent = _reporter(make_options, {"sinks": [
+        {"type": "supabase", "entities": ["sensor.*"]},
+        {"type": "file", "path": str(tmp_path / "all.jsonl")},
+    ]})
+    stuck = _StuckSink({"max_queue": 2, "batch_size": 1})
+    r.sinks.append(stuck)
+    for sink in r.sinks:
+        sink.start()
+    for eid in ("sensor.a", "light.b", "switch.c", "sensor.d"):
+        r.enqueue(eid, _payload(eid))
+    await asyncio.wait_for(r.flush_buffer(), timeout=1)
+    await _wait_sent(r.sinks[0], 4)
+    for sink in r.sinks:
+        await sink.stop()
+    assert [p["entity_id"] for p in sent] == ["sensor.a", "sensor.d"]
+    assert len((tmp_path / "all.jsonl").read_text().splitlines()) == 4
+    assert stuck.dropped == 2
+    assert len(stuck.queue) == 1
+    assert 'nexdom_pulse_sink_dropped_total{sink="stuck"} 2' in r.metrics.render()
+
+def test_unknown_sink_type(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"sinks": [{"type": "kafka"}]})
+    with pytest.raises(ValueError):
+        r.load_options()
+
+@pytest.mark.asyncio
+async def test_slow_supabase_does_not_stall_sinks(make_options, tmp_path):
+    r = HAOSReporter()
+    r.options_path = make_options({"update_interval": 60, "flush_min_gap": 0, "flush_jitter": 0, "flush_max_entries": 1,
+                                   "sinks": [{"type": "file", "path": str(tmp_path / "all.jsonl")}]})
+    r.load_options()
+    gate = asyncio.Event()
+    sent = []
+    async def deliver(payloads):
+        await gate.wait()
+        sent.append([p["entity_id"] for p in payloads])
+        return []
+    r.deliver = deliver
+    r.sinks[0].start()
+    task = asyncio.create_task(r.periodic_flush())
+    for eid in ("sensor.a", "sensor.b", "sensor.c"):
+        r.enqueue(eid, _payload(eid))
+        await asyncio.sleep(0.05)
+    await _wait_sent(r.sinks[0], 3)
+    assert r.sinks[0].sent == 3
+    assert sent == [] and list(r.supabase_pending) == ["sensor.b", "sensor.c"]
+    gate.set()
+    await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await r.sinks[0].stop()
+    assert sent == [["sensor.a"], ["sensor.b", "sensor.c"]]
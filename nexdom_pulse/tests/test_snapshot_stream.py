@@ -0,0 +1,82 @@
+import asyncio
+import json
+import pytest
+from haos_reporter_addon.app.codec import iter_array
+from haos_reporter_addon.app.main import HAOSReporter
+
+def _state(eid, state, last_changed="2025-02-02T12:30:00+00:00"):
+    return {"entity_id": eid, "state": state, "attributes": {"note": "x" * 50}, "last_changed": last_changed}
+
+def _reporter(make_options, overrides=None):
+    r = HAOSReporter()
+    r.options_path = make_options(overrides)
+    r.load_options()
+    flushes = []
+    async def deliver(payloads):
+        flushes.append([p["entity_id"] for p in payloads])
+        return []
+    r.deliver = deliver
+    return r, flushes
+
+class _FakeWS:
+    def __init__(self, reporter, states):
+        self.reporter = reporter
+        self.states = states
+
+    async def send(self, message):
+        req = json.loads(message)
+        frame = json.dumps({"id": req["id"], "type": "result", "success": True, "result": self.states})
+        asyncio.get_running_loop().call_soon(self.reporter.handle_frame, frame)
+
+def test_iter_array():
+    text = '{"result": [ {"a": [1, 2]}, "x,]" ,3 ]}'
+    assert list(iter_array(text, text.index("[") + 1)) == [{"a": [1, 2]}, "x,]", 3]
+    assert list(iter_array("[ ]", 1)) == []
+
+@pytest.mark.asyncio
+async def test_snapshot_streamed_in_chunks(make_options):
+    r, flushes = _reporter(make_options, {"entities": ["sensor.*"], "snapshot_chunk": 300, "attribute_max_bytes": 10})
+    states = [_state(f"sensor.s{i}", "1") for i in range(1000)] + [_state("light.x", "on")]
+    ids = await r.request_get_states(_FakeWS(r, states))
+    assert len(ids) == 1000 and "light.x" not in ids
+    assert len(flushes) == 3 and all(len(f) == 300 for f in flushes)
+    assert len(r.changed_buffer) == 100
+    assert r.changed_buffer["sensor.s999"]["attributes"]["note"] == "x" * 10
+    assert r.pending_requests == {} and r.raw_requests == set()
+
+@pytest.mark.asyncio
+async def test_live_event_wins_over_streamed_snapshot(make_options):
+    r, flushes = _reporter(make_options, {"snapshot_chunk": 1})
+    states = [_state(f"sensor.s{i}", "1") for i in range(200)] + [_state("sensor.a", "old")]
+    ws = _FakeWS(r, states)
+    event = _state("sensor.a", "new", "2025-02-02T12:31:00+00:00")
+    asyncio.get_running_loop().call_soon(r.handle_frame, json.dumps(
+        {"id": 1, "type": "event", "event": {"event_type": "state_changed", "data": {"entity_id": "sensor.a", "new_state": event}}}))
+    await r.request_get_states(ws)
+    assert "sensor.a" in flushes[0]
+    assert "sensor.a" not in r.changed_buffer
+    assert r.snapshot_live is None
+
+@pytest.mark.asyncio
+async def test_get_states_error(make_options):
+    r, _ = _reporter(make_options)
+    class _ErrorWS:
+        async def send(self, message):
+            req = json.loads(message)
+            frame = json.dumps({"id": req["id"], "type": "result", "success": False, "error": {"code": "unknown"}})
+            asyncio.get_running_loop().call_soon(r.handle_frame, frame)
+    with pytest.raises(RuntimeError):
+        await r.request_get_states(_ErrorWS())
+
+@pytest.mark.asyncio
+async def test_entity_created_during_snapshot_not_removed(make_options):
+    r, flushes = _reporter(make_options, {"snapshot_chunk": 1})
+    states = [_state(f"sensor.s{i}", "1") for i in range(200)]
+    event = _state("sensor.new", "1", "2025-02-02T12:31:00+00:00")
+    asyncio.get_running_loop().call_soon(r.handle_frame, json.dumps(
+        {"id": 1, "type": "event", "event": {"event_type": "state_changed", "data": {"entity_id": "sensor.new", "new_state": event}}}))
+    present = await r.request_get_states(_FakeWS(r, states))
+    assert "sensor.new" not in present and "sensor.new" in r.reported_digests
+    assert r.queue_removed(present) == 0
+    assert r.snapshot_seen is None
+    assert "sensor.new" not in r.changed_buffer
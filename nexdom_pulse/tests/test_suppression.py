@@ -0,0 +1,60 @@
+import pytest
+from haos_reporter_addon.app.main import HAOSReporter
+
+def _payload(state, attributes=None, last_changed="2025-02-02T12:30:00+00:00"):
+    return {
+        "entity_id": "sensor.temp",
+        "state": state,
+        "attributes": attributes or {},
+        "last_changed": last_changed,
+    }
+
+def _reporter(make_options, overrides=None):
+    r = HAOSReporter()
+    r.options_path = make_options(overrides)
+    r.load_options()
+    sent = []
+    async def deliver(payloads):
+        sent.extend(payloads)
+        return []
+    r.deliver = deliver
+    return r, sent
+
+@pytest.mark.asyncio
+async def test_identical_payload_suppressed(make_options):
+    r, sent = _reporter(make_options)
+    await r.report([_payload("22.5", {"unit_of_measurement": "°C"})])
+    await r.report([_payload("22.5", {"unit_of_measurement": "°C"}, "2025-02-02T12:31:00+00:00")])
+    await r.report([_payload("23.0", {"unit_of_measurement": "°C"})])
+    assert [p["state"] for p in sent] == ["22.5", "23.0"]
+    assert r.suppressed_count == 1
+
+@pytest.mark.asyncio
+async def test_failed_payload_not_recorded(make_options):
+    r, sent = _reporter(make_options)
+    async def failing(payloads):
+        sent.extend(payloads)
+        return list(payloads)
+    r.deliver = failing
+    await r.report([_payload("22.5")])
+    await r.report([_payload("22.5")])
+    assert len(sent) == 2
+    assert r.suppressed_count == 0
+
+@pytest.mark.asyncio
+async def test_full_refresh_after_interval(make_options):
+    r, sent = _reporter(make_options)
+    await r.report([_payload("22.5")])
+    r.reported_at["sensor.temp"] -= r.full_refresh_interval
+    await r.report([_payload("22.5")])
+    assert len(sent) == 2
+
+@pytest.mark.asyncio
+async def test_attribute_delta(make_options):
+    r, sent = _reporter(make_options, {"attribute_delta": True})
+    await r.report([_payload("on", {"brightness": 10, "color": "red", "effect": "none"})])
+    await r.report([_payload("on", {"brightness": 20, "color": "red"})])
+    assert "attributes_delta" not in sent[0]
+    assert sent[1]["attributes_delta"] is True
+    assert sent[1]["attributes"] == {"brightness": 20}
+    assert sent[1]["removed_attributes"] == ["effect"]
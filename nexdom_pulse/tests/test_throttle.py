@@ -0,0 +1,51 @@
+from haos_reporter_addon.app.main import HAOSReporter
+from haos_reporter_addon.app.throttle import Throttle
+
+def _payload(eid, state):
+    return {"entity_id": eid, "state": state, "attributes": {}, "last_changed": "2025-02-02T12:30:00+00:00"}
+
+def test_min_interval_holds_and_releases_latest():
+    t = Throttle([{"pattern": "sensor.*_power", "min_interval": 10}])
+    assert t.admit("sensor.a_power", _payload("sensor.a_power", "1"), now=0)
+    assert not t.admit("sensor.a_power", _payload("sensor.a_power", "2"), now=3)
+    assert not t.admit("sensor.a_power", _payload("sensor.a_power", "3"), now=6)
+    assert t.release(now=8) == []
+    assert [p["state"] for p in t.release(now=10)] == ["3"]
+    assert t.held == {}
+    assert t.admit("sensor.other", _payload("sensor.other", "1"), now=11)
+
+def test_absolute_deadband_and_max_age():
+    t = Throttle([{"pattern": "sensor.temp", "deadband": 0.5, "max_age": 300}])
+    assert t.admit("sensor.temp", _payload("sensor.temp", "20.0"), now=0)
+    assert not t.admit("sensor.temp", _payload("sensor.temp", "20.3"), now=5)
+    assert not t.admit("sensor.temp", _payload("sensor.temp", "19.6"), now=10)
+    assert t.admit("sensor.temp", _payload("sensor.temp", "20.6"), now=15)
+    assert not t.admit("sensor.temp", _payload("sensor.temp", "20.7"), now=20)
+    assert [p["state"] for p in t.release(now=315)] == ["20.7"]
+    assert t.admit("sensor.temp", _payload("sensor.temp", "unavailable"), now=316)
+
+def test_percent_deadband():
+    t = Throttle([{"pattern": "sensor.*", "deadband_pct": 5}])
+    assert t.admit("sensor.p", _payload("sensor.p", "200"), now=0)
+    assert not t.admit("sensor.p", _payload("sensor.p", "209"), now=1)
+    assert t.admit("sensor.p", _payload("sensor.p", "211"), now=2)
+
+def test_reporter_applies_rules(make_options):
+    r = HAOSReporter()
+    r.options_path = make_options({"reporting_rules": [{"pattern": "sensor.*", "min_interval": 60}]})
+    r.load_options()
+    r.enqueue("sensor.a", _payload("sensor.a", "1"))
+    r.changed_buffer.clear()
+    r.enqueue("sensor.a", _payload("sensor.a", "2"))
+    r.enqueue("light.sala", _payload("light.sala", "on"))
+    assert list(r.changed_buffer) == ["light.sala"]
+    assert r.throttle.held["sensor.a"]["state"] == "2"
+
+def test_rule_cache_first_match_and_bounded():
+    t = Throttle([{"pattern": "sensor.temp", "min_interval": 5}, {"pattern": "sensor.*", "min_interval": 10}])
+    t.CACHE_SIZE = 3
+    assert t.rule_for("sensor.temp").min_interval == 5
+    assert t.rule_for("sensor.other").min_interval == 10
+    assert t.rule_for("light.sala") is None
+    t.rule_for("sensor.x")
+    assert list(t.rule_cache) == ["sensor.other", "light.sala", "sensor.x"]